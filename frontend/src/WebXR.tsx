@@ -4,9 +4,17 @@ import { handleTracking, handleControllerInput} from './lib/tracking';
 import { cleanUpScene, 
   createStatusCanvas, createVideoPlane, updateVideoTexture, 
   getDistanceColor, updateMeshColor, initThreeScene } from './lib/three-scene';
-import { loadURDFRobot, updateURDF } from './lib/urdf';
+import { loadURDFRobot, updateURDF, enableServerLinkPoses, applyLinkPoses } from './lib/urdf';
+import { decodeBinaryFeedback } from './lib/feedback';
 import { updateSTLPositions, loadSTLModelsWithFallback } from './lib/stl';
-import { SceneState, DEFAULT_SCENE_STATE, ForwardKinematicsMessage } from './lib/types';
+import { SceneState, DEFAULT_SCENE_STATE, ForwardKinematicsMessage, ServerStatusMessage, ClockPingMessage, LinkLayoutMessage } from './lib/types';
+
+// Place the robot overlay from server-computed link poses instead of joint angles + local kinematics
+const SERVER_LINK_POSES = true;
+// Ask for the compact binary kinematics feedback (lib/feedback.ts) instead of JSON
+const BINARY_FEEDBACK = true;
+// Seconds between overlay timing reports in the console
+const OVERLAY_TIMING_INTERVAL = 5;
 
 interface VRViewerProps {
   stream: MediaStream | null;
@@ -29,6 +37,19 @@ export default function VRViewer({ stream, url, udpHost }: VRViewerProps) {
   
   // Single state object for all scene-related refs
   const sceneStateRef = useRef<SceneState>(DEFAULT_SCENE_STATE);
+  // Time spent updating the robot overlay and rendering, and feedback bytes received, since the last report
+  const overlayTimingRef = useRef({ updateMs: 0, updates: 0, renderMs: 0, frames: 0, bytes: 0, since: performance.now() });
+
+  const reportOverlayTiming = () => {
+    const timing = overlayTimingRef.current;
+    const elapsed = (performance.now() - timing.since) / 1000;
+    if (elapsed < OVERLAY_TIMING_INTERVAL) return;
+    console.log(`Overlay (${SERVER_LINK_POSES ? 'server link poses' : 'local FK'}): ` +
+      `update ${(timing.updateMs / Math.max(timing.updates, 1)).toFixed(3)} ms x ${timing.updates}, ` +
+      `render ${(timing.renderMs / Math.max(timing.frames, 1)).toFixed(2)} ms/frame, ` +
+      `feedback ${(timing.bytes / elapsed / 1024).toFixed(1)} KiB/s`);
+    overlayTimingRef.current = { updateMs: 0, updates: 0, renderMs: 0, frames: 0, bytes: 0, since: performance.now() };
+  };
 
   useEffect(() => {
     if (videoRef.current && stream) {
@@ -207,7 +228,11 @@ export default function VRViewer({ stream, url, udpHost }: VRViewerProps) {
           setPauseCommands(sceneStateRef.current.pauseCommands);
         }
       }
+      const renderStart = performance.now();
       renderer.render(sceneStateRef.current.scene, camera);
+      overlayTimingRef.current.renderMs += performance.now() - renderStart;
+      overlayTimingRef.current.frames += 1;
+      reportOverlayTiming();
     });
   };
 
@@ -215,50 +240,101 @@ export default function VRViewer({ stream, url, udpHost }: VRViewerProps) {
     return new Promise((resolve, reject) => {
       try {
         let webSocket = new WebSocket(url);
+        webSocket.binaryType = 'arraybuffer';
 
         webSocket.onopen = () => {
           webSocket.send(JSON.stringify({
             role: "teleop",
             robot_ip: udpHost,
           }));
+          if (SERVER_LINK_POSES || BINARY_FEEDBACK) {
+            webSocket.send(JSON.stringify({
+              type: "feedback_config",
+              links: SERVER_LINK_POSES,
+              format: BINARY_FEEDBACK ? "binary" : "json",
+            }));
+          }
           wsRef.current = webSocket;
           setStatus('Hand tracking WebSocket connected');
           resolve(true);
         };
 
-        webSocket.onmessage = (event) => {
-          const data: ForwardKinematicsMessage= JSON.parse(event.data);
-          if (data.type === "kinematics") {
-            // Process left and right joint arrays
-            if(data.joints) {
-              if (data.joints.left && Array.isArray(data.joints.left)) {
-                updateURDF('left', data.joints.left, sceneStateRef.current);
-              }
-
-              if (data.joints.right && Array.isArray(data.joints.right)) {
-                updateURDF('right', data.joints.right, sceneStateRef.current);
-              }
+        const handleKinematics = (data: ForwardKinematicsMessage) => {
+          // Process left and right joint arrays (the overlay follows link poses instead once they arrive)
+          if(data.joints && !sceneStateRef.current.linkPoseTargets) {
+            const updateStart = performance.now();
+            if (data.joints.left && Array.isArray(data.joints.left)) {
+              updateURDF('left', data.joints.left, sceneStateRef.current);
+            }
+
+            if (data.joints.right && Array.isArray(data.joints.right)) {
+              updateURDF('right', data.joints.right, sceneStateRef.current);
+            }
+            overlayTimingRef.current.updateMs += performance.now() - updateStart;
+            overlayTimingRef.current.updates += 1;
+          }
+          
+          // Process distance data for STL mesh color updates
+          if(data.distances) {              
+            // Update left hand mesh color based on its own distance (green to red spectrum)
+            if (data.distances.left !== undefined && sceneStateRef.current.leftHandMesh) {
+              const leftDistance = data.distances.left;
+              const leftColor = getDistanceColor(leftDistance);
+              updateMeshColor(sceneStateRef.current.leftHandMesh, leftColor, 'LEFT', sceneStateRef.current.lastLeftColorRef, sceneStateRef.current);
             }
             
-            // Process distance data for STL mesh color updates
-            if(data.distances) {              
-              // Update left hand mesh color based on its own distance (green to red spectrum)
-              if (data.distances.left !== undefined && sceneStateRef.current.leftHandMesh) {
-                const leftDistance = data.distances.left;
-                const leftColor = getDistanceColor(leftDistance);
-                updateMeshColor(sceneStateRef.current.leftHandMesh, leftColor, 'LEFT', sceneStateRef.current.lastLeftColorRef, sceneStateRef.current);
-              }
-              
-              // Update right hand mesh color based on its own distance (green to red spectrum)
-              if (data.distances.right !== undefined && sceneStateRef.current.rightHandMesh) {
-                const rightDistance = data.distances.right;
-                const rightColor = getDistanceColor(rightDistance);
-                updateMeshColor(sceneStateRef.current.rightHandMesh, rightColor, 'RIGHT', sceneStateRef.current.lastRightColorRef, sceneStateRef.current);
-              }
+            // Update right hand mesh color based on its own distance (green to red spectrum)
+            if (data.distances.right !== undefined && sceneStateRef.current.rightHandMesh) {
+              const rightDistance = data.distances.right;
+              const rightColor = getDistanceColor(rightDistance);
+              updateMeshColor(sceneStateRef.current.rightHandMesh, rightColor, 'RIGHT', sceneStateRef.current.lastRightColorRef, sceneStateRef.current);
             }
           }
         };
 
+        webSocket.onmessage = (event) => {
+          if (event.data instanceof ArrayBuffer) {
+            overlayTimingRef.current.bytes += event.data.byteLength;
+            // Binary frames are kinematics feedback or link poses, told apart by their magic byte
+            const feedback = decodeBinaryFeedback(event.data);
+            if (feedback) {
+              handleKinematics(feedback);
+              return;
+            }
+            const updateStart = performance.now();
+            if (applyLinkPoses(sceneStateRef.current, event.data)) {
+              overlayTimingRef.current.updateMs += performance.now() - updateStart;
+              overlayTimingRef.current.updates += 1;
+            }
+            return;
+          }
+          overlayTimingRef.current.bytes += event.data.length;
+          const data: ForwardKinematicsMessage | ServerStatusMessage | ClockPingMessage | LinkLayoutMessage = JSON.parse(event.data);
+          if (data.type === "link_layout") {
+            enableServerLinkPoses(sceneStateRef.current, data.links);
+            return;
+          }
+          if (data.type === "clock_ping") {
+            // Answer immediately with our clock so the server can estimate the offset
+            webSocket.send(JSON.stringify({ type: "clock_pong", t0: data.t0, t1: performance.now() }));
+            return;
+          }
+          if (data.type === "status") {
+            // The server builds its IK solver in the background and reports progress until ready
+            if (data.status === "warming_up") {
+              setStatus(`Teleop server warming up (${data.stage}, ${Math.round((data.progress ?? 0) * 100)}%)`);
+            } else if (data.status === "ready") {
+              setStatus('Hand tracking WebSocket connected');
+            } else {
+              setStatus(`Teleop server error: ${data.error}`);
+            }
+            return;
+          }
+          if (data.type === "kinematics") {
+            handleKinematics(data);
+          }
+        };
+
         webSocket.onerror = (error) => {
           resolve(false);
           setStatus('Hand tracking WebSocket error');
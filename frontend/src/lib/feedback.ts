@@ -0,0 +1,57 @@
+import { ForwardKinematicsMessage } from './types';
+
+// Binary kinematics feedback from the server (kscale_vr_teleop/kinematics_feedback.py):
+// magic 'K' (uint8), field bitmask (uint8), pad, seq (uint32), ack (uint32, NO_ACK if none),
+// then float32 values of the fields whose bit is set, in FEEDBACK_FIELDS order
+const FEEDBACK_MAGIC = 0x4B;
+const FEEDBACK_HEADER_BYTES = 12;
+const NO_ACK = 0xFFFFFFFF;
+const FEEDBACK_FIELDS: [group: 'joints' | 'joysticks' | 'distances' | 'reach_offsets', side: 'right' | 'left', size: number][] = [
+  ['joints', 'right', 5],
+  ['joints', 'left', 5],
+  ['joysticks', 'right', 2],
+  ['joysticks', 'left', 2],
+  ['distances', 'right', 1],
+  ['distances', 'left', 1],
+  ['reach_offsets', 'right', 1],
+  ['reach_offsets', 'left', 1],
+];
+
+export const isBinaryFeedback = (buffer: ArrayBuffer): boolean =>
+  buffer.byteLength >= FEEDBACK_HEADER_BYTES && new DataView(buffer).getUint8(0) === FEEDBACK_MAGIC;
+
+// Decodes a binary feedback frame into the same shape as the JSON "kinematics" message
+// (fields that did not change since the last frame are absent, as in the JSON form)
+export const decodeBinaryFeedback = (buffer: ArrayBuffer): ForwardKinematicsMessage | null => {
+  if (!isBinaryFeedback(buffer)) {
+    return null;
+  }
+  const header = new DataView(buffer);
+  const mask = header.getUint8(1);
+  const ack = header.getUint32(8, true);
+  const message: ForwardKinematicsMessage = { type: "kinematics", seq: header.getUint32(4, true) };
+  if (ack !== NO_ACK) {
+    message.ack = ack;
+  }
+  // The header is 12 bytes, so the floats are viewed in place without copying
+  const values = new Float32Array(buffer, FEEDBACK_HEADER_BYTES, (buffer.byteLength - FEEDBACK_HEADER_BYTES) / 4);
+  let offset = 0;
+  FEEDBACK_FIELDS.forEach(([group, side, size], bit) => {
+    // Absent fields, or a frame cut short
+    if (!(mask & (1 << bit)) || offset + size > values.length) {
+      return;
+    }
+    if (group === 'joints') {
+      message.joints = message.joints || {};
+      message.joints[side] = Array.from(values.subarray(offset, offset + size));
+    } else if (group === 'joysticks') {
+      message.joysticks = message.joysticks || {};
+      message.joysticks[side] = { x: values[offset], y: values[offset + 1] };
+    } else {
+      message[group] = message[group] || {};
+      message[group][side] = values[offset];
+    }
+    offset += size;
+  });
+  return message;
+};
@@ -125,10 +125,12 @@ export function handleTracking(frame, referenceSpace, wsRef, lastHandSendRef, pa
     return null;
   }
 
+  const captureTime = performance.now();
   let response = handleHandTracking(frame, referenceSpace);
   if(response.left == null || response.right == null){
     response = handleControllerTracking(frame, referenceSpace, joystickScale);
   }
+  response.t = captureTime;
   if(pauseCommands){
     return response;
   }
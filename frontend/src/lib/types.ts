@@ -1,16 +1,50 @@
 import * as THREE from 'three';
 
 // WebSocket message types
+// JSON, or binary decoded by lib/feedback.ts. Field groups that did not change since the
+// previous message are left out, so every group and side is optional.
 export interface ForwardKinematicsMessage {
   type: "kinematics";
-  joints: {
-    right: number[];
-    left: number[];
+  seq?: number;
+  // Id of the tracking frame these values were computed from, if the client sent one
+  ack?: number;
+  joints?: {
+    right?: number[];
+    left?: number[];
   };
-  distances: {
-    right: number;
-    left: number;
+  joysticks?: {
+    right?: { x: number; y: number };
+    left?: { x: number; y: number };
   };
+  distances?: {
+    right?: number;
+    left?: number;
+  };
+  // Metres the server moved each target into the robot's workspace before IK (0 when reachable)
+  reach_offsets?: {
+    right?: number;
+    left?: number;
+  };
+}
+
+export interface ServerStatusMessage {
+  type: "status";
+  status: "warming_up" | "ready" | "error";
+  stage?: string;
+  progress?: number;
+  error?: string;
+}
+
+// Sent once before the first binary link pose message: link names in message order
+export interface LinkLayoutMessage {
+  type: "link_layout";
+  root: string;
+  links: string[];
+}
+
+export interface ClockPingMessage {
+  type: "clock_ping";
+  t0: number;
 }
 
 export interface AppConnectionMessage {
@@ -21,6 +55,7 @@ export interface AppConnectionMessage {
 
 export type UnifiedTrackingResult = {
   type: "hand" | "controller";
+  t?: number  // performance.now() when the poses were sampled, for server-side latency measurement
   right: TrackingResult | null
   left: TrackingResult | null
 };
@@ -47,6 +82,8 @@ export type SceneState = {
   statusCanvas: HTMLCanvasElement | null;
   statusTexture: THREE.CanvasTexture | null;
   robot: any | null;
+  // Robot links placed directly from server poses, in link_layout order (null: joint angles + local FK)
+  linkPoseTargets: THREE.Object3D[] | null;
   pauseCommands: boolean;
   joystickScale: number;
   previousButtonStates: Map<string, boolean>;
@@ -65,6 +102,7 @@ export const DEFAULT_SCENE_STATE: SceneState = {
   statusCanvas: null,
   statusTexture: null,
   robot: null,
+  linkPoseTargets: null,
   pauseCommands: true,
   joystickScale: 0.1,
   previousButtonStates: new Map<string, boolean>(),
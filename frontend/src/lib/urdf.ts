@@ -20,14 +20,62 @@ const actuatorMapping = {
     }
   }
 
+// Decimated, quantized meshes built by kscale_vr_teleop/analysis/headset_meshes.py
+const MESH_MANIFEST_DIR = '/meshes_lod/';
+
+type QuantizedMeshEntry = {
+  file: string;
+  index_type: 'uint16' | 'uint32';
+  position_offset: [number, number, number];
+  position_extent: [number, number, number];
+  sections: { position: [number, number]; normal: [number, number]; index: [number, number] };
+};
+
+const loadMeshManifest = async (): Promise<{ [filename: string]: QuantizedMeshEntry } | null> => {
+  try {
+    const response = await fetch(`${MESH_MANIFEST_DIR}manifest.json`);
+    if (!response.ok) {
+      return null;
+    }
+    return (await response.json()).meshes;
+  } catch (error) {
+    return null;
+  }
+};
+
+// Positions are uint16 over the mesh bounding box and normals int8, both normalized attributes;
+// the inner mesh's scale and position map the unit box back to the original coordinates.
+const buildQuantizedMesh = (buffer: ArrayBuffer, entry: QuantizedMeshEntry, material: THREE.Material) => {
+  const { position, normal, index } = entry.sections;
+  const geometry = new THREE.BufferGeometry();
+  geometry.setAttribute('position', new THREE.BufferAttribute(new Uint16Array(buffer, position[0], position[1] / 2), 3, true));
+  geometry.setAttribute('normal', new THREE.BufferAttribute(new Int8Array(buffer, normal[0], normal[1]), 3, true));
+  const indices = entry.index_type === 'uint16'
+    ? new Uint16Array(buffer, index[0], index[1] / 2)
+    : new Uint32Array(buffer, index[0], index[1] / 4);
+  geometry.setIndex(new THREE.BufferAttribute(indices, 1));
+
+  const mesh = new THREE.Mesh(geometry, material);
+  mesh.scale.set(...entry.position_extent);
+  mesh.position.set(...entry.position_offset);
+  const group = new THREE.Group();
+  group.add(mesh);
+  return group;
+};
+
 // Load URDF robot after scene is initialized
 export const loadURDFRobot = async (sceneState: SceneState, updateStatus: (msg: string) => void) => {
+    const meshManifest = await loadMeshManifest();
     return new Promise((resolve, reject) => {
         if (sceneState.scene) {
-            const loader = new URDFLoader();
+            const loadStart = performance.now();
+            const manager = new THREE.LoadingManager();
+            manager.onLoad = () => {
+                console.log(`Robot meshes (${meshManifest ? 'quantized' : 'STL'}) loaded in ${(performance.now() - loadStart).toFixed(0)} ms`);
+            };
+            const loader = new URDFLoader(manager);
 
-            // Set up STL loader for mesh loading (same as urdf-viewer)
-            loader.loadMeshCb = (path, manager, done) => {
+            const loadSTL = (path: string, manager: THREE.LoadingManager, done: (mesh: THREE.Object3D) => void) => {
                 new STLLoader(manager).load(path, (geometry) => {
                     const material = new THREE.MeshPhongMaterial({ color: 0x888888 });
                     const mesh = new THREE.Mesh(geometry, material);
@@ -35,6 +83,30 @@ export const loadURDFRobot = async (sceneState: SceneState, updateStatus: (msg:
                 });
             };
 
+            // Prefer the quantized meshes from the manifest, falling back to STL (same as urdf-viewer)
+            loader.loadMeshCb = (path, manager, done) => {
+                const filename = meshManifest && Object.keys(meshManifest).find((name) => path.endsWith(name));
+                if (!meshManifest || !filename) {
+                    loadSTL(path, manager, done);
+                    return;
+                }
+                const entry = meshManifest[filename];
+                manager.itemStart(path);
+                fetch(`${MESH_MANIFEST_DIR}${entry.file}`)
+                    .then((response) => {
+                        if (!response.ok) {
+                            throw new Error(`${response.status} ${response.statusText}`);
+                        }
+                        return response.arrayBuffer();
+                    })
+                    .then((buffer) => done(buildQuantizedMesh(buffer, entry, new THREE.MeshPhongMaterial({ color: 0x888888 }))))
+                    .catch((error) => {
+                        console.warn(`Falling back to STL for ${path}:`, error);
+                        loadSTL(path, manager, done);
+                    })
+                    .finally(() => manager.itemEnd(path));
+            };
+
             loader.load(
                 '/robot.urdf',
                 (robot) => {
@@ -94,4 +166,52 @@ export const updateURDF = (side: string, jointArray: number[], sceneState: Scene
         sceneState.robot.joints[jointName].setJointValue(angleInRadians);
       }
     });
-  };
\ No newline at end of file
+  };
+
+// Binary link pose message from the server (kscale_vr_teleop/link_poses.py):
+// magic 'L' (uint8), pad, link count (uint16), seq (uint32), then per link float32 px, py, pz, qx, qy, qz, qw
+const LINK_POSE_MAGIC = 0x4C;
+const LINK_POSE_HEADER_BYTES = 8;
+const LINK_POSE_FLOATS = 7;
+
+// Switch the overlay to server-computed link poses: every link becomes a direct child of the
+// robot root, so a pose relative to the URDF root is its local transform and no joint chain
+// has to be evaluated on the headset.
+export const enableServerLinkPoses = (sceneState: SceneState, linkNames: string[]) => {
+  const robot = sceneState.robot;
+  if (!robot) {
+    return;
+  }
+  const targets: THREE.Object3D[] = [];
+  linkNames.forEach((name) => {
+    const link = robot.links[name];
+    if (!link) {
+      console.warn(`Link ${name} from the server is not in the URDF`);
+      targets.push(new THREE.Object3D());
+      return;
+    }
+    robot.add(link);
+    targets.push(link);
+  });
+  sceneState.linkPoseTargets = targets;
+};
+
+export const applyLinkPoses = (sceneState: SceneState, buffer: ArrayBuffer): boolean => {
+  const targets = sceneState.linkPoseTargets;
+  if (!targets || buffer.byteLength < LINK_POSE_HEADER_BYTES) {
+    return false;
+  }
+  const header = new DataView(buffer);
+  if (header.getUint8(0) !== LINK_POSE_MAGIC) {
+    return false;
+  }
+  const count = Math.min(header.getUint16(2, true), targets.length);
+  // The header is 8 bytes, so the floats are viewed in place without copying
+  const poses = new Float32Array(buffer, LINK_POSE_HEADER_BYTES, count * LINK_POSE_FLOATS);
+  for (let i = 0; i < count; i++) {
+    const offset = i * LINK_POSE_FLOATS;
+    targets[i].position.set(poses[offset], poses[offset + 1], poses[offset + 2]);
+    targets[i].quaternion.set(poses[offset + 3], poses[offset + 4], poses[offset + 5], poses[offset + 6]);
+  }
+  return true;
+};
@@ -6,12 +6,17 @@ This is a completely optional visualization tool that listens to the same
 UDP commands being sent to the robot. It provides real-time 3D visualization
 of robot kinematics without affecting the main teleop loop.
 
+A receive thread only decodes packets, keeping the newest joint state and a
+compact history of the plotted commands. The render loop publishes the robot
+pose at the display rate and sends all plot samples since the previous render
+in one batch, so a fast command stream never builds up lag.
+
 Usage:
-    python visualizer.py [--port PORT] [--host HOST]
+    python visualizer.py [--port PORT] [--host HOST] [--display-rate HZ]
 
 Expected UDP message format (JSON):
     {"commands": {"joint_name": value, ...}}
-    
+
 The visualizer receives the exact same commands as the robot, providing
 a clear debugging interface with no coupling to the main teleop code.
 """
@@ -20,6 +25,7 @@ import argparse
 import json
 import socket
 import sys
+import threading
 import time
 from pathlib import Path
 
@@ -29,6 +35,7 @@ import rerun as rr
 # Import from the main package
 try:
     from kscale_vr_teleop._assets import ASSETS_DIR
+    from kscale_vr_teleop.analysis.mesh_cache import LOD_MAX_FACES, MeshCache
     from kscale_vr_teleop.analysis.rerun_loader_urdf import URDFLogger
 except ImportError:
     print("Error: Could not import from kscale_vr_teleop package.")
@@ -36,50 +43,163 @@ except ImportError:
     sys.exit(1)
 
 
+# Map command keys to URDF joint names
+JOINT_MAPPING = {
+    "rshoulderpitch": "dof_right_shoulder_pitch_03",
+    "rshoulderroll": "dof_right_shoulder_roll_03",
+    "rshoulderyaw": "dof_right_shoulder_yaw_02",
+    "relbowpitch": "dof_right_elbow_02",
+    "rwristroll": "dof_right_wrist_00",
+    "lshoulderpitch": "dof_left_shoulder_pitch_03",
+    "lshoulderroll": "dof_left_shoulder_roll_03",
+    "lshoulderyaw": "dof_left_shoulder_yaw_02",
+    "lelbowpitch": "dof_left_elbow_02",
+    "lwristroll": "dof_left_wrist_00",
+}
+
+# Define colors for each command (RGB)
+PLOT_COLORS = {
+    # Right arm - red/orange tones
+    "rshoulderpitch": [255, 0, 0],      # Red
+    "rshoulderroll": [255, 128, 0],     # Orange
+    "rshoulderyaw": [255, 200, 0],      # Yellow-orange
+    "relbowpitch": [255, 100, 100],     # Light red
+    "rwristroll": [200, 0, 0],          # Dark red
+    "rgripper": [255, 50, 150],         # Pink
+
+    # Left arm - blue/cyan tones
+    "lshoulderpitch": [0, 0, 255],      # Blue
+    "lshoulderroll": [0, 128, 255],     # Light blue
+    "lshoulderyaw": [0, 200, 255],      # Cyan
+    "lelbowpitch": [100, 100, 255],     # Light purple-blue
+    "lwristroll": [0, 0, 200],          # Dark blue
+    "lgripper": [150, 50, 255],         # Purple
+
+    # Velocity - green tones
+    "xvel": [0, 255, 0],                # Green
+    "yvel": [0, 200, 100],              # Teal
+    "zvel": [100, 255, 0],              # Yellow-green
+    "rollvel": [0, 150, 0],             # Dark green
+    "pitchvel": [150, 255, 150],        # Light green
+    "yawvel": [50, 200, 50],            # Medium green
+}
+PLOT_KEYS = list(PLOT_COLORS)
+
+
+def plot_entity_path(cmd_key: str) -> str:
+    # Organize plots by category
+    if "shoulder" in cmd_key or "elbow" in cmd_key or "wrist" in cmd_key:
+        category = "arm_joints"
+    elif "gripper" in cmd_key:
+        category = "grippers"
+    elif "vel" in cmd_key:
+        category = "velocity"
+    else:
+        category = "other"
+    return f"plots/{category}/{cmd_key}"
+
+
+class CommandHistory:
+    '''
+    Fixed-size ring of (timestamp, plotted command values) rows. Written only by the
+    receive thread and read only by the render loop; each side owns one index.
+    Keys missing from a packet are NaN and skipped when plotted.
+    '''
+    def __init__(self, size: int = 8192):
+        self.size = size
+        self.times = np.zeros(size)
+        self.values = np.full((size, len(PLOT_KEYS)), np.nan)
+        self.write_index = 0
+        self.read_index = 0
+        self.overwritten = 0
+
+    def append(self, timestamp: float, commands: dict):
+        row = self.write_index % self.size
+        self.times[row] = timestamp
+        values = self.values[row]
+        for i, key in enumerate(PLOT_KEYS):
+            value = commands.get(key)
+            values[i] = np.nan if value is None else float(value)
+        self.write_index += 1
+
+    def take(self):
+        '''
+        Returns (times, values) of all rows appended since the last take.
+        '''
+        end = self.write_index
+        start = max(self.read_index, end - self.size)
+        self.overwritten += start - self.read_index
+        self.read_index = end
+        rows = np.arange(start, end) % self.size
+        return self.times[rows], self.values[rows]
+
+
 class RerunUDPVisualizer:
-    def __init__(self, urdf_path: str):
+    def __init__(self, urdf_path: str, host: str = "0.0.0.0", port: int = 10000, display_rate: float = 30.0,
+                 max_faces: int | str | None = None):
         """
         Initialize the Rerun visualizer with UDP socket.
-        
+
         Args:
             urdf_path: Path to the robot URDF file
             host: UDP host to bind to (default: "0.0.0.0" for all interfaces)
-            port: UDP port to listen on (default: 10002 to avoid conflicts)
+            port: UDP port to listen on (default: 10000, the robot command port)
+            display_rate: Robot pose and plot updates per second
+            max_faces: Mesh level of detail, faces per mesh or a MeshCache LOD name (default: full)
         """
         self.urdf_path = urdf_path
-        
+        self.display_rate = display_rate
+
         # Initialize Rerun
         logs_folder = Path(f'~/.vr_teleop_logs/{time.strftime("%Y-%m-%d")}/').expanduser()
         logs_folder.mkdir(parents=True, exist_ok=True)
         logs_path = logs_folder / f'rerun_viz_{time.strftime("%H-%M-%S")}.rrd'
-        
+
         rr.init("vr_teleop_visualizer")
         print(f"Saving logs to {logs_path}")
         rr.save(logs_path)
         rr.spawn()
-        
+
         # Set up coordinate system
-        rr.log('origin', rr.Transform3D(translation=[0, 0, 0], axis_length=0.1), static=True)
-        
+        # Arrows rather than Transform3D(axis_length=...)/TransformAxes3D: the axis
+        # length argument moved between rerun releases, Arrows3D works on all of them
+        rr.log('origin', rr.Transform3D(translation=[0, 0, 0]),
+               rr.Arrows3D(vectors=np.eye(3) * 0.1, colors=[[255, 0, 0], [0, 255, 0], [0, 0, 255]]), static=True)
+        for cmd_key, color in PLOT_COLORS.items():
+            rr.log(plot_entity_path(cmd_key), rr.SeriesLines(colors=[color], names=[cmd_key]), static=True)
+
         # Initialize URDF logger
-        self.urdf_logger = URDFLogger(urdf_path, root_path="robot")
-        
+        start_time = time.perf_counter()
+        self.urdf_logger = URDFLogger(urdf_path, root_path="robot", mesh_cache=MeshCache(max_faces=max_faces))
+
         # Log initial robot pose
         self.urdf_logger.log()
-        
+        mesh_cache = self.urdf_logger.mesh_cache
+        print(f"Robot loaded in {time.perf_counter() - start_time:.2f}s "
+              f"({mesh_cache.hits} cached meshes, {mesh_cache.misses} built)")
+
+        # State shared with the receive thread
+        self.history = CommandHistory()
+        self.latest_joint_angles = None
+        self.latest_time = 0.0
+        self.packet_count = 0
+        self.error_count = 0
+        self._running = threading.Event()
+
         # Create UDP socket
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.sock.bind(("0.0.0.0", 10000))
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        self.sock.bind((host, port))
         self.sock.settimeout(0.1)  # 100ms timeout for graceful shutdown
-        
-        print(f"UDP socket listening on 0.0.0.0:10000")
+
+        print(f"UDP socket listening on {host}:{port}")
         print("Waiting for robot joint commands...")
-        
+
     def _parse_message(self, message: dict) -> dict:
         """
         Parse incoming message and extract joint angles.
-        
+
         Expected format from command_conn.py:
         {
             "commands": {
@@ -94,80 +214,70 @@ class RerunUDPVisualizer:
         """
         if "commands" not in message:
             return {}
-            
+
         commands = message["commands"]
-        
-        # Map command keys to URDF joint names
-        joint_mapping = {
-            "rshoulderpitch": "dof_right_shoulder_pitch_03",
-            "rshoulderroll": "dof_right_shoulder_roll_03",
-            "rshoulderyaw": "dof_right_shoulder_yaw_02",
-            "relbowpitch": "dof_right_elbow_02",
-            "rwristroll": "dof_right_wrist_00",
-            "lshoulderpitch": "dof_left_shoulder_pitch_03",
-            "lshoulderroll": "dof_left_shoulder_roll_03",
-            "lshoulderyaw": "dof_left_shoulder_yaw_02",
-            "lelbowpitch": "dof_left_elbow_02",
-            "lwristroll": "dof_left_wrist_00",
-        }
-        
+
         joint_angles = {}
-        for cmd_key, urdf_joint in joint_mapping.items():
+        for cmd_key, urdf_joint in JOINT_MAPPING.items():
             if cmd_key in commands:
                 joint_angles[urdf_joint] = float(commands[cmd_key])
-        
-        # Define colors for each command (RGB)
-        colors = {
-            # Right arm - red/orange tones
-            "rshoulderpitch": [255, 0, 0],      # Red
-            "rshoulderroll": [255, 128, 0],     # Orange
-            "rshoulderyaw": [255, 200, 0],      # Yellow-orange
-            "relbowpitch": [255, 100, 100],     # Light red
-            "rwristroll": [200, 0, 0],          # Dark red
-            "rgripper": [255, 50, 150],         # Pink
-            
-            # Left arm - blue/cyan tones
-            "lshoulderpitch": [0, 0, 255],      # Blue
-            "lshoulderroll": [0, 128, 255],     # Light blue
-            "lshoulderyaw": [0, 200, 255],      # Cyan
-            "lelbowpitch": [100, 100, 255],     # Light purple-blue
-            "lwristroll": [0, 0, 200],          # Dark blue
-            "lgripper": [150, 50, 255],         # Purple
-            
-            # Velocity - green tones
-            "xvel": [0, 255, 0],                # Green
-            "yvel": [0, 200, 100],              # Teal
-            "zvel": [100, 255, 0],              # Yellow-green
-            "rollvel": [0, 150, 0],             # Dark green
-            "pitchvel": [150, 255, 150],        # Light green
-            "yawvel": [50, 200, 50],            # Medium green
-        }
-        
-        # Log all available commands to plots
-        for cmd_key, value in commands.items():
-            if cmd_key in colors:
-                # Organize plots by category
-                if "shoulder" in cmd_key or "elbow" in cmd_key or "wrist" in cmd_key:
-                    category = "arm_joints"
-                elif "gripper" in cmd_key:
-                    category = "grippers"
-                elif "vel" in cmd_key:
-                    category = "velocity"
-                else:
-                    category = "other"
-                
-                rr.log(
-                    f"plots/{category}/{cmd_key}",
-                    rr.Scalars(np.array([float(value)]))
-                )
-            
         return joint_angles
-    
+
+    def _receive_loop(self):
+        """Decode packets and keep only the newest pose plus the plot history."""
+        while self._running.is_set():
+            try:
+                data, addr = self.sock.recvfrom(4096)
+                message = json.loads(data.decode('utf-8'))
+                joint_angles = self._parse_message(message)
+                if joint_angles:
+                    now = time.time()
+                    self.history.append(now, message["commands"])
+                    self.latest_joint_angles = joint_angles
+                    self.latest_time = now
+                    self.packet_count += 1
+            except socket.timeout:
+                continue
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                self.error_count += 1
+            except OSError:
+                break
+
+    def _render(self):
+        """Publish the newest robot pose and the plot samples since the last render."""
+        times, values = self.history.take()
+        if len(times) > 0:
+            index = [rr.TimeColumn("time", timestamp=times)]
+            for i, cmd_key in enumerate(PLOT_KEYS):
+                present = ~np.isnan(values[:, i])
+                if not present.any():
+                    continue
+                rr.send_columns(
+                    plot_entity_path(cmd_key),
+                    indexes=[rr.TimeColumn("time", timestamp=times[present])] if not present.all() else index,
+                    columns=rr.Scalars.columns(scalars=values[present, i]),
+                )
+
+        joint_angles = self.latest_joint_angles
+        if joint_angles is not None:
+            rr.set_time("time", timestamp=self.latest_time)
+            self.urdf_logger.log(joint_angles)
+            self.latest_joint_angles = None
+            return True
+        return False
+
     def run(self):
-        """Main loop to receive and visualize UDP messages."""
-        message_count = 0
+        """Main loop: receive on a background thread, render at the display rate."""
+        self._running.set()
+        receiver = threading.Thread(target=self._receive_loop, name="udp-receive", daemon=True)
+        receiver.start()
+
+        render_count = 0
+        last_packet_count = 0
         last_print_time = time.time()
-        
+        period = 1.0 / self.display_rate
+        next_render = time.perf_counter()
+
         try:
             print("\n" + "="*60)
             print("Rerun Visualizer Running")
@@ -175,44 +285,40 @@ class RerunUDPVisualizer:
             print("Send UDP commands in JSON format with 'commands' key")
             print("Press Ctrl+C to stop")
             print("="*60 + "\n")
-            
+
             while True:
+                delay = next_render - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                # Skip missed slots instead of rendering in a burst to catch up
+                next_render = max(next_render + period, time.perf_counter())
+
                 try:
-                    # Receive UDP message
-                    data, addr = self.sock.recvfrom(4096)
-                    message = json.loads(data.decode('utf-8'))
-                    print(message)
-                    # Parse joint angles from message
-                    joint_angles = self._parse_message(message)
-                    
-                    # Log to rerun
-                    if joint_angles:
-                        self.urdf_logger.log(joint_angles)
-                        message_count += 1
-                        
-                        # Print status every second
-                        current_time = time.time()
-                        if current_time - last_print_time >= 1.0:
-                            fps = message_count / (current_time - last_print_time)
-                            print(f"📊 Receiving: {fps:.1f} msg/s | Total: {message_count}")
-                            message_count = 0
-                            last_print_time = current_time
-                
-                except socket.timeout:
-                    # Timeout is expected, continue waiting
-                    continue
-                except json.JSONDecodeError as e:
-                    print(f"❌ Failed to parse JSON: {e}")
-                    continue
+                    if self._render():
+                        render_count += 1
                 except Exception as e:
-                    print(f"⚠️  Error processing message: {e}")
-                    continue
-        
+                    print(f"⚠️  Error rendering: {e}")
+
+                # Print status every second
+                current_time = time.time()
+                if current_time - last_print_time >= 1.0:
+                    elapsed = current_time - last_print_time
+                    packets = self.packet_count - last_packet_count
+                    if packets > 0 or render_count > 0:
+                        print(f"📊 Packets: {packets / elapsed:.1f}/s | Renders: {render_count / elapsed:.1f}/s | "
+                              f"Total: {self.packet_count} | Bad: {self.error_count} | "
+                              f"Plot samples dropped: {self.history.overwritten}")
+                    last_packet_count = self.packet_count
+                    render_count = 0
+                    last_print_time = current_time
+
         except KeyboardInterrupt:
             print("\n\n" + "="*60)
             print("Shutting down Rerun Visualizer...")
             print("="*60)
         finally:
+            self._running.clear()
+            receiver.join(timeout=1.0)
             self.sock.close()
             print("✓ UDP socket closed")
 
@@ -223,29 +329,34 @@ def main():
         formatter_class=argparse.RawDescriptionHelpFormatter,
         epilog="""
 Examples:
-  # Listen on default port 10002
+  # Listen on the default robot command port 10000
   python visualizer.py
-  
+
   # Listen on custom port
-  python visualizer.py --port 10000
-  
-  # Listen on specific host
-  python visualizer.py --host 192.168.1.100 --port 10000
+  python visualizer.py --port 10002
+
+  # Listen on specific host, redraw at 60 Hz
+  python visualizer.py --host 192.168.1.100 --port 10000 --display-rate 60
         """
     )
+    parser.add_argument("--host", type=str, default="0.0.0.0", help="UDP host to bind to")
+    parser.add_argument("--port", type=int, default=10000, help="UDP port to listen on")
+    parser.add_argument("--display-rate", type=float, default=30.0, help="Robot pose and plot updates per second")
+    parser.add_argument("--lod", type=str, default="full", choices=list(LOD_MAX_FACES),
+                        help="Mesh level of detail")
+    args = parser.parse_args()
 
-    
     # Get URDF path
- 
+
     urdf_path = str(ASSETS_DIR / "kbot_legless" / "robot.urdf")
-    
+
     print(f"\n🤖 Using URDF: {urdf_path}\n")
-    
+
     # Create and run visualizer
-    visualizer = RerunUDPVisualizer(urdf_path)
+    visualizer = RerunUDPVisualizer(urdf_path, host=args.host, port=args.port, display_rate=args.display_rate,
+                                    max_faces=args.lod)
     visualizer.run()
 
 
 if __name__ == "__main__":
     main()
-
@@ -4,4 +4,5 @@ __all__ = [
     "visualizer",
     "rerun_loader_urdf",
     "from_rerun_data",
+    "replay",
 ]
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+Export recorded teleop sessions as a training dataset with random window access.
+
+Sessions written by ``SessionRecorder`` are split into episodes (at recording gaps
+longer than --max-gap) and every episode is stored as one ``.npy`` file per field,
+so a reader can memory-map it and slice fixed windows without copying. An
+``index.json`` lists the episodes with their source, length and time span.
+
+Layout::
+
+    dataset/
+        index.json
+        episode_00000/timestamp.npy
+        episode_00000/joints.npy
+        ...
+
+Usage:
+    python -m kscale_vr_teleop.analysis.dataset_export SESSION_DIR [SESSION_DIR ...] --out DATASET_DIR
+    python -m kscale_vr_teleop.analysis.dataset_export --benchmark-hours 3 --out /tmp/bench_dataset
+"""
+import argparse
+import json
+import shutil
+import time
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+# SessionRecorder columns a policy is trained on
+EXPORT_FIELDS = ("timestamp", "joints", "ik_targets", "grippers", "joysticks", "finger_angles", "converged")
+DATASET_VERSION = 1
+
+
+def _session_chunks(session_dir: Path) -> tuple[dict, list[Path]]:
+    meta = json.loads((session_dir / "meta.json").read_text())
+    return meta, sorted(session_dir.glob("chunk_*"))[:meta["num_chunks"]]
+
+
+def find_episodes(timestamps: np.ndarray, max_gap: float, min_frames: int) -> list[tuple[int, int]]:
+    '''
+    Splits a session into [start, end) frame ranges at gaps longer than max_gap seconds,
+    dropping ranges shorter than min_frames.
+    '''
+    if len(timestamps) == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(timestamps) > max_gap) + 1
+    starts = np.concatenate([[0], breaks])
+    ends = np.concatenate([breaks, [len(timestamps)]])
+    return [(int(s), int(e)) for s, e in zip(starts, ends) if e - s >= min_frames]
+
+
+def export_dataset(session_dirs: list, out_dir, max_gap: float = 1.0, min_frames: int = 40,
+                   fields: tuple[str, ...] = EXPORT_FIELDS, overwrite: bool = False) -> dict:
+    '''
+    Exports session_dirs into out_dir and returns the index. Source chunks are read
+    memory-mapped and copied straight into the memory-mapped episode files, so memory
+    use does not grow with session length.
+
+    A non-empty out_dir is refused unless overwrite is set, which deletes the episodes
+    and index of the dataset already there (nothing else) before exporting.
+    '''
+    out_dir = Path(out_dir)
+    if out_dir.is_dir() and any(out_dir.iterdir()):
+        if not overwrite:
+            raise FileExistsError(f"{out_dir} is not empty; pass overwrite=True (--overwrite) to replace the dataset")
+        # Stale episodes past the new count would otherwise sit next to the new index
+        for episode_dir in out_dir.glob("episode_*"):
+            shutil.rmtree(episode_dir)
+        (out_dir / "index.json").unlink(missing_ok=True)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    episodes = []
+    field_specs = None
+    for session_dir in map(Path, session_dirs):
+        meta, chunk_dirs = _session_chunks(session_dir)
+        if field_specs is None:
+            field_specs = {name: meta["fields"][name] for name in fields}
+        # First pass: timestamps only, to find the episode boundaries
+        chunk_lengths = []
+        timestamps = []
+        for chunk_dir in chunk_dirs:
+            chunk_timestamps = np.load(chunk_dir / "timestamp.npy", mmap_mode='r')
+            chunk_lengths.append(len(chunk_timestamps))
+            timestamps.append(np.asarray(chunk_timestamps))
+        timestamps = np.concatenate(timestamps) if timestamps else np.zeros(0)
+        chunk_offsets = np.concatenate([[0], np.cumsum(chunk_lengths)]).astype(int)
+
+        for start, end in find_episodes(timestamps, max_gap, min_frames):
+            episode_name = f"episode_{len(episodes):05d}"
+            episode_dir = out_dir / episode_name
+            episode_dir.mkdir()
+            for name in fields:
+                dtype, shape = field_specs[name]
+                target = np.lib.format.open_memmap(episode_dir / f"{name}.npy", mode='w+', dtype=np.dtype(dtype),
+                                                   shape=(end - start, *shape))
+                # Second pass: copy the chunk slices that overlap this episode
+                for chunk_dir, chunk_start, chunk_end in zip(chunk_dirs, chunk_offsets[:-1], chunk_offsets[1:]):
+                    lo, hi = max(start, chunk_start), min(end, chunk_end)
+                    if lo >= hi:
+                        continue
+                    source = np.load(chunk_dir / f"{name}.npy", mmap_mode='r')
+                    target[lo - start:hi - start] = source[lo - chunk_start:hi - chunk_start]
+                target.flush()
+                del target
+            episodes.append({
+                "path": episode_name,
+                "source": str(session_dir),
+                "source_start": start,
+                "length": end - start,
+                "start_time": float(timestamps[start]),
+                "end_time": float(timestamps[end - 1]),
+            })
+
+    index = {
+        "version": DATASET_VERSION,
+        "fields": field_specs or {},
+        "num_frames": int(sum(e["length"] for e in episodes)),
+        "episodes": episodes,
+    }
+    (out_dir / "index.json").write_text(json.dumps(index, indent=2))
+    return index
+
+
+class TeleopDataset:
+    '''
+    Random access to an exported dataset. Episodes are memory-mapped on first use and
+    every window is a view into the mapped files; nothing is copied until the caller
+    converts it.
+    '''
+    def __init__(self, dataset_dir, fields: Optional[tuple[str, ...]] = None):
+        self.dataset_dir = Path(dataset_dir)
+        self.index = json.loads((self.dataset_dir / "index.json").read_text())
+        self.fields = tuple(fields) if fields is not None else tuple(self.index["fields"])
+        self.episodes = self.index["episodes"]
+        self.lengths = np.array([e["length"] for e in self.episodes], dtype=np.int64)
+        self._mapped: dict[int, dict[str, np.ndarray]] = {}
+
+    def __len__(self) -> int:
+        return len(self.episodes)
+
+    def episode(self, i: int) -> dict[str, np.ndarray]:
+        if i not in self._mapped:
+            episode_dir = self.dataset_dir / self.episodes[i]["path"]
+            self._mapped[i] = {name: np.load(episode_dir / f"{name}.npy", mmap_mode='r') for name in self.fields}
+        return self._mapped[i]
+
+    def window(self, episode: int, start: int, length: int) -> dict[str, np.ndarray]:
+        '''
+        Frames [start, start + length) of an episode as read-only views.
+        '''
+        if start < 0 or start + length > self.lengths[episode]:
+            raise IndexError(f"window [{start}, {start + length}) outside episode {episode} of length {self.lengths[episode]}")
+        return {name: column[start:start + length] for name, column in self.episode(episode).items()}
+
+    def num_windows(self, length: int, stride: int = 1) -> np.ndarray:
+        '''Number of windows of the given length that fit in each episode.'''
+        return np.maximum(0, (self.lengths - length) // stride + 1)
+
+    def window_index(self, i: int, length: int, stride: int = 1) -> tuple[int, int]:
+        '''
+        Maps a flat window number in [0, num_windows(length, stride).sum()) to (episode, start),
+        so a sampler can treat the dataset as one list of windows.
+        '''
+        counts = self.num_windows(length, stride)
+        offsets = np.cumsum(counts)
+        episode = int(np.searchsorted(offsets, i, side='right'))
+        if episode >= len(counts):
+            raise IndexError(f"window {i} out of range ({offsets[-1] if len(offsets) else 0} windows)")
+        return episode, int((i - (offsets[episode] - counts[episode])) * stride)
+
+    def sample_windows(self, num: int, length: int, rng: Optional[np.random.Generator] = None):
+        '''
+        Yields num uniformly sampled windows (every valid start equally likely).
+        '''
+        rng = rng or np.random.default_rng()
+        for i in rng.integers(0, self.num_windows(length).sum(), size=num):
+            yield self.window(*self.window_index(int(i), length), length)
+
+
+def write_synthetic_session(session_dir, hours: float, rate_hz: float = 40.0, chunk_frames: int = 2048,
+                            pauses_per_hour: int = 6, seed: int = 0) -> Path:
+    '''
+    Writes a SessionRecorder-layout session with only the exported fields, for benchmarks.
+    '''
+    from kscale_vr_teleop.session_recorder import RECORD_DTYPE
+
+    session_dir = Path(session_dir)
+    session_dir.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    num_frames = int(hours * 3600 * rate_hz)
+    timestamps = time.time() + np.arange(num_frames) / rate_hz
+    # Operator pauses split the session into episodes
+    for pause in rng.integers(0, num_frames, size=int(hours * pauses_per_hour)):
+        timestamps[pause:] += 5.0
+
+    num_chunks = 0
+    for num_chunks, start in enumerate(range(0, num_frames, chunk_frames), start=1):
+        count = min(chunk_frames, num_frames - start)
+        chunk_dir = session_dir / f"chunk_{num_chunks - 1:05d}"
+        chunk_dir.mkdir(exist_ok=True)
+        for name in EXPORT_FIELDS:
+            if name == "timestamp":
+                values = timestamps[start:start + count]
+            else:
+                dtype = RECORD_DTYPE[name]
+                values = rng.standard_normal((count, *dtype.shape)).astype(dtype.base) if dtype.base != np.bool_ \
+                    else np.ones((count, *dtype.shape), dtype=np.bool_)
+            np.save(chunk_dir / f"{name}.npy", values)
+
+    meta = {
+        "start_time": float(timestamps[0]) if num_frames else 0.0,
+        "fields": {name: [RECORD_DTYPE[name].base.str, list(RECORD_DTYPE[name].shape)] for name in EXPORT_FIELDS},
+        "num_chunks": num_chunks,
+        "num_frames": num_frames,
+        "frames_dropped": 0,
+        "synthetic": True,
+    }
+    (session_dir / "meta.json").write_text(json.dumps(meta, indent=2))
+    return session_dir
+
+
+def benchmark(out_dir, hours: float, window: int = 64, num_reads: int = 10000, seed: int = 0) -> dict:
+    out_dir = Path(out_dir)
+    session_dir = write_synthetic_session(out_dir / "source_session", hours, seed=seed)
+
+    start = time.perf_counter()
+    index = export_dataset([session_dir], out_dir / "dataset", overwrite=True)
+    export_time = time.perf_counter() - start
+    dataset_bytes = sum(f.stat().st_size for f in (out_dir / "dataset").rglob("*.npy"))
+
+    dataset = TeleopDataset(out_dir / "dataset")
+    rng = np.random.default_rng(seed)
+    read_times = np.empty(num_reads)
+    for i, flat in enumerate(rng.integers(0, dataset.num_windows(window).sum(), size=num_reads)):
+        read_start = time.perf_counter()
+        batch = dataset.window(*dataset.window_index(int(flat), window), window)
+        # Touch the last frame of every field so the pages are actually read
+        for column in batch.values():
+            column[-1].sum()
+        read_times[i] = time.perf_counter() - read_start
+
+    read_ms = read_times * 1e3
+    return {
+        "hours": hours,
+        "frames": index["num_frames"],
+        "episodes": len(index["episodes"]),
+        "dataset_mb": dataset_bytes / 1e6,
+        "export_s": export_time,
+        "export_frames_per_s": index["num_frames"] / export_time,
+        "export_mb_per_s": dataset_bytes / 1e6 / export_time,
+        "window": window,
+        "read_us": {
+            "p50": float(np.percentile(read_ms, 50) * 1e3),
+            "p90": float(np.percentile(read_ms, 90) * 1e3),
+            "p99": float(np.percentile(read_ms, 99) * 1e3),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export recorded teleop sessions as a windowed training dataset")
+    parser.add_argument("sessions", nargs="*", help="SessionRecorder directories")
+    parser.add_argument("--out", type=str, required=True, help="Dataset directory (or scratch directory with --benchmark-hours)")
+    parser.add_argument("--max-gap", type=float, default=1.0, help="Start a new episode after a gap this long (s)")
+    parser.add_argument("--min-frames", type=int, default=40, help="Drop episodes shorter than this")
+    parser.add_argument("--benchmark-hours", type=float, default=None,
+                        help="Benchmark export and window reads on a synthetic session of this length")
+    parser.add_argument("--overwrite", action="store_true", help="Replace the dataset already in --out")
+    parser.add_argument("--window", type=int, default=64, help="Window length for the read benchmark")
+    args = parser.parse_args()
+
+    if args.benchmark_hours is not None:
+        report = benchmark(args.out, args.benchmark_hours, window=args.window)
+        print(json.dumps(report, indent=2))
+        return
+
+    try:
+        index = export_dataset(args.sessions, args.out, max_gap=args.max_gap, min_frames=args.min_frames,
+                               overwrite=args.overwrite)
+    except FileExistsError as e:
+        parser.error(str(e))
+    print(f"Exported {len(index['episodes'])} episodes, {index['num_frames']} frames to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,64 +1,98 @@
-import rerun as rr
+"""Read wrist target frames out of a rerun ``.rrd`` recording.
+
+Columns are converted a whole record batch at a time with pyarrow compute instead of
+row by row with ``as_py()``. The result feeds ``kscale_vr_teleop.analysis.replay``.
+"""
 import numpy as np
-from pathlib import Path
-from tqdm import tqdm
-from line_profiler import profile
-from kscale_vr_teleop.teleop_core import TeleopCore
-import warnings
 import pyarrow as pa
+import pyarrow.compute as pc
+import rerun as rr
 
-rr.init("replay_teleop_from_rerun", spawn=True)
+WRIST_ENTITIES = {
+    "right": "/right_wrist",
+    "left": "/left_wrist",
+}
 
-recording_path = "/home/miller/Downloads/data.rrd"
-recording = rr.dataframe.load_recording(str(recording_path))
-view = recording.view(index="log_time", contents="/**")
-reader = view.select()
 
-teleop_core = TeleopCore()
-teleop_core.update_head(np.eye(4))
+def _first_instance(column: pa.ChunkedArray, width: int):
+    '''
+    Converts a rerun component column (one list of instances per row, nullable)
+    to (values[N, width], present[N]) taking the first instance of each row.
+    '''
+    column = column.combine_chunks()
+    lengths = pc.fill_null(pc.list_value_length(column), 0).to_numpy(zero_copy_only=False)
+    flat = pc.list_flatten(pc.list_flatten(column)).to_numpy(zero_copy_only=False).reshape(-1, width)
+    present = lengths > 0
+    first = np.cumsum(lengths) - lengths
+    values = np.zeros((len(lengths), width), dtype=np.float64)
+    values[present] = flat[first[present]]
+    return values, present
 
-rr.log('origin_axes', rr.Transform3D(translation=[0,0,0], axis_length=0.1), static=True)
 
-err = []
-@profile
-def main():
-    left_wrist_frame = np.eye(4)
-    right_wrist_frame = np.eye(4)
+def _forward_fill(values: np.ndarray, present: np.ndarray, initial: np.ndarray):
+    '''
+    Replaces rows that are not present with the latest present row (or initial).
+    '''
+    index = np.where(present, np.arange(len(present)), -1)
+    np.maximum.accumulate(index, out=index)
+    filled = values[np.maximum(index, 0)]
+    filled[index < 0] = initial
+    return filled
 
-    # Iterate over RecordBatchReader batches and rows
-    batch_reader = view.select()
-    total_rows = 0
-    for batch in batch_reader:
-        table = pa.Table.from_batches([batch])
-        columns = table.column_names
-        for i in range(table.num_rows):
-            row = {col: table[col][i].as_py() for col in columns}
-            timestamp = row.get('log_time') if 'log_time' in row else None
-            if timestamp is None:
-                warnings.warn(f"Skipping row {total_rows} with missing log_time")
-                timestamp = int(total_rows)
-            rr.set_time('', timestamp=timestamp)
-            right_translate = row.get('/right_wrist:Transform3D:translation')
-            right_rot = row.get('/right_wrist:Transform3D:mat3x3')
-            left_translate = row.get('/left_wrist:Transform3D:translation')
-            left_rot = row.get('/left_wrist:Transform3D:mat3x3')
 
-            if right_rot is not None:
-                right_wrist_frame[:3,:3] = np.array(right_rot).reshape((3,3))
-                right_wrist_frame[:3,3] = np.array(right_translate).reshape(3,)
-                teleop_core.update_right_hand(right_wrist_frame, np.zeros((24,4,4)))
-            if left_rot is not None:
-                left_wrist_frame[:3,:3] = np.array(left_rot).reshape((3,3))
-                left_wrist_frame[:3,3] = np.array(left_translate).reshape(3,)
-                teleop_core.update_left_hand(left_wrist_frame, np.zeros((24,4,4)))
+def load_wrist_frames(recording_path: str, index: str = "log_time") -> dict[str, np.ndarray]:
+    '''
+    Loads the right and left wrist poses logged as Transform3D in an .rrd file.
+
+    Returns a dict with ``timestamp`` (seconds, N) and ``wrist_poses`` (N x 2 x 4 x 4,
+    right then left) with one row per logged update. Poses are forward-filled so every
+    row holds the latest pose of both wrists.
+    '''
+    recording = rr.dataframe.load_recording(str(recording_path))
+    view = recording.view(index=index, contents="/**")
+
+    timestamps = []
+    poses = {side: ([], [], []) for side in WRIST_ENTITIES}
+    for batch in view.select():
+        table = pa.Table.from_batches([batch])
+        if table.num_rows == 0:
+            continue
+        times = table.column(index).cast(pa.int64()).to_numpy(zero_copy_only=False)
+        timestamps.append(times)
+        for side, entity in WRIST_ENTITIES.items():
+            translation_name = f"{entity}:Transform3D:translation"
+            rotation_name = f"{entity}:Transform3D:mat3x3"
+            if translation_name not in table.column_names or rotation_name not in table.column_names:
+                translation = np.zeros((table.num_rows, 3))
+                rotation = np.zeros((table.num_rows, 9))
+                present = np.zeros(table.num_rows, dtype=bool)
+            else:
+                translation, _ = _first_instance(table.column(translation_name), 3)
+                rotation, present = _first_instance(table.column(rotation_name), 9)
+            poses[side][0].append(translation)
+            poses[side][1].append(rotation)
+            poses[side][2].append(present)
 
-            right_arm_joints, left_arm_joints = teleop_core.compute_joint_angles()
-            teleop_core.log_joint_angles(right_arm_joints, left_arm_joints)
-            total_rows += 1
+    if not timestamps:
+        return {"timestamp": np.zeros(0), "wrist_poses": np.zeros((0, 2, 4, 4))}
 
-    print('Done')
-    mse = np.mean(np.array(err)**2)
-    print(f'MSE: {mse}')
-    rr.log('mse', rr.Scalars(mse), static=True)
+    timestamps = np.concatenate(timestamps)
+    num_rows = len(timestamps)
+    any_present = np.zeros(num_rows, dtype=bool)
+    wrist_poses = np.tile(np.eye(4), (num_rows, 2, 1, 1))
+    for i, side in enumerate(("right", "left")):
+        translation = np.concatenate(poses[side][0])
+        # rerun stores mat3x3 column-major
+        rotation = np.concatenate(poses[side][1]).reshape(-1, 3, 3).transpose(0, 2, 1)
+        present = np.concatenate(poses[side][2])
+        any_present |= present
+        flat = np.concatenate([rotation.reshape(-1, 9), translation], axis=1)
+        flat = _forward_fill(flat, present, np.concatenate([np.eye(3).reshape(9), np.zeros(3)]))
+        wrist_poses[:, i, :3, :3] = flat[:, :9].reshape(-1, 3, 3)
+        wrist_poses[:, i, :3, 3] = flat[:, 9:]
 
-main()
+    # log_time is nanoseconds since the epoch
+    return {
+        "timestamp": timestamps[any_present] * 1e-9,
+        "wrist_poses": wrist_poses[any_present],
+    }
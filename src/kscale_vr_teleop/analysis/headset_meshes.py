@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Build compact binary meshes for the headset robot overlay.
+
+Reads a URDF, decimates every referenced mesh to a share of a total triangle
+budget (proportional to its original size), quantizes it and writes one indexed
+binary file per mesh plus ``manifest.json``. The frontend loads the manifest and
+uses these files in place of the raw STL, falling back to STL for anything not
+listed.
+
+Per mesh the binary holds, back to back, each section aligned to 4 bytes:
+    position  uint16 x 3 per vertex, normalized over the mesh bounding box
+              (position = offset + value / 65535 * extent, both in the manifest)
+    normal    int8 x 3 per vertex, normalized (value / 127), in the unit-box frame
+    index     uint16 x 3 per triangle (uint32 above 65535 vertices)
+The manifest gives the byte offset and length of every section, so the client
+views them as typed arrays without parsing.
+
+Decimation uses mesh_cache.decimate and needs the optional ``mesh`` extra
+(fast-simplification); without it meshes are only quantized.
+
+Usage:
+    python -m kscale_vr_teleop.analysis.headset_meshes [URDF] [--out DIR] [--triangle-budget 30000]
+"""
+import argparse
+import gzip
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+import trimesh
+
+from kscale_vr_teleop.analysis.mesh_cache import decimate
+from kscale_vr_teleop.robot_model import RobotModel
+
+FRONTEND_PUBLIC = Path(__file__).resolve().parents[3] / "frontend" / "public"
+MANIFEST_VERSION = 1
+POSITION_LEVELS = 65535
+NORMAL_LEVELS = 127
+
+
+def mesh_filenames(urdf_path: str) -> list[str]:
+    '''
+    Mesh filenames referenced by the URDF's visuals, as written (relative to the URDF).
+    '''
+    filenames = [visual.filename for visual in RobotModel.load(urdf_path).visuals if visual.geometry == "mesh"]
+    return list(dict.fromkeys(filenames))
+
+
+def triangle_budgets(face_counts: dict[str, int], total: int, minimum: int = 200) -> dict[str, int]:
+    '''
+    Splits a total triangle budget across meshes in proportion to their face counts,
+    never going below minimum (or above the original count) for any mesh.
+    '''
+    source_total = sum(face_counts.values())
+    if source_total <= total:
+        return dict(face_counts)
+    return {name: min(count, max(minimum, int(total * count / source_total))) for name, count in face_counts.items()}
+
+
+def _aligned(data: bytes) -> bytes:
+    return data + b"\0" * (-len(data) % 4)
+
+
+def quantize_mesh(mesh: trimesh.Trimesh) -> tuple[bytes, dict]:
+    '''
+    Encodes a mesh as the binary layout above. Returns the bytes and its manifest entry.
+    '''
+    vertices = np.asarray(mesh.vertices, dtype=np.float64)
+    offset = vertices.min(axis=0)
+    extent = np.maximum(vertices.max(axis=0) - offset, 1e-9)
+    positions = np.round((vertices - offset) / extent * POSITION_LEVELS).astype('<u2')
+    # The client scales the unit-box positions by extent, and three.js transforms normals by the
+    # inverse transpose of that scale, so store them pre-multiplied by extent
+    normals = np.array(mesh.vertex_normals)
+    # Folds left by decimation can cancel a vertex normal out; use one adjacent face instead
+    degenerate = np.linalg.norm(normals, axis=1) < 0.5
+    if degenerate.any():
+        normals[degenerate] = mesh.face_normals[mesh.vertex_faces[degenerate, 0]]
+    normals *= extent
+    normals /= np.maximum(np.linalg.norm(normals, axis=1, keepdims=True), 1e-12)
+    normals = np.round(normals * NORMAL_LEVELS).astype(np.int8)
+    index_type = '<u2' if len(vertices) <= 65535 else '<u4'
+    indices = np.asarray(mesh.faces).astype(index_type)
+
+    sections = {}
+    data = b""
+    for name, array in (("position", positions), ("normal", normals), ("index", indices)):
+        raw = array.tobytes()
+        sections[name] = [len(data), len(raw)]
+        data += _aligned(raw)
+
+    decoded = offset + positions.astype(np.float64) / POSITION_LEVELS * extent
+    entry = {
+        "vertices": int(len(vertices)),
+        "triangles": int(len(indices)),
+        "index_type": "uint16" if index_type == '<u2' else "uint32",
+        "position_offset": offset.astype(np.float32).tolist(),
+        "position_extent": extent.astype(np.float32).tolist(),
+        "sections": sections,
+        "max_position_error_mm": float(np.abs(decoded - vertices).max() * 1e3),
+    }
+    return data, entry
+
+
+def build_headset_meshes(urdf_path: str, out_dir, triangle_budget: int = 30000) -> dict:
+    '''
+    Writes out_dir/<mesh>.bin for every mesh the URDF references and out_dir/manifest.json,
+    and returns the manifest. Manifest keys are the filenames as written in the URDF.
+    '''
+    urdf_dir = Path(urdf_path).resolve().parent
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    sources = {}
+    for filename in mesh_filenames(urdf_path):
+        mesh = trimesh.load_mesh(urdf_dir / filename)
+        if isinstance(mesh, trimesh.Trimesh):
+            sources[filename] = mesh
+    budgets = triangle_budgets({name: len(mesh.faces) for name, mesh in sources.items()}, triangle_budget)
+
+    meshes = {}
+    for filename, mesh in sources.items():
+        source_path = urdf_dir / filename
+        decimated = decimate(mesh, budgets[filename]).copy()
+        # Decimation leaves collapsed vertices behind; they would only cost bytes
+        decimated.remove_unreferenced_vertices()
+        data, entry = quantize_mesh(decimated)
+        output = out_dir / (Path(filename).stem + ".bin")
+        output.write_bytes(data)
+        entry.update({
+            "file": output.name,
+            "source_triangles": int(len(mesh.faces)),
+            "source_bytes": source_path.stat().st_size,
+            "source_gzip_bytes": len(gzip.compress(source_path.read_bytes())),
+            "bytes": len(data),
+            "gzip_bytes": len(gzip.compress(data)),
+        })
+        meshes[filename] = entry
+
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "triangle_budget": triangle_budget,
+        "meshes": meshes,
+        "total": {
+            key: sum(entry[key] for entry in meshes.values())
+            for key in ("source_triangles", "triangles", "source_bytes", "bytes", "source_gzip_bytes", "gzip_bytes")
+        },
+    }
+    (out_dir / "manifest.json").write_text(json.dumps(manifest, indent=2))
+    return manifest
+
+
+def decode_time(manifest: dict, out_dir, urdf_path: str, repeats: int = 5) -> dict:
+    '''
+    Host-side load time of all meshes: STL parse with trimesh versus viewing the
+    binary sections. A proxy for the headset; the frontend logs the real number.
+    '''
+    urdf_dir = Path(urdf_path).resolve().parent
+    out_dir = Path(out_dir)
+    times = {"stl_ms": [], "binary_ms": []}
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for filename in manifest["meshes"]:
+            trimesh.load_mesh(urdf_dir / filename, process=False)
+        times["stl_ms"].append((time.perf_counter() - start) * 1e3)
+
+        start = time.perf_counter()
+        for entry in manifest["meshes"].values():
+            data = (out_dir / entry["file"]).read_bytes()
+            for name, dtype in (("position", '<u2'), ("normal", np.int8), ("index", entry["index_type"])):
+                offset, length = entry["sections"][name]
+                np.frombuffer(data, dtype=dtype, count=length // np.dtype(dtype).itemsize, offset=offset)
+        times["binary_ms"].append((time.perf_counter() - start) * 1e3)
+    return {name: float(np.median(values)) for name, values in times.items()}
+
+
+def print_report(manifest: dict, timing: dict = None):
+    print(f"{'mesh':<36}{'tris':>14}{'bytes':>20}{'gzip':>20}{'err mm':>8}")
+    for filename, entry in manifest["meshes"].items():
+        print(f"{Path(filename).name:<36}{entry['source_triangles']:>7}>{entry['triangles']:<6}"
+              f"{entry['source_bytes']:>10}>{entry['bytes']:<9}{entry['source_gzip_bytes']:>10}>{entry['gzip_bytes']:<9}"
+              f"{entry['max_position_error_mm']:>8.3f}")
+    total = manifest["total"]
+    print(f"{'total':<36}{total['source_triangles']:>7}>{total['triangles']:<6}"
+          f"{total['source_bytes']:>10}>{total['bytes']:<9}{total['source_gzip_bytes']:>10}>{total['gzip_bytes']:<9}")
+    print(f"Download: {total['source_bytes'] / 1e6:.2f} MB -> {total['bytes'] / 1e6:.2f} MB "
+          f"({total['source_bytes'] / max(total['bytes'], 1):.1f}x smaller)")
+    if timing:
+        print(f"Host load time: STL {timing['stl_ms']:.1f} ms, binary {timing['binary_ms']:.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build decimated, quantized binary meshes for the headset")
+    parser.add_argument("urdf", nargs="?", default=str(FRONTEND_PUBLIC / "robot.urdf"))
+    parser.add_argument("--out", type=str, default=str(FRONTEND_PUBLIC / "meshes_lod"))
+    parser.add_argument("--triangle-budget", type=int, default=30000, help="Total triangles across all meshes")
+    parser.add_argument("--json", type=str, default=None, help="Write the size report as JSON to this path")
+    args = parser.parse_args()
+
+    manifest = build_headset_meshes(args.urdf, args.out, args.triangle_budget)
+    timing = decode_time(manifest, args.out, args.urdf)
+    print_report(manifest, timing)
+    if args.json:
+        Path(args.json).write_text(json.dumps({"total": manifest["total"], "load_ms": timing}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Preprocessed mesh cache for the rerun URDF loader.
+
+Meshes are loaded with trimesh once, optionally decimated to a level of detail,
+and stored with their vertex normals as compact ``.npz`` files (float32 vertices
+and normals, uint32 faces). Entries are keyed by a hash of the source file
+contents and the LOD, so editing a mesh invalidates it without any bookkeeping.
+Misses are built in a thread pool.
+
+Decimation uses ``trimesh.Trimesh.simplify_quadric_decimation``, which needs the
+optional ``fast-simplification`` package; without it meshes are cached at full
+resolution.
+
+Usage:
+    python -m kscale_vr_teleop.analysis.mesh_cache URDF [URDF ...] [--max-faces N]   # prebuild
+    python -m kscale_vr_teleop.analysis.mesh_cache --clear
+"""
+import argparse
+import hashlib
+import os
+import shutil
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterable, Optional
+
+import numpy as np
+import trimesh
+
+DEFAULT_CACHE_DIR = Path("~/.cache/kscale_vr_teleop/meshes").expanduser()
+# Bump when the stored layout or the preprocessing changes
+CACHE_VERSION = 1
+# Named levels of detail: maximum faces per mesh (None keeps every face)
+LOD_MAX_FACES = {
+    "full": None,
+    "high": 20000,
+    "medium": 5000,
+    "low": 1000,
+}
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def decimate(mesh: trimesh.Trimesh, max_faces: Optional[int]) -> trimesh.Trimesh:
+    '''
+    Reduces mesh to at most max_faces faces, or returns it unchanged if it is already
+    small enough or fast-simplification is not installed.
+    '''
+    if max_faces is None or len(mesh.faces) <= max_faces:
+        return mesh
+    try:
+        return mesh.simplify_quadric_decimation(face_count=max_faces)
+    except ImportError:
+        if not decimate.warned:
+            warnings.warn("fast-simplification is not installed; meshes are cached at full resolution")
+            decimate.warned = True
+        return mesh
+
+
+decimate.warned = False
+
+
+def build_mesh_arrays(path: str, max_faces: Optional[int]) -> Optional[dict[str, np.ndarray]]:
+    '''
+    Loads, decimates and computes normals for the mesh at path. Returns None for files
+    that load as a multi-mesh scene, which are not cached.
+    '''
+    mesh = trimesh.load_mesh(path)
+    if not isinstance(mesh, trimesh.Trimesh):
+        return None
+    mesh = decimate(mesh, max_faces)
+    return {
+        "vertices": np.asarray(mesh.vertices, dtype=np.float32),
+        "faces": np.asarray(mesh.faces, dtype=np.uint32),
+        "vertex_normals": np.asarray(mesh.vertex_normals, dtype=np.float32),
+    }
+
+
+def mesh_from_arrays(arrays: dict[str, np.ndarray]) -> trimesh.Trimesh:
+    # process=False keeps the cached vertex order so the stored normals stay valid
+    return trimesh.Trimesh(
+        vertices=arrays["vertices"],
+        faces=arrays["faces"],
+        vertex_normals=arrays["vertex_normals"],
+        process=False,
+    )
+
+
+class MeshCache:
+    '''
+    Loads meshes through an on-disk cache of preprocessed arrays.
+
+    cache_dir=None keeps everything in memory (meshes are still preprocessed and
+    loaded in parallel). max_faces is the LOD: an int or a key of LOD_MAX_FACES.
+    '''
+    def __init__(self, cache_dir: Optional[str | Path] = DEFAULT_CACHE_DIR, max_faces: Optional[int | str] = None,
+                 max_workers: Optional[int] = None):
+        self.cache_dir = Path(cache_dir).expanduser() if cache_dir is not None else None
+        self.max_faces = LOD_MAX_FACES[max_faces] if isinstance(max_faces, str) else max_faces
+        self.max_workers = max_workers or min(8, os.cpu_count() or 1)
+        self.meshes: dict[str, Optional[trimesh.Trimesh]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def entry_path(self, path: str) -> Path:
+        lod = "full" if self.max_faces is None else str(self.max_faces)
+        return self.cache_dir / f"v{CACHE_VERSION}" / f"{Path(path).name}.{file_hash(path)}.{lod}.npz"
+
+    def _load_arrays(self, path: str) -> Optional[dict[str, np.ndarray]]:
+        if self.cache_dir is None:
+            self.misses += 1
+            return build_mesh_arrays(path, self.max_faces)
+
+        entry = self.entry_path(path)
+        if entry.exists():
+            try:
+                with np.load(entry) as data:
+                    arrays = {name: data[name] for name in data.files}
+                self.hits += 1
+                return arrays or None
+            except (OSError, ValueError, EOFError):
+                pass  # Corrupt entry, rebuild it
+
+        self.misses += 1
+        arrays = build_mesh_arrays(path, self.max_faces)
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        # Write then rename so concurrent loaders never read a partial file
+        tmp = entry.with_suffix(f".{os.getpid()}.tmp.npz")
+        np.savez(tmp, **(arrays or {}))
+        os.replace(tmp, entry)
+        return arrays
+
+    def load(self, path: str) -> Optional[trimesh.Trimesh]:
+        '''
+        Returns the preprocessed mesh at path, or None if it cannot be cached (scenes).
+        '''
+        path = str(path)
+        if path not in self.meshes:
+            arrays = self._load_arrays(path)
+            self.meshes[path] = mesh_from_arrays(arrays) if arrays is not None else None
+        return self.meshes[path]
+
+    def load_many(self, paths: Iterable[str]) -> dict[str, Optional[trimesh.Trimesh]]:
+        '''
+        Loads all paths, building the missing ones in parallel.
+        '''
+        pending = list(dict.fromkeys(str(p) for p in paths if str(p) not in self.meshes))
+        if len(pending) > 1 and self.max_workers > 1:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                for path, arrays in zip(pending, pool.map(self._load_arrays, pending)):
+                    self.meshes[path] = mesh_from_arrays(arrays) if arrays is not None else None
+        else:
+            for path in pending:
+                self.load(path)
+        return {str(p): self.meshes[str(p)] for p in paths}
+
+    def clear(self):
+        self.meshes.clear()
+        if self.cache_dir is not None and self.cache_dir.exists():
+            shutil.rmtree(self.cache_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prebuild or clear the preprocessed URDF mesh cache")
+    parser.add_argument("urdfs", nargs="*", help="URDF files whose meshes to cache")
+    parser.add_argument("--cache-dir", type=str, default=str(DEFAULT_CACHE_DIR))
+    parser.add_argument("--max-faces", type=str, default=None,
+                        help=f"Faces per mesh, or one of {', '.join(LOD_MAX_FACES)}")
+    parser.add_argument("--clear", action="store_true", help="Delete the cache directory")
+    args = parser.parse_args()
+
+    max_faces = int(args.max_faces) if args.max_faces is not None and args.max_faces.isdigit() else args.max_faces
+    cache = MeshCache(args.cache_dir, max_faces=max_faces)
+    if args.clear:
+        cache.clear()
+        print(f"Cleared {cache.cache_dir}")
+
+    from kscale_vr_teleop.analysis.rerun_loader_urdf import URDFLogger
+    for urdf_path in args.urdfs:
+        paths = URDFLogger(urdf_path, mesh_cache=cache).mesh_paths()
+        cache.hits = cache.misses = 0
+        cache.load_many(paths)
+        print(f"{urdf_path}: {len(paths)} meshes ({cache.hits} cached, {cache.misses} built)")
+
+
+if __name__ == "__main__":
+    main()
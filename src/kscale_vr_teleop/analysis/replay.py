@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Replay a recorded teleop session through the real TrackingHandler and TeleopCore.
+
+The WebSocket and UDP sockets are replaced by in-memory stand-ins, so nothing
+leaves the process. Frames are replayed either at the recorded timing or as fast
+as possible, and the tool reports throughput, per-stage latency percentiles and
+tracking error.
+
+Usage:
+    python -m kscale_vr_teleop.analysis.replay SESSION_DIR_OR_RRD [--realtime] [--json OUT]
+
+SESSION_DIR_OR_RRD is a directory written by SessionRecorder or a rerun .rrd file
+with /right_wrist and /left_wrist transforms.
+"""
+import argparse
+import asyncio
+import json
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import numpy as np
+
+from kscale_vr_teleop._assets import ASSETS_DIR
+from kscale_vr_teleop.tracking_handler import TrackingHandler, kbot_xr_to_urdf_frame, hand_xr_to_urdf_frame
+
+# Inverse of the rotation TrackingHandler applies to controller targets
+_controller_unrotate = {
+    'right': np.array([[0, -1, 0], [1, 0, 0], [0, 0, 1]], dtype=np.float64),  # Rz(+90)
+    'left': np.array([[0, 1, 0], [-1, 0, 0], [0, 0, 1]], dtype=np.float64),   # Rz(-90)
+}
+_xr_from_urdf = np.linalg.inv(kbot_xr_to_urdf_frame)
+_hand_from_urdf = np.linalg.inv(hand_xr_to_urdf_frame)
+
+
+class ReplayWebSocket:
+    '''Stand-in for the headset WebSocket; counts what would have been sent.'''
+    def __init__(self):
+        self.messages = 0
+        self.bytes = 0
+
+    async def send(self, message):
+        self.messages += 1
+        self.bytes += len(message)
+
+
+class ReplayUDPSocket:
+    '''Stand-in for a UDP socket; keeps the send time of every datagram.'''
+    def __init__(self):
+        self.send_times = []
+        self.bytes = 0
+        self.last_payload = None
+
+    def sendto(self, data, address):
+        self.send_times.append(time.perf_counter())
+        self.bytes += len(data)
+        self.last_payload = data
+        return len(data)
+
+    def setsockopt(self, *args):
+        pass
+
+    def setblocking(self, flag):
+        pass
+
+    def close(self):
+        pass
+
+
+def headset_target(wrist_pose: np.ndarray, side: str, tracking_type: str) -> np.ndarray:
+    '''
+    Undoes TrackingHandler._handle_target_location: robot frame wrist pose -> flat
+    column-major headset matrix.
+    '''
+    target = _xr_from_urdf @ wrist_pose
+    if tracking_type == "controller":
+        target[:3, :3] = target[:3, :3] @ _controller_unrotate[side]
+    return target.T.reshape(-1)
+
+
+def headset_fingers(finger_poses: np.ndarray, wrist_pose: np.ndarray) -> np.ndarray:
+    '''
+    Undoes TrackingHandler._handle_joints: wrist-relative finger poses -> flat
+    column-major headset joint matrices.
+    '''
+    wrist_vr = _xr_from_urdf @ wrist_pose
+    fingers = wrist_vr @ _hand_from_urdf @ finger_poses
+    return fingers.transpose(0, 2, 1).reshape(-1)
+
+
+def load_session(path: str) -> dict[str, np.ndarray]:
+    '''
+    Loads a SessionRecorder directory or an .rrd file into replayable columns.
+    '''
+    path = Path(path)
+    if path.is_dir():
+        from kscale_vr_teleop.session_recorder import load_recording
+        return load_recording(path, mmap=False)
+
+    from kscale_vr_teleop.analysis.from_rerun_data import load_wrist_frames
+    frames = load_wrist_frames(str(path))
+    num_frames = len(frames["timestamp"])
+    return {
+        "timestamp": frames["timestamp"],
+        "wrist_poses": frames["wrist_poses"],
+        "use_fingers": np.zeros(num_frames, dtype=bool),
+        "grippers": np.zeros((num_frames, 2)),
+        "joysticks": np.zeros((num_frames, 2, 2)),
+    }
+
+
+def build_messages(session: dict[str, np.ndarray]) -> list[str]:
+    '''
+    Rebuilds the UnifiedTrackingResult messages the headset would have sent.
+    '''
+    messages = []
+    has_fingers = "finger_poses" in session
+    for i in range(len(session["timestamp"])):
+        tracking_type = "hand" if session["use_fingers"][i] else "controller"
+        message = {"type": tracking_type}
+        for side_index, side in enumerate(("right", "left")):
+            wrist_pose = np.asarray(session["wrist_poses"][i, side_index], dtype=np.float64)
+            side_data = {"targetLocation": headset_target(wrist_pose, side, tracking_type).tolist()}
+            if tracking_type == "hand" and has_fingers:
+                finger_poses = np.asarray(session["finger_poses"][i, side_index], dtype=np.float64)
+                side_data["joints"] = headset_fingers(finger_poses, wrist_pose).tolist()
+            else:
+                side_data["joints"] = []
+                # Controller gripper commands are trigger * 0.9
+                side_data["trigger"] = float(session["grippers"][i, side_index]) / 0.9
+                side_data["joystickX"] = float(session["joysticks"][i, side_index, 0])
+                side_data["joystickY"] = float(session["joysticks"][i, side_index, 1])
+            message[side] = side_data
+        messages.append(json.dumps(message))
+    return messages
+
+
+def _timed(stage_times: dict, name: str, fn):
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        stage_times[name].append(time.perf_counter() - start)
+        return result
+    return wrapper
+
+
+async def replay(messages: list[str], timestamps: np.ndarray, ik_solver, realtime: bool = False) -> dict:
+    websocket = ReplayWebSocket()
+    handler = TrackingHandler(websocket, udp_host="127.0.0.1", ik_solver=ik_solver)
+    teleop_core = handler.teleop_core
+    command_sock = ReplayUDPSocket()
+    teleop_core.kinfer_command_handler.sock = command_sock
+    handler.finger_server._udp_sock = ReplayUDPSocket()
+    teleop_core.reset_to_home()
+
+    stage_times = defaultdict(list)
+    # Shadow the solver and sender methods on the instances to time each stage
+    ik_solver.inverse_kinematics = _timed(stage_times, "ik", type(ik_solver).inverse_kinematics.__get__(ik_solver))
+    original_fk = ik_solver.forward_kinematics
+    ik_solver.forward_kinematics = _timed(stage_times, "fk", original_fk)
+    commander = teleop_core.kinfer_command_handler
+    commander.send_commands = _timed(stage_times, "encode_send", commander.send_commands)
+
+    distances = []
+    replay_start = time.perf_counter()
+    try:
+        for i, message in enumerate(messages):
+            if realtime:
+                delay = (timestamps[i] - timestamps[0]) - (time.perf_counter() - replay_start)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            frame_start = time.perf_counter()
+            data = json.loads(message)
+            decoded = time.perf_counter()
+            await handler.handle_tracking(data)
+            frame_end = time.perf_counter()
+            stage_times["decode"].append(decoded - frame_start)
+            stage_times["handle_tracking"].append(frame_end - decoded)
+            stage_times["frame"].append(frame_end - frame_start)
+            distances.append(teleop_core.last_distances)
+            if not realtime:
+                # Let the feedback task run, as it would between frames on a live connection
+                await asyncio.sleep(0)
+    finally:
+        del ik_solver.inverse_kinematics
+        ik_solver.forward_kinematics = original_fk
+        teleop_core.feedback.stop()
+    elapsed = time.perf_counter() - replay_start
+
+    distances = np.array(distances).reshape(-1, 2)
+    recorded_duration = float(timestamps[-1] - timestamps[0]) if len(timestamps) > 1 else 0.0
+    report = {
+        "frames": len(messages),
+        "elapsed_s": elapsed,
+        "frames_per_s": len(messages) / elapsed if elapsed > 0 else 0.0,
+        "recorded_duration_s": recorded_duration,
+        "speedup": recorded_duration / elapsed if elapsed > 0 else 0.0,
+        "commands_sent": len(command_sock.send_times),
+        "command_bytes": command_sock.bytes,
+        "feedback_messages": websocket.messages,
+        "latency_ms": {
+            name: {
+                "p50": float(np.percentile(times, 50) * 1e3),
+                "p90": float(np.percentile(times, 90) * 1e3),
+                "p99": float(np.percentile(times, 99) * 1e3),
+                "max": float(np.max(times) * 1e3),
+            }
+            for name, times in stage_times.items() if times
+        },
+        "tracking_error_m": {
+            side: {
+                "mean": float(np.mean(distances[:, i])) if len(distances) else 0.0,
+                "p95": float(np.percentile(distances[:, i], 95)) if len(distances) else 0.0,
+                "max": float(np.max(distances[:, i])) if len(distances) else 0.0,
+            }
+            for i, side in enumerate(("right", "left"))
+        },
+    }
+    return report
+
+
+def print_report(report: dict):
+    print(f"Frames: {report['frames']} in {report['elapsed_s']:.2f}s "
+          f"({report['frames_per_s']:.1f} frames/s, {report['speedup']:.1f}x recorded speed)")
+    print(f"Commands sent: {report['commands_sent']} | feedback messages: {report['feedback_messages']}")
+    print(f"{'stage':<16}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, stats in report["latency_ms"].items():
+        print(f"{name:<16}{stats['p50']:>10.3f}{stats['p90']:>10.3f}{stats['p99']:>10.3f}{stats['max']:>10.3f}")
+    for side, stats in report["tracking_error_m"].items():
+        print(f"Tracking error {side}: mean {stats['mean'] * 1e3:.1f} mm, "
+              f"p95 {stats['p95'] * 1e3:.1f} mm, max {stats['max'] * 1e3:.1f} mm")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded teleop session through TrackingHandler/TeleopCore")
+    parser.add_argument("session", type=str, help="SessionRecorder directory or rerun .rrd file")
+    parser.add_argument("--realtime", action="store_true", help="Replay at recorded timing instead of as fast as possible")
+    parser.add_argument("--json", type=str, default=None, help="Write the report as JSON to this path")
+    args = parser.parse_args()
+
+    from kscale_vr_teleop.jax_ik import RobotInverseKinematics
+
+    session = load_session(args.session)
+    messages = build_messages(session)
+    print(f"Loaded {len(messages)} frames from {args.session}")
+
+    urdf_path = str(ASSETS_DIR / "kbot_legless" / "robot.urdf")
+    ik_solver = RobotInverseKinematics(urdf_path, ['PRT0001', 'PRT0001_2'], 'base')
+
+    report = asyncio.run(replay(messages, np.asarray(session["timestamp"]), ik_solver, realtime=args.realtime))
+    print_report(report)
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
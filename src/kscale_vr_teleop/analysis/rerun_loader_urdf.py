@@ -12,165 +12,208 @@ from typing import Optional
 from PIL import Image
 import numpy as np
 import rerun as rr  # pip install rerun-sdk
-import scipy.spatial.transform as st
 import trimesh
-from urdf_parser_py import urdf as urdf_parser
-from pathlib import Path
-from line_profiler import profile
+
+from kscale_vr_teleop import tracing
+from kscale_vr_teleop.analysis.mesh_cache import MeshCache
+from kscale_vr_teleop.robot_model import RobotModel, Visual
 
 class URDFLogger:
     """Class to log a URDF to Rerun."""
-    def __init__(self, filepath: str, root_path: str = "") -> None:
-        urdf_contents = open(filepath, 'r').read()
-        urdf_parent_path =Path(filepath).absolute().parent
-        urdf_contents = urdf_contents.replace('filename="', f'filename="{urdf_parent_path}/')
-        self.urdf: urdf_parser.Robot = urdf_parser.URDF.from_xml_string(urdf_contents)
-        self.mat_name_to_mat = {mat.name: mat for mat in self.urdf.materials}
+    def __init__(self, filepath: str, root_path: str = "", angle_tolerance: Optional[float] = 1e-5,
+                 mesh_cache: Optional[MeshCache] = None) -> None:
+        # Same compiled model as the IK solver; mesh and texture paths resolve against the URDF's directory
+        self.model = RobotModel.load(filepath)
         self.entity_to_transform = {}
         self.root_path = root_path
         self.meshes_cache = {}
         self.mesh_data_cache = {}
-        self.joint_transform_set = set()
+        # Preprocessed (normals, optional LOD) meshes shared across runs through an on-disk cache
+        self.mesh_cache = mesh_cache if mesh_cache is not None else MeshCache()
         rr.log(self.root_path + "", rr.ViewCoordinates.RIGHT_HAND_Z_UP, static=True)  # default ROS convention
+
+        # Everything that only depends on the URDF is resolved once here so log() is just array math
+        model = self.model
+        self.link_entity_paths = {}
+        for link_name in model.link_names:
+            link_names = [link_name]
+            while link_names[0] in model.parent_map:
+                link_names.insert(0, model.parent_map[link_names[0]][1])
+            self.link_entity_paths[link_name] = "/".join([n+'/link' for n in link_names])
+        self.joints = list(model.joint_names)
+        self.joint_index = model.joint_index
+        self.joint_entity_paths = [self.root_path + self.link_entity_paths[model.link_names[child]]
+                                   for child in model.joint_children]
+        self.joint_axes = np.array(model.joint_axes, dtype=float)
+        self.movable_joints = np.array([joint_type != 'fixed' for joint_type in model.joint_types])
+        # Visuals of each link, in URDF order
+        self.link_visuals = {link_name: [] for link_name in model.link_names}
+        for visual in model.visuals:
+            self.link_visuals[model.link_names[visual.link]].append(visual)
+        # Only joints whose angle moved by more than this are re-logged (None logs every movable joint)
+        self.angle_tolerance = angle_tolerance
+        self._last_angles = None
+        self._visuals_logged = False
     
-    def link_entity_path(self, link: urdf_parser.Link) -> str:
-        root_name = self.urdf.get_root()
-        link_names = self.urdf.get_chain(root_name, link.name)[0::2]  # skip the joints
-        return "/".join([n+'/link' for n in link_names])
+    def link_entity_path(self, link_name: str) -> str:
+        return self.link_entity_paths[link_name]
 
-    def joint_entity_path(self, joint: urdf_parser.Joint) -> str:
-        return self.link_entity_path(self.urdf.link_map[joint.child])
+    def joint_entity_path(self, joint_name: str) -> str:
+        return self.joint_entity_paths[self.joint_index[joint_name]][len(self.root_path):]
 
-    @profile
-    def log(self, joint_angles: Optional[dict | list | tuple] = None) -> None:
-        """Log the URDF to Rerun using an optional set of joint angles.
+    def joint_angles_array(self, joint_angles: Optional[dict | list | tuple | np.ndarray] = None) -> np.ndarray:
+        """Normalize joint_angles into an array in ``self.joints`` order (missing joints are 0.0).
 
         joint_angles may be:
         - None: all joints default to 0.0
-        - dict mapping joint name -> angle (radians for revolute/continuous, meters for prismatic)
-        - list/tuple/ndarray providing angles in the same order as ``self.urdf.joints``
+        - dict mapping joint name -> angle (radians), or joint name -> array of angles for a batch
+        - list/tuple/ndarray providing angles in the same order as ``self.joints``
+          (last axis indexes joints for a batch)
         """
-        # Normalize joint_angles into a name->float map
         if joint_angles is None:
-            joint_map = {}
-        elif isinstance(joint_angles, (list, tuple, np.ndarray)):
-            joint_map = {j.name: float(joint_angles[i]) if i < len(joint_angles) else 0.0 for i, j in enumerate(self.urdf.joints)}
-        elif isinstance(joint_angles, dict):
-            joint_map = {str(k): float(v) for k, v in joint_angles.items()}
-        else:
-            raise TypeError("joint_angles must be None, dict, or list/tuple/ndarray")
-
-
-        for joint in self.urdf.joints:
-            entity_path = self.joint_entity_path(joint)
-            angle = float(joint_map.get(joint.name, 0.0))
-            self.log_joint(entity_path, joint, angle)
-
-        for link in self.urdf.links:
-            entity_path = self.link_entity_path(link)
-            self.log_link(entity_path, link)
+            return np.zeros(len(self.joints))
+        if isinstance(joint_angles, dict):
+            values = {str(k): np.asarray(v, dtype=float) for k, v in joint_angles.items()}
+            batch_shape = np.broadcast_shapes(*(v.shape for v in values.values())) if values else ()
+            angles = np.zeros(batch_shape + (len(self.joints),))
+            for name, value in values.items():
+                if name in self.joint_index:
+                    angles[..., self.joint_index[name]] = value
+            return angles
+        if isinstance(joint_angles, (list, tuple, np.ndarray)):
+            joint_angles = np.asarray(joint_angles, dtype=float)
+            angles = np.zeros(joint_angles.shape[:-1] + (len(self.joints),))
+            count = min(joint_angles.shape[-1], len(self.joints))
+            angles[..., :count] = joint_angles[..., :count]
+            return angles
+        raise TypeError("joint_angles must be None, dict, or list/tuple/ndarray")
+
+    def joint_quaternions(self, angles: np.ndarray, joint_indices: Optional[np.ndarray] = None) -> np.ndarray:
+        """Quaternions (xyzw) of the rotation of each joint about its axis.
+
+        angles has shape (..., num_joints), or (..., len(joint_indices)) for a subset of joints.
+        """
+        axes = self.joint_axes if joint_indices is None else self.joint_axes[joint_indices]
+        half = 0.5 * np.asarray(angles)[..., None]
+        return np.concatenate([axes * np.sin(half), np.cos(half)], axis=-1)
 
-    def log_link(self, entity_path: str, link: urdf_parser.Link) -> None:
-        for i, visual in enumerate(link.visuals):
-            self.log_visual(entity_path + f"/visual_{i}", visual)
+    def _log_joint_origins(self) -> None:
+        for origin, entity_path in zip(self.model.joint_origins, self.joint_entity_paths):
+            translation = origin[:3, 3]
+            rotation = origin[:3, :3]
+            rr.log(entity_path[:-len('/link')], rr.Transform3D(translation=translation, mat3x3=rotation), static=True)
 
-    @profile
-    def log_joint(self, entity_path: str, joint: urdf_parser.Joint, angle: float = 0.0) -> None:
-        """Log a joint transform, applying the provided joint angle.
+    @tracing.traced()
+    def log(self, joint_angles: Optional[dict | list | tuple] = None) -> None:
+        """Log the URDF to Rerun using an optional set of joint angles.
 
-        For revolute/continuous joints the angle is interpreted as radians and a rotation
-        about the joint axis is applied. For prismatic joints the angle is interpreted
-        as a linear displacement along the joint axis (meters).
+        See ``joint_angles_array`` for the accepted forms of joint_angles. Joint origins and
+        visuals are logged on the first call only; afterwards only joints whose angle changed
+        are re-logged.
         """
-        # Start from the joint origin (if present)
-
-        if entity_path not in self.joint_transform_set:
-            base_trans = np.zeros(3, dtype=float)
-            base_rot = np.eye(3, dtype=float)
-
-            if joint.origin is not None and joint.origin.xyz is not None:
-                base_trans = np.array(joint.origin.xyz, dtype=float)
+        angles = self.joint_angles_array(joint_angles)
+        if self._last_angles is None:
+            self._log_joint_origins()
+            changed = np.arange(len(self.joints))
+        elif self.angle_tolerance is None:
+            changed = np.flatnonzero(self.movable_joints)
+        else:
+            changed = np.flatnonzero(np.abs(angles - self._last_angles) > self.angle_tolerance)
+        self._last_angles = angles
+
+        quaternions = self.joint_quaternions(angles[changed], changed)
+        # One rr.log per changed joint: every joint is its own entity and rerun (0.24) has no
+        # call that writes several entities at once. send_columns batches over time, not
+        # entities, so it only helps for recorded trajectories (log_columns).
+        for i, quaternion in zip(changed, quaternions):
+            rr.log(self.joint_entity_paths[i], rr.Transform3D.from_fields(quaternion=quaternion))
+
+        if not self._visuals_logged:
+            self.mesh_data_cache.update(self.mesh_cache.load_many(self.mesh_paths()))
+            for link_name in self.model.link_names:
+                self.log_link(self.link_entity_paths[link_name], link_name)
+            self._visuals_logged = True
+
+    def log_columns(self, times: np.ndarray, joint_angles, timeline: str = "time") -> None:
+        """Log a batch of N joint configurations at once with the columnar API.
+
+        times are N timestamps in seconds on ``timeline``; joint_angles is an (N, num_joints)
+        array or a dict mapping joint name -> N angles. Sends one column per movable joint.
+        """
+        if self._last_angles is None:
+            self.log()
+        angles = self.joint_angles_array(joint_angles)
+        quaternions = self.joint_quaternions(angles)
+        indexes = [rr.TimeColumn(timeline, timestamp=np.asarray(times, dtype=float))]
+        for i in np.flatnonzero(self.movable_joints):
+            rr.send_columns(
+                self.joint_entity_paths[i],
+                indexes=indexes,
+                columns=rr.Transform3D.columns(quaternion=quaternions[:, i]),
+            )
+        self._last_angles = angles[-1]
 
-            if joint.origin is not None and joint.origin.rpy is not None:
-                base_rot = st.Rotation.from_euler("xyz", joint.origin.rpy).as_matrix()
+    def log_link(self, entity_path: str, link_name: str) -> None:
+        for i, visual in enumerate(self.link_visuals[link_name]):
+            self.log_visual(entity_path + f"/visual_{i}", visual)
 
-            origin_transform = np.eye(4, dtype=float)
-            origin_transform[:3, :3] = base_rot
-            origin_transform[:3, 3] = base_trans
-            rr.log(self.root_path + entity_path[:-len('/link')], rr.Transform3D(translation=origin_transform[:3, 3], mat3x3=origin_transform[:3, :3]), static=True)
-            joint_axis = joint.axis if joint.axis is not None else [1, 0, 0]
-            rr.log(self.root_path + entity_path, rr.Transform3D.from_fields(quaternion=st.Rotation.from_rotvec(np.array(joint_axis) * angle).as_quat()))
-            self.joint_transform_set.add(entity_path)
-        else:
-            joint_axis = joint.axis if joint.axis is not None else [1, 0, 0]
-            rr.log(self.root_path + entity_path, rr.Transform3D.from_fields(quaternion=st.Rotation.from_rotvec(np.array(joint_axis) * angle).as_quat()))
+    def mesh_paths(self) -> list[str]:
+        """Resolved paths of every mesh file referenced by a visual."""
+        return [resolve_ros_path(self.model.resolve(visual.filename))
+                for visual in self.model.visuals if visual.geometry == "mesh"]
 
     def load_mesh(self, path):
-        if path not in self.mesh_data_cache:
-            self.mesh_data_cache[path] = trimesh.load_mesh(path)
+        if self.mesh_data_cache.get(path) is None:
+            # Files that are not a single mesh (scenes) bypass the cache
+            self.mesh_data_cache[path] = self.mesh_cache.load(path) or trimesh.load_mesh(path)
         return self.mesh_data_cache[path]
 
-    @profile
-    def log_visual(self, entity_path: str, visual: urdf_parser.Visual) -> None:
+    @tracing.traced()
+    def log_visual(self, entity_path: str, visual: Visual) -> None:
         if entity_path in self.meshes_cache:
             return
-        material = None
-        if visual.material is not None:
-            if visual.material.color is None and visual.material.texture is None:
-                material = self.mat_name_to_mat[visual.material.name]
-            else:
-                material = visual.material
-
-        transform = np.eye(4)
-        if visual.origin is not None and visual.origin.xyz is not None:
-            transform[:3, 3] = visual.origin.xyz
-        if visual.origin is not None and visual.origin.rpy is not None:
-            transform[:3, :3] = st.Rotation.from_euler("xyz", visual.origin.rpy).as_matrix()
-
-        if isinstance(visual.geometry, urdf_parser.Mesh):
-            resolved_path = resolve_ros_path(visual.geometry.filename)
-            mesh_scale = visual.geometry.scale
+        texture_path = resolve_ros_path(self.model.resolve(visual.texture)) if visual.texture else None
+
+        transform = visual.origin.copy()
+
+        if visual.geometry == "mesh":
+            resolved_path = resolve_ros_path(self.model.resolve(visual.filename))
             mesh_or_scene = self.load_mesh(resolved_path)#
-            if mesh_scale is not None:
-                transform[:3, :3] *= mesh_scale
-        elif isinstance(visual.geometry, urdf_parser.Box):
-            mesh_or_scene = trimesh.creation.box(extents=visual.geometry.size)
-        elif isinstance(visual.geometry, urdf_parser.Cylinder):
+            transform[:3, :3] *= visual.scale
+        elif visual.geometry == "box":
+            mesh_or_scene = trimesh.creation.box(extents=visual.size)
+        elif visual.geometry == "cylinder":
             mesh_or_scene = trimesh.creation.cylinder(
-                radius=visual.geometry.radius,
-                height=visual.geometry.length,
+                radius=visual.size[0],
+                height=visual.size[1],
             )
-        elif isinstance(visual.geometry, urdf_parser.Sphere):
+        elif visual.geometry == "sphere":
             mesh_or_scene = trimesh.creation.icosphere(
-                radius=visual.geometry.radius,
+                radius=visual.size[0],
             )
         else:
             rr.log(self.root_path + 
                 "",
-                rr.TextLog("Unsupported geometry type: " + str(type(visual.geometry))),
+                rr.TextLog("Unsupported geometry type on link " + self.model.link_names[visual.link]),
             )
             mesh_or_scene = trimesh.Trimesh()
         
         if isinstance(mesh_or_scene, trimesh.Scene):
             scene = mesh_or_scene
             for i, mesh in enumerate(scene.dump()):
-                if material is not None:
-                    if material.color is not None:
-                        mesh.visual = trimesh.visual.ColorVisuals()
-                        mesh.visual.vertex_colors = material.color.rgba
-                    elif material.texture is not None:
-                        texture_path = resolve_ros_path(material.texture.filename)
-                        mesh.visual = trimesh.visual.texture.TextureVisuals(image=Image.open(texture_path))
+                if visual.color is not None:
+                    mesh.visual = trimesh.visual.ColorVisuals()
+                    mesh.visual.vertex_colors = visual.color
+                elif texture_path is not None:
+                    mesh.visual = trimesh.visual.texture.TextureVisuals(image=Image.open(texture_path))
                 log_trimesh(self.root_path + entity_path+f"/{i}", mesh)
         else:
             mesh = mesh_or_scene
-            if material is not None:
-                if material.color is not None:
-                    mesh.visual = trimesh.visual.ColorVisuals()
-                    mesh.visual.vertex_colors = material.color.rgba
-                elif material.texture is not None:
-                    texture_path = resolve_ros_path(material.texture.filename)
-                    mesh.visual = trimesh.visual.texture.TextureVisuals(image=Image.open(texture_path))
+            if visual.color is not None:
+                mesh.visual = trimesh.visual.ColorVisuals()
+                mesh.visual.vertex_colors = visual.color
+            elif texture_path is not None:
+                mesh.visual = trimesh.visual.texture.TextureVisuals(image=Image.open(texture_path))
             log_trimesh(self.root_path + entity_path, mesh)
         self.meshes_cache[entity_path] = mesh
 
@@ -255,6 +298,7 @@ This is an example executable data-loader plugin for the Rerun Viewer.
     )
     parser.add_argument("filepath", type=str)
     parser.add_argument("--recording-id", type=str)
+    parser.add_argument("--max-faces", type=int, default=None, help="Decimate meshes to at most this many faces")
     args = parser.parse_args()
 
     is_file = os.path.isfile(args.filepath)
@@ -266,7 +310,7 @@ This is an example executable data-loader plugin for the Rerun Viewer.
     rr.init("rerun_example_external_data_loader_urdf", recording_id=args.recording_id)
     rr.stdout()
 
-    urdf_logger = URDFLogger(args.filepath)
+    urdf_logger = URDFLogger(args.filepath, mesh_cache=MeshCache(max_faces=args.max_faces))
     urdf_logger.log()
 
 
@@ -0,0 +1,7 @@
+"""benchmarks subpackage for kscale_vr_teleop"""
+
+__all__ = [
+    "trajectories",
+    "run",
+    "headset_simulator",
+]
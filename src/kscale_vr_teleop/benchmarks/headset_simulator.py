@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Headset traffic simulator for load-testing signaling.py.
+
+Connects to the signaling server as one or more ``role: teleop`` clients and
+streams tracking frames in the UnifiedTrackingResult shape from
+frontend/src/lib/tracking.ts, at a configurable rate and jitter. Every few frames
+an ``echo`` message is sent in the same stream; the server answers it as soon as
+it gets to it, which gives the round-trip latency. (The ``ack`` in the kinematics
+feedback is not used for this: feedback is rate-limited and skipped when nothing
+changed, so acks would add up to a feedback period.) Frames are also stamped
+with a capture time and the server's clock pings are answered, so the server's
+motion-to-UDP latency distribution is collected at the end of each step. The UDP
+commands the server emits are counted on a local receiver.
+
+Every combination of --clients and --rate is run as one step, so a sweep shows
+where the output command rate stops following the offered load.
+
+Usage:
+    python -m kscale_vr_teleop.benchmarks.headset_simulator --clients 1 2 4 --rate 40 80 --duration 10
+    python -m kscale_vr_teleop.benchmarks.headset_simulator --session ~/.vr_teleop_logs/<date>/session_<time>
+    python -m kscale_vr_teleop.benchmarks.headset_simulator --unified   # server started with --unified-commands
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import numpy as np
+import websockets
+
+from kscale_vr_teleop import command_conn
+from kscale_vr_teleop.analysis.replay import build_messages, headset_fingers, headset_target, load_session
+from kscale_vr_teleop.benchmarks.trajectories import synthetic_finger_poses
+
+# IK targets at the TeleopCore home pose (FK of the reset_to_home joints), base frame
+HOME_TARGETS = {
+    "right": np.array([
+        [0.0, 0.0, -1.0, 0.106],
+        [-0.174, -0.985, 0.0, -0.267],
+        [-0.985, 0.174, 0.0, -0.173],
+        [0.0, 0.0, 0.0, 1.0],
+    ]),
+    "left": np.array([
+        [0.0, 0.0, -1.0, 0.107],
+        [-0.174, 0.985, 0.0, 0.263],
+        [0.985, 0.174, 0.0, -0.173],
+        [0.0, 0.0, 0.0, 1.0],
+    ]),
+}
+# TeleopCore.base_to_head_transform is a 0.25 m lift; wrist poses are relative to the head
+HEAD_HEIGHT = 0.25
+
+
+def synthetic_messages(num_frames: int, rate_hz: float, mode: str, radius: float = 0.05) -> list[str]:
+    '''
+    Wrists circling the home targets; in "hand" mode with curling fingers.
+    '''
+    t = np.arange(num_frames) / rate_hz
+    fingers = {side: synthetic_finger_poses(num_frames, seed=i) for i, side in enumerate(("right", "left"))}
+    messages = []
+    for i in range(num_frames):
+        message = {"type": mode}
+        for side in ("right", "left"):
+            wrist = HOME_TARGETS[side].copy()
+            wrist[2, 3] -= HEAD_HEIGHT
+            wrist[0, 3] += radius * np.cos(2 * np.pi * 0.25 * t[i])
+            wrist[2, 3] += radius * np.sin(2 * np.pi * 0.25 * t[i])
+            side_data = {"targetLocation": headset_target(wrist, side, mode).tolist()}
+            if mode == "hand":
+                side_data["joints"] = headset_fingers(fingers[side][i].astype(np.float64), wrist).tolist()
+            else:
+                side_data.update({"joints": [], "trigger": 0.5, "grip": 0.0, "joystickX": 0.0, "joystickY": 0.0,
+                                  "buttons": [False] * 6})
+            message[side] = side_data
+        messages.append(json.dumps(message))
+    return messages
+
+
+class UDPCommandCounter(asyncio.DatagramProtocol):
+    '''Counts the command datagrams the server sends to the robot address.'''
+    def __init__(self):
+        self.count = 0
+
+    def datagram_received(self, data, addr):
+        self.count += 1
+
+
+async def run_client(url: str, robot_ip: str, messages: list[str], rate_hz: float, jitter_ms: float,
+                     duration: float, feedback_rate: float | None, rng: np.random.Generator, echo_every: int = 5) -> dict:
+    # Echo id -> send time of the echoes still unanswered
+    send_times = {}
+    round_trips = []
+    stats = {"sent": 0, "feedback": 0, "latency": None}
+    latency_received = asyncio.Event()
+
+    async with websockets.connect(url, max_size=None) as websocket:
+        await websocket.send(json.dumps({"role": "teleop", "robot_ip": robot_ip}))
+        if feedback_rate is not None:
+            await websocket.send(json.dumps({"type": "feedback_config", "rate": feedback_rate}))
+
+        async def receive():
+            async for reply in websocket:
+                received = time.perf_counter()
+                if isinstance(reply, bytes):
+                    continue
+                data = json.loads(reply)
+                if data.get("type") == "clock_ping":
+                    # Same monotonic clock as the server on one host, so the estimated offset should be ~0
+                    await websocket.send(json.dumps({"type": "clock_pong", "t0": data["t0"],
+                                                     "t1": time.perf_counter() * 1e3}))
+                    continue
+                if data.get("type") == "echo":
+                    echo_id = data.get("id")
+                    sent = send_times.pop(echo_id, None)
+                    if sent is not None:
+                        round_trips.append(received - sent)
+                    # Echoes are answered in order: older ones still pending were lost
+                    for stale in [i for i in send_times if i < echo_id]:
+                        del send_times[stale]
+                    continue
+                if data.get("type") == "latency":
+                    stats["latency"] = data
+                    latency_received.set()
+                    continue
+                if data.get("type") != "kinematics":
+                    continue
+                stats["feedback"] += 1
+
+        receiver = asyncio.create_task(receive())
+        start = time.perf_counter()
+        next_send = start
+        frame_id = 0
+        while next_send - start < duration:
+            delay = next_send - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            message = messages[frame_id % len(messages)]
+            # Prepend the id and capture time without re-encoding the frame
+            await websocket.send(f'{{"id": {frame_id}, "t": {time.perf_counter() * 1e3}, {message[1:]}')
+            stats["sent"] += 1
+            if frame_id % echo_every == 0:
+                send_times[frame_id] = time.perf_counter()
+                await websocket.send(json.dumps({"type": "echo", "id": frame_id}))
+            frame_id += 1
+            next_send += 1.0 / rate_hz + rng.normal(0.0, jitter_ms * 1e-3)
+        # Let the last replies arrive, then collect the server's latency distribution
+        await asyncio.sleep(0.5)
+        await websocket.send(json.dumps({"type": "latency"}))
+        try:
+            await asyncio.wait_for(latency_received.wait(), timeout=2.0)
+        except asyncio.TimeoutError:
+            pass
+        receiver.cancel()
+
+    stats["round_trips"] = round_trips
+    return stats
+
+
+async def run_step(args, messages: list[str], num_clients: int, rate_hz: float) -> dict:
+    loop = asyncio.get_running_loop()
+    transport, counter = await loop.create_datagram_endpoint(
+        UDPCommandCounter, local_addr=(args.robot_ip, args.udp_port), reuse_port=True)
+    rng = np.random.default_rng(args.seed)
+    start = time.perf_counter()
+    try:
+        results = await asyncio.gather(*(
+            run_client(args.url, args.robot_ip, messages, rate_hz, args.jitter_ms, args.duration, args.feedback_rate,
+                       np.random.default_rng(rng.integers(1 << 31)), args.echo_every)
+            for _ in range(num_clients)
+        ))
+    finally:
+        elapsed = time.perf_counter() - start
+        transport.close()
+
+    round_trips = np.concatenate([r["round_trips"] for r in results]) * 1e3 if results else np.zeros(0)
+    latencies = [r["latency"] for r in results if r["latency"] is not None]
+    active = args.duration
+    return {
+        "clients": num_clients,
+        "offered_hz": num_clients * rate_hz,
+        "sent_hz": sum(r["sent"] for r in results) / active,
+        "feedback_hz": sum(r["feedback"] for r in results) / active,
+        "udp_hz": counter.count / elapsed,
+        "rtt_ms": {
+            "n": int(round_trips.size),
+            "p50": float(np.percentile(round_trips, 50)) if round_trips.size else None,
+            "p90": float(np.percentile(round_trips, 90)) if round_trips.size else None,
+            "p99": float(np.percentile(round_trips, 99)) if round_trips.size else None,
+        },
+        # Server-side capture-to-UDP latency and clock estimate, per client
+        "motion_to_udp_ms": [latency["motion_to_udp"] for latency in latencies],
+        "clock": [latency["clock"] for latency in latencies],
+    }
+
+
+def print_step(step: dict):
+    rtt = step["rtt_ms"]
+    rtt_text = "no replies" if rtt["n"] == 0 else f"{rtt['p50']:8.2f}{rtt['p90']:8.2f}{rtt['p99']:8.2f}"
+    latency_text = "  ".join(
+        f"{m['p50_ms']:.1f}/{m['p99_ms']:.1f}" if m.get("n") else "-" for m in step["motion_to_udp_ms"])
+    print(f"{step['clients']:>7}{step['offered_hz']:>10.1f}{step['sent_hz']:>10.1f}{step['udp_hz']:>10.1f}"
+          f"{step['feedback_hz']:>10.1f}  {rtt_text}  {latency_text}")
+
+
+async def main_async(args):
+    if args.session:
+        messages = build_messages(load_session(args.session))
+    else:
+        messages = synthetic_messages(int(max(args.rate) * 20), max(args.rate), args.mode)
+    print(f"Streaming {len(messages)} distinct frames to {args.url}, commands counted on {args.robot_ip}:{args.udp_port}")
+    print(f"{'clients':>7}{'offered':>10}{'sent':>10}{'udp':>10}{'feedback':>10}  {'rtt p50':>8}{'p90':>8}{'p99':>8}  motion-to-udp p50/p99")
+
+    steps = []
+    for num_clients in args.clients:
+        for rate_hz in args.rate:
+            step = await run_step(args, messages, num_clients, rate_hz)
+            print_step(step)
+            steps.append(step)
+    return steps
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate headset teleop clients against signaling.py")
+    parser.add_argument("--url", type=str, default="ws://localhost:8013")
+    parser.add_argument("--robot-ip", type=str, default="127.0.0.1",
+                        help="robot_ip sent in the handshake; commands are counted on this address")
+    parser.add_argument("--udp-port", type=int, default=None,
+                        help="Port the server sends commands to (default: 10000, or the unified port with --unified)")
+    parser.add_argument("--unified", action="store_true",
+                        help="The server runs with --unified-commands; count commands on the unified command port")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1], help="Client counts to sweep")
+    parser.add_argument("--rate", type=float, nargs="+", default=[40.0], help="Per-client frame rates (Hz) to sweep")
+    parser.add_argument("--jitter-ms", type=float, default=2.0, help="Std dev of send interval jitter")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per step")
+    parser.add_argument("--mode", choices=["controller", "hand"], default="controller")
+    parser.add_argument("--session", type=str, default=None, help="Replay frames from a recorded session instead")
+    parser.add_argument("--feedback-rate", type=float, default=None,
+                        help="Ask the server for feedback at this rate (Hz); default keeps the server's rate")
+    parser.add_argument("--echo-every", type=int, default=5, help="Frames between round-trip echo messages")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", type=str, default=None, help="Write the step results as JSON to this path")
+    args = parser.parse_args()
+    if args.udp_port is None:
+        args.udp_port = command_conn.UNIFIED_PORT if args.unified else 10000
+
+    steps = asyncio.run(main_async(args))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(steps, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,435 @@
+#!/usr/bin/env python3
+"""
+Simulated K-Bot arms for closed-loop tracking and latency benchmarks.
+
+Receives the Commander16 UDP stream (or unified command frames), applies a
+configurable transport delay, jitter and loss, and integrates every arm joint as
+a PD-controlled double integrator with the velocity and position limits from the
+URDF. Tracking error is reported against the commanded joints and end effector
+poses and, in --benchmark mode, against the operator-intended wrist targets.
+
+--serve stands in for the robot behind a running signaling.py (point the
+headset or headset_simulator at robot_ip 127.0.0.1). --benchmark drives the real
+TrackingHandler/TeleopCore with a synthetic or recorded headset stream at its
+recorded timing and sends the commands over loopback UDP to the simulator, which
+gives a repeatable end-to-end number for any change to the pipeline.
+
+Usage:
+    python -m kscale_vr_teleop.benchmarks.robot_simulator --serve [--port 10000] [--delay-ms 20 --loss 0.01]
+    python -m kscale_vr_teleop.benchmarks.robot_simulator --benchmark [--duration 20] [--session SESSION_DIR]
+    python -m kscale_vr_teleop.benchmarks.robot_simulator --benchmark --motion reaching --delay-ms 40 --predict-ms 140
+"""
+import argparse
+import asyncio
+import heapq
+import json
+import socket
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+import numpy as np
+
+from kscale_vr_teleop._assets import ASSETS_DIR
+from kscale_vr_teleop.robot_model import RobotModel
+
+URDF_PATH = str(ASSETS_DIR / "kbot_legless" / "robot.urdf")
+EE_LINKS = ['PRT0001', 'PRT0001_2']
+# IK joint order (RobotInverseKinematics.active_joints) and the Commander16 key of each joint
+ARM_JOINTS = [
+    'dof_right_shoulder_pitch_03',
+    'dof_right_shoulder_roll_03',
+    'dof_right_shoulder_yaw_02',
+    'dof_right_elbow_02',
+    'dof_right_wrist_00',
+    'dof_left_shoulder_pitch_03',
+    'dof_left_shoulder_roll_03',
+    'dof_left_shoulder_yaw_02',
+    'dof_left_elbow_02',
+    'dof_left_wrist_00',
+]
+COMMAND_KEYS = [
+    "rshoulderpitch", "rshoulderroll", "rshoulderyaw", "relbowpitch", "rwristroll",
+    "lshoulderpitch", "lshoulderroll", "lshoulderyaw", "lelbowpitch", "lwristroll",
+]
+
+
+def joint_limits(urdf_path: str, joints: list[str]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    '''
+    Returns (lower, upper, max velocity) of the named joints from the URDF.
+    '''
+    model = RobotModel.load(urdf_path)
+    limits = model.joint_limits[[model.joint_index[name] for name in joints]]
+    return limits[:, 0], limits[:, 1], limits[:, 2]
+
+
+def _per_joint(value, num_joints: int) -> np.ndarray:
+    value = np.atleast_1d(np.asarray(value, dtype=np.float64))
+    return np.broadcast_to(value, (num_joints,)).copy()
+
+
+class SimulatedRobot:
+    '''
+    Arm joints driven by delayed, lossy joint commands.
+
+    Every joint follows qdd = kp * (q_cmd - q) - kd * qd (kp in 1/s^2, kd in 1/s, so
+    the defaults are critically damped at 20 rad/s), integrated with semi-implicit
+    Euler at physics_rate. Velocities are clipped to the URDF limit times
+    velocity_scale and positions to the URDF range. Commands take effect delay ±
+    jitter seconds after they arrive, or never with probability loss.
+
+    Time is explicit: receive() stamps arrivals and advance() integrates up to a
+    given perf_counter time in fixed steps, so a late-scheduled thread catches up
+    exactly instead of changing the dynamics.
+
+    history bounds the logged samples and arrivals to that many seconds (None keeps
+    everything, as a benchmark run needs); a long-running --serve sets it.
+    '''
+    def __init__(self, urdf_path: str = URDF_PATH, kp=400.0, kd=40.0, delay: float = 0.0, jitter: float = 0.0,
+                 loss: float = 0.0, velocity_scale: float = 1.0, physics_rate: float = 1000.0,
+                 log_rate: float = 200.0, initial=None, seed: int = 0, history: float = None):
+        num_joints = len(ARM_JOINTS)
+        self.lower, self.upper, velocity = joint_limits(urdf_path, ARM_JOINTS)
+        self.max_velocity = velocity * velocity_scale
+        self.kp = _per_joint(kp, num_joints)
+        self.kd = _per_joint(kd, num_joints)
+        self.delay = delay
+        self.jitter = jitter
+        self.loss = loss
+        self.dt = 1.0 / physics_rate
+        self._log_every = max(1, int(round(physics_rate / log_rate)))
+        self.history = history
+        log_size = None if history is None else int(np.ceil(history * physics_rate / self._log_every)) + 1
+        self._rng = np.random.default_rng(seed)
+
+        self.q = np.zeros(num_joints) if initial is None else np.array(initial, dtype=np.float64)
+        self.qd = np.zeros(num_joints)
+        self.q_cmd = self.q.copy()
+        self.sim_time = None
+        self._steps = 0
+        # Commands in flight: (due time, arrival order, joint vector)
+        self._pending = []
+        self._lock = threading.Lock()
+        self._log_time, self._log_q, self._log_cmd = (deque(maxlen=log_size) for _ in range(3))
+        self._arrival_time, self._arrival_cmd = deque(), deque()
+
+        self.received = 0
+        self.lost = 0
+        self.applied = 0
+        self.invalid = 0
+
+    def receive(self, data: bytes, arrival: float = None) -> bool:
+        '''
+        Queues one Commander16 or unified command datagram. Returns False if it was
+        dropped (invalid or lost).
+        '''
+        arrival = time.perf_counter() if arrival is None else arrival
+        try:
+            commands = json.loads(data)["commands"]
+            q_cmd = np.array([commands[key] for key in COMMAND_KEYS], dtype=np.float64)
+        except (ValueError, KeyError, TypeError):
+            self.invalid += 1
+            return False
+        with self._lock:
+            self.received += 1
+            # Lost commands still count as sent: the error reference is what the server sent
+            self._arrival_time.append(arrival)
+            self._arrival_cmd.append(q_cmd)
+            if self.history is not None:
+                self._discard_arrivals(arrival - self.history)
+            if self._rng.random() < self.loss:
+                self.lost += 1
+                return False
+            delay = self.delay + (self._rng.normal(0.0, self.jitter) if self.jitter else 0.0)
+            heapq.heappush(self._pending, (arrival + max(0.0, delay), self.received, q_cmd))
+        return True
+
+    def advance(self, until: float):
+        '''
+        Integrates the joints up to perf_counter time until.
+        '''
+        with self._lock:
+            if self.sim_time is None:
+                self.sim_time = until
+                return
+            while self.sim_time + self.dt <= until:
+                while self._pending and self._pending[0][0] <= self.sim_time:
+                    self.q_cmd = heapq.heappop(self._pending)[2]
+                    self.applied += 1
+                qdd = self.kp * (self.q_cmd - self.q) - self.kd * self.qd
+                self.qd = np.clip(self.qd + qdd * self.dt, -self.max_velocity, self.max_velocity)
+                self.q += self.qd * self.dt
+                at_limit = (self.q < self.lower) | (self.q > self.upper)
+                if at_limit.any():
+                    self.q = np.clip(self.q, self.lower, self.upper)
+                    self.qd[at_limit] = 0.0
+                self.sim_time += self.dt
+                self._steps += 1
+                if self._steps % self._log_every == 0:
+                    self._log_time.append(self.sim_time)
+                    self._log_q.append(self.q.copy())
+                    self._log_cmd.append(self.q_cmd)
+
+    def _discard_arrivals(self, before: float):
+        # Keep the last command sent before the cut: it is the reference until the next one
+        while len(self._arrival_time) > 1 and self._arrival_time[1] <= before:
+            self._arrival_time.popleft()
+            self._arrival_cmd.popleft()
+
+    def trajectory(self, since: float = -np.inf, discard: bool = False) -> dict[str, np.ndarray]:
+        '''
+        Logged samples at log_rate from time since: time, joints and applied command,
+        plus every command as it arrived (before delay and loss). discard drops
+        everything older than since, for callers that only ever look forward.
+        '''
+        with self._lock:
+            if discard:
+                while self._log_time and self._log_time[0] < since:
+                    self._log_time.popleft()
+                    self._log_q.popleft()
+                    self._log_cmd.popleft()
+                self._discard_arrivals(since)
+            log_time = np.array(self._log_time)
+            arrival_time = np.array(self._arrival_time)
+            first = int(np.searchsorted(log_time, since))
+            first_arrival = max(0, int(np.searchsorted(arrival_time, since, side='right')) - 1)
+            return {
+                "time": log_time[first:],
+                "q": np.array(list(self._log_q)[first:]).reshape(-1, len(ARM_JOINTS)),
+                "q_cmd": np.array(list(self._log_cmd)[first:]).reshape(-1, len(ARM_JOINTS)),
+                "sent_time": arrival_time[first_arrival:],
+                "sent_q": np.array(list(self._arrival_cmd)[first_arrival:]).reshape(-1, len(ARM_JOINTS)),
+            }
+
+    def transport_stats(self) -> dict:
+        return {"received": self.received, "lost": self.lost, "applied": self.applied, "invalid": self.invalid}
+
+    def serve(self, host: str, port: int, stop: threading.Event):
+        '''
+        Receives commands on a UDP socket and integrates in real time until stop is set.
+        '''
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind((host, port))
+        sock.settimeout(self.dt)
+        self.advance(time.perf_counter())
+        try:
+            while not stop.is_set():
+                try:
+                    data, _ = sock.recvfrom(4096)
+                    self.receive(data, time.perf_counter())
+                except socket.timeout:
+                    pass
+                self.advance(time.perf_counter())
+        finally:
+            sock.close()
+
+    def start(self, host: str = "127.0.0.1", port: int = 10000) -> threading.Event:
+        '''Runs serve() in a daemon thread; set the returned event to stop it.'''
+        stop = threading.Event()
+        self._thread = threading.Thread(target=self.serve, args=(host, port, stop), daemon=True)
+        self._thread.start()
+        return stop
+
+
+def _error_stats(errors: np.ndarray, scale: float = 1.0) -> dict:
+    if len(errors) == 0:
+        return {"n": 0}
+    errors = errors * scale
+    return {
+        "n": int(len(errors)),
+        "rms": float(np.sqrt(np.mean(errors ** 2))),
+        "p50": float(np.percentile(errors, 50)),
+        "p95": float(np.percentile(errors, 95)),
+        "max": float(np.max(errors)),
+    }
+
+
+def batch_forward_kinematics(ik_solver, joints: np.ndarray) -> np.ndarray:
+    '''End effector poses of many configurations: N x 10 -> N x 2 x 4 x 4.'''
+    import jax
+    if len(joints) == 0:
+        return np.zeros((0, len(EE_LINKS), 4, 4))
+    return np.asarray(jax.vmap(ik_solver.forward_kinematics)(np.asarray(joints, dtype=np.float32)))
+
+
+def tracking_report(trajectory: dict[str, np.ndarray], ik_solver=None, target_times: np.ndarray = None,
+                    targets: np.ndarray = None) -> dict:
+    '''
+    Tracking error of the simulated joints against the last command sent at every
+    logged instant (so transport delay and loss count as error), in joint space and,
+    with an ik_solver, at the end effectors in metres. With targets (N x 2 x 3
+    intended wrist positions), also the end effector distance to the operator's
+    intent at each target time.
+    '''
+    report = {}
+    times, q = trajectory["time"], trajectory["q"]
+    sent_times, sent_joints = trajectory["sent_time"], trajectory["sent_q"]
+    valid = times >= sent_times[0] if len(sent_times) else np.zeros(len(times), dtype=bool)
+    times, q = times[valid], q[valid]
+    commanded = sent_joints[np.searchsorted(sent_times, times, side='right') - 1] if len(times) else q
+    joint_error = np.abs(q - commanded)
+    report["joint_error_rad"] = {
+        side: _error_stats(joint_error[:, sl].max(axis=1)) for side, sl in (("right", slice(0, 5)), ("left", slice(5, 10)))
+    }
+    if ik_solver is None:
+        return report
+
+    actual_ee = batch_forward_kinematics(ik_solver, q)[:, :, :3, 3]
+    commanded_ee = batch_forward_kinematics(ik_solver, commanded)[:, :, :3, 3]
+    ee_error = np.linalg.norm(actual_ee - commanded_ee, axis=-1)
+    report["ee_error_vs_commanded_mm"] = {side: _error_stats(ee_error[:, i], 1e3) for i, side in enumerate(("right", "left"))}
+
+    if targets is not None and len(times):
+        # Simulated pose at each target time (nearest logged sample after it)
+        inside = (target_times >= times[0]) & (target_times <= times[-1])
+        index = np.minimum(np.searchsorted(times, target_times[inside]), len(times) - 1)
+        intent_error = np.linalg.norm(actual_ee[index] - targets[inside], axis=-1)
+        report["ee_error_vs_intended_mm"] = {side: _error_stats(intent_error[:, i], 1e3)
+                                             for i, side in enumerate(("right", "left"))}
+    return report
+
+
+async def closed_loop(messages: list[str], rate_hz: float, robot: SimulatedRobot, ik_solver, port: int,
+                      predictor=None) -> dict:
+    '''
+    Feeds messages at rate_hz through TrackingHandler with its commands going over
+    loopback UDP to robot (already serving on port). Returns the tracking report.
+    predictor (a motion_prediction.MotionPredictor) is installed in TeleopCore.
+    '''
+    from kscale_vr_teleop.analysis.replay import ReplayWebSocket
+    from kscale_vr_teleop.tracking_handler import TrackingHandler
+
+    handler = TrackingHandler(ReplayWebSocket(), udp_host="127.0.0.1", ik_solver=ik_solver, udp_port=port)
+    teleop_core = handler.teleop_core
+    teleop_core.predictor = predictor
+    teleop_core.reset_to_home()
+    target_times, targets, frame_times = [], [], []
+    start = time.perf_counter()
+    try:
+        for i, message in enumerate(messages):
+            delay = start + i / rate_hz - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            frame_start = time.perf_counter()
+            await handler.handle_tracking(json.loads(message))
+            frame_times.append(time.perf_counter() - frame_start)
+            # Operator intent: the wrist targets before IK (and before the z clamp)
+            target_times.append(frame_start)
+            targets.append([(teleop_core.base_to_head_transform @ pose)[:3, 3]
+                            for pose in (teleop_core.right_wrist_pose, teleop_core.left_wrist_pose)])
+    finally:
+        teleop_core.feedback.stop()
+    # Let the last commands arrive and settle
+    await asyncio.sleep(robot.delay + 0.2)
+
+    report = {
+        "frames": len(messages),
+        "commands_sent": robot.received,
+        "frame_ms_p50": float(np.percentile(frame_times, 50) * 1e3),
+        "transport": robot.transport_stats(),
+    }
+    report.update(tracking_report(robot.trajectory(), ik_solver, np.array(target_times), np.array(targets)))
+    return report
+
+
+def print_report(report: dict):
+    if "frames" in report:
+        print(f"Frames: {report['frames']}, commands sent: {report['commands_sent']}, "
+              f"frame p50 {report['frame_ms_p50']:.1f} ms")
+    print(f"Transport: {report['transport']}")
+    for name, unit in (("joint_error_rad", "rad"), ("ee_error_vs_commanded_mm", "mm"), ("ee_error_vs_intended_mm", "mm")):
+        for side, stats in report.get(name, {}).items():
+            if stats.get("n"):
+                print(f"{name:<26}{side:<7}rms {stats['rms']:8.3f}  p95 {stats['p95']:8.3f}  max {stats['max']:8.3f} {unit}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated robot arms for closed-loop teleop benchmarks")
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument("--serve", action="store_true", help="Receive commands from signaling.py until interrupted")
+    mode.add_argument("--benchmark", action="store_true", help="Drive the teleop pipeline in-process and report tracking")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=10000, help="UDP port for Commander16 commands")
+    parser.add_argument("--delay-ms", type=float, default=0.0, help="Transport delay")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Std dev of the transport delay")
+    parser.add_argument("--loss", type=float, default=0.0, help="Fraction of commands dropped")
+    parser.add_argument("--kp", type=float, nargs="+", default=[400.0], help="Position gain (1/s^2), one or per joint")
+    parser.add_argument("--kd", type=float, nargs="+", default=[40.0], help="Velocity gain (1/s), one or per joint")
+    parser.add_argument("--velocity-scale", type=float, default=1.0, help="Scale of the URDF velocity limits")
+    parser.add_argument("--report-interval", type=float, default=5.0, help="Seconds between --serve reports")
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds of synthetic headset stream (--benchmark)")
+    parser.add_argument("--rate", type=float, default=40.0, help="Headset frame rate (--benchmark)")
+    parser.add_argument("--mode", choices=["controller", "hand"], default="controller")
+    parser.add_argument("--motion", choices=["circle", "reaching"], default="circle",
+                        help="Synthetic wrist motion: slow circles, or point-to-point reaches with sudden stops")
+    parser.add_argument("--predict-ms", type=float, default=None,
+                        help="Extrapolate wrist targets by this horizon before IK (motion_prediction)")
+    parser.add_argument("--session", type=str, default=None, help="Replay a recorded session instead (--benchmark)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", type=str, default=None, help="Write the report as JSON to this path")
+    args = parser.parse_args()
+
+    from kscale_vr_teleop.jax_ik import RobotInverseKinematics
+    ik_solver = RobotInverseKinematics(URDF_PATH, EE_LINKS, 'base')
+    from kscale_vr_teleop.teleop_core import home_position
+    robot = SimulatedRobot(URDF_PATH, kp=args.kp, kd=args.kd, delay=args.delay_ms * 1e-3, jitter=args.jitter_ms * 1e-3,
+                           loss=args.loss, velocity_scale=args.velocity_scale, initial=home_position(), seed=args.seed,
+                           # --serve runs until interrupted and only reports the last interval
+                           history=None if args.benchmark else 2 * args.report_interval)
+    stop = robot.start(args.host, args.port)
+
+    if args.benchmark:
+        from kscale_vr_teleop.benchmarks.headset_simulator import synthetic_messages
+        if args.session:
+            from kscale_vr_teleop.analysis.replay import build_messages, load_session
+            session = load_session(args.session)
+            messages = build_messages(session)
+            timestamps = np.asarray(session["timestamp"])
+            rate_hz = (len(timestamps) - 1) / (timestamps[-1] - timestamps[0]) if len(timestamps) > 1 else args.rate
+        elif args.motion == "reaching":
+            from kscale_vr_teleop.analysis.replay import build_messages
+            from kscale_vr_teleop.benchmarks.headset_simulator import HEAD_HEIGHT, HOME_TARGETS
+            from kscale_vr_teleop.benchmarks.trajectories import reaching_wrist_poses
+            rate_hz = args.rate
+            num_frames = int(args.duration * rate_hz)
+            home = np.array([HOME_TARGETS["right"], HOME_TARGETS["left"]])
+            home[:, 2, 3] -= HEAD_HEIGHT
+            messages = build_messages({
+                "timestamp": np.arange(num_frames) / rate_hz,
+                "wrist_poses": reaching_wrist_poses(home, num_frames, rate_hz, seed=args.seed),
+                "use_fingers": np.zeros(num_frames, dtype=bool),
+                "grippers": np.zeros((num_frames, 2)),
+                "joysticks": np.zeros((num_frames, 2, 2)),
+            })
+        else:
+            rate_hz = args.rate
+            messages = synthetic_messages(int(args.duration * rate_hz), rate_hz, args.mode)
+        predictor = None
+        if args.predict_ms is not None:
+            from kscale_vr_teleop.motion_prediction import MotionPredictor
+            predictor = MotionPredictor(horizon=args.predict_ms * 1e-3)
+        report = asyncio.run(closed_loop(messages, rate_hz, robot, ik_solver, args.port, predictor))
+        stop.set()
+        print_report(report)
+        if args.json:
+            Path(args.json).write_text(json.dumps(report, indent=2))
+        return
+
+    print(f"Simulated robot listening on {args.host}:{args.port}")
+    try:
+        while True:
+            since = time.perf_counter()
+            time.sleep(args.report_interval)
+            trajectory = robot.trajectory(since, discard=True)
+            if len(trajectory["sent_time"]) == 0:
+                continue
+            report = {"transport": robot.transport_stats()}
+            report.update(tracking_report(trajectory, ik_solver))
+            print_report(report)
+    except KeyboardInterrupt:
+        stop.set()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the teleop hot path.
+
+Times FK and IK (cold JIT, warm steady state, large jumps; JAX and NumPy backends), full-tree
+FK (one pass over the tree versus per-link traversal, single and batched), finger angle
+computation, tracking message decode, command encode (separate arm and finger
+datagrams versus one unified frame), headset link pose encode, URDFLogger updates
+and URDF loader startup (without, cold and warm mesh cache) on reproducible
+synthetic trajectories, and writes machine-readable JSON.
+
+Usage:
+    python -m kscale_vr_teleop.benchmarks.run [--out results.json]
+    python -m kscale_vr_teleop.benchmarks.run --check            # compare against the stored baseline
+    python -m kscale_vr_teleop.benchmarks.run --save-baseline    # replace the stored baseline
+
+The regression check compares the median time of every benchmark to the baseline
+and fails (exit code 1) if any is slower by more than --threshold. Benchmarks with
+fewer than MIN_SAMPLES runs (cold JIT and startup times, measured once or a few
+times) only fail past the looser --few-sample-threshold. Benchmarks missing from
+the baseline are listed so a new one is not silently left unchecked.
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+from kscale_vr_teleop._assets import ASSETS_DIR
+from kscale_vr_teleop.benchmarks.trajectories import (
+    smooth_joint_path,
+    synthetic_finger_poses,
+    targets_from_joints,
+    tracking_message,
+)
+
+BASELINE_PATH = Path(__file__).parent / "baseline.json"
+URDF_PATH = str(ASSETS_DIR / "kbot_legless" / "robot.urdf")
+EE_LINKS = ['PRT0001', 'PRT0001_2']
+# Below this many runs a median is one noisy sample or close to it
+MIN_SAMPLES = 10
+
+
+def summarize(times, **extra) -> dict:
+    times_ms = np.asarray(times, dtype=np.float64) * 1e3
+    return {
+        "n": int(times_ms.size),
+        "mean_ms": float(times_ms.mean()),
+        "p50_ms": float(np.percentile(times_ms, 50)),
+        "p90_ms": float(np.percentile(times_ms, 90)),
+        "p99_ms": float(np.percentile(times_ms, 99)),
+        **extra,
+    }
+
+
+def time_each(fn, inputs) -> np.ndarray:
+    times = np.empty(len(inputs))
+    for i, args in enumerate(inputs):
+        start = time.perf_counter()
+        fn(*args)
+        times[i] = time.perf_counter() - start
+    return times
+
+
+def bench_kinematics(results: dict, num_frames: int, seed: int):
+    for backend in ("jax", "numpy"):
+        _bench_kinematics_backend(results, num_frames, seed, backend)
+
+
+def _bench_kinematics_backend(results: dict, num_frames: int, seed: int, backend: str):
+    from kscale_vr_teleop.jax_ik import RobotInverseKinematics
+
+    # The JAX backend keeps the unsuffixed names of the stored baseline
+    suffix = "" if backend == "jax" else f"_{backend}"
+    start = time.perf_counter()
+    ik_solver = RobotInverseKinematics(URDF_PATH, EE_LINKS, 'base', backend=backend)
+    results[f"ik_init_cold{suffix}"] = summarize([time.perf_counter() - start])
+
+    lower = np.asarray(ik_solver.lower_bounds)
+    upper = np.asarray(ik_solver.upper_bounds)
+    joint_path = smooth_joint_path(lower, upper, num_frames, seed=seed).astype(np.float32)
+
+    start = time.perf_counter()
+    np.asarray(ik_solver.forward_kinematics(joint_path[0]))
+    results[f"fk_cold{suffix}"] = summarize([time.perf_counter() - start])
+
+    results[f"fk_warm{suffix}"] = summarize(time_each(
+        lambda q: np.asarray(ik_solver.forward_kinematics(q)), [(q,) for q in joint_path]))
+
+    targets = targets_from_joints(ik_solver.forward_kinematics, joint_path)
+
+    def solve_all(target_sequence):
+        errors = np.empty(len(target_sequence))
+        times = np.empty(len(target_sequence))
+        for i, target in enumerate(target_sequence):
+            start = time.perf_counter()
+            joints = np.asarray(ik_solver.inverse_kinematics(target))
+            times[i] = time.perf_counter() - start
+            achieved = np.asarray(ik_solver.forward_kinematics(joints))
+            errors[i] = np.max(np.linalg.norm(achieved[:, :3, 3] - target[:, :3, 3], axis=-1))
+        return times, errors
+
+    ik_solver.last_solution = joint_path[0]
+    times, errors = solve_all(targets)
+    results[f"ik_warm{suffix}"] = summarize(times, median_error_mm=float(np.median(errors) * 1e3))
+
+    # Every frame jumps to an unrelated point of the trajectory
+    jumps = targets[np.random.default_rng(seed).permutation(len(targets))]
+    times, errors = solve_all(jumps)
+    results[f"ik_jump{suffix}"] = summarize(times, median_error_mm=float(np.median(errors) * 1e3))
+
+
+def bench_hand_and_messages(results: dict, num_frames: int, seed: int):
+    from kscale_vr_teleop.hand_inverse_kinematics import calculate_hand_joints_no_ik
+    from kscale_vr_teleop.tracking_handler import TrackingHandler
+    from kscale_vr_teleop.analysis.replay import ReplayUDPSocket, ReplayWebSocket
+    from kscale_vr_teleop.command_conn import UnifiedCommander
+    from kscale_vr_teleop.link_poses import LinkPoseModel
+
+    right_fingers = synthetic_finger_poses(num_frames, seed=seed)
+    left_fingers = synthetic_finger_poses(num_frames, seed=seed + 1)
+    results["finger_angles"] = summarize(time_each(
+        calculate_hand_joints_no_ik, list(zip(left_fingers, right_fingers))))
+
+    class _NullSolver:
+        last_solution = None
+
+    handler = TrackingHandler(ReplayWebSocket(), udp_host="127.0.0.1", ik_solver=_NullSolver())
+    handler.teleop_core.kinfer_command_handler.sock = ReplayUDPSocket()
+    wrist = np.eye(4)
+    messages = [json.dumps(tracking_message(wrist, wrist, right_fingers[i], left_fingers[i])) for i in range(num_frames)]
+
+    def decode(message):
+        data = json.loads(message)
+        for side in ("left", "right"):
+            handler._handle_target_location(data[side], side, data["type"])
+            handler._handle_buttons(data[side], side)
+            handler._handle_joints(data[side], side)
+
+    results["message_decode"] = summarize(time_each(decode, [(m,) for m in messages]),
+                                          message_bytes=len(messages[0]))
+
+    commander = handler.teleop_core.kinfer_command_handler
+    arm_commands = np.random.default_rng(seed).uniform(-1, 1, (num_frames, 2, 6))
+
+    def encode(right_arm, left_arm):
+        commander.update_commands(right_arm.tolist(), left_arm.tolist(), (0.1, 0.2), (0.0, 0.0))
+        commander.send_commands()
+
+    results["command_encode"] = summarize(time_each(encode, [tuple(c) for c in arm_commands]),
+                                          datagram_bytes=len(commander.sock.last_payload))
+
+    # Arm datagram plus a separate finger datagram, versus one unified frame carrying both
+    finger_server = handler.finger_server
+    finger_server._udp_sock = ReplayUDPSocket()
+    finger_angles = np.random.default_rng(seed + 2).uniform(0, 1, (num_frames, 2, 6))
+
+    def encode_separate(right_arm, left_arm, right_fingers, left_fingers):
+        encode(right_arm, left_arm)
+        finger_server.send_finger_commands(right_fingers, left_fingers)
+
+    separate_inputs = [(*arm, *fingers) for arm, fingers in zip(arm_commands, finger_angles)]
+    results["command_encode_separate"] = summarize(time_each(encode_separate, separate_inputs), datagrams=2)
+
+    unified = UnifiedCommander()
+    unified.sock = ReplayUDPSocket()
+
+    def encode_unified(right_arm, left_arm, right_fingers, left_fingers):
+        unified.update_commands(right_arm.tolist(), left_arm.tolist(), (0.1, 0.2), (0.0, 0.0))
+        unified.update_fingers(right_fingers, left_fingers)
+        unified.send_commands()
+
+    results["command_encode_unified"] = summarize(time_each(encode_unified, separate_inputs), datagrams=1,
+                                                  datagram_bytes=len(unified.sock.last_payload))
+
+    # Robot overlay feedback: link poses for the headset, from one batched FK per message
+    link_model = LinkPoseModel(URDF_PATH)
+    arm_joints = np.random.default_rng(seed + 3).uniform(-1, 1, (num_frames, 10))
+    results["link_pose_encode"] = summarize(time_each(link_model.encode, [(q, i) for i, q in enumerate(arm_joints)]),
+                                            message_bytes=len(link_model.encode(arm_joints[0], 0)),
+                                            links=len(link_model.visual_links))
+
+
+def bench_urdf_logger(results: dict, num_frames: int, seed: int):
+    import rerun as rr
+    from kscale_vr_teleop.analysis.rerun_loader_urdf import URDFLogger
+
+    rr.init("kscale_vr_teleop_benchmark")
+    rr.memory_recording()
+    urdf_logger = URDFLogger(URDF_PATH, root_path="robot")
+    urdf_logger.log()
+
+    movable = np.flatnonzero(urdf_logger.movable_joints)
+    joint_path = np.zeros((num_frames, len(urdf_logger.joints)))
+    joint_path[:, movable] = smooth_joint_path(-np.ones(len(movable)), np.ones(len(movable)), num_frames, seed=seed)
+    times = time_each(urdf_logger.log, [(q,) for q in joint_path])
+    results["urdf_log"] = summarize(times, messages_per_s=float(len(times) / times.sum()))
+
+    batch = 40
+    timestamps = np.arange(num_frames) / 40.0
+    batches = [(timestamps[i:i + batch], joint_path[i:i + batch]) for i in range(0, num_frames - batch + 1, batch)]
+    times = time_each(urdf_logger.log_columns, batches)
+    results["urdf_log_columns_40"] = summarize(times, messages_per_s=float(len(times) * batch / times.sum()))
+
+
+def bench_mesh_loading(results: dict, num_frames: int, seed: int):
+    import tempfile
+    import rerun as rr
+    from kscale_vr_teleop.analysis.mesh_cache import MeshCache
+    from kscale_vr_teleop.analysis.rerun_loader_urdf import URDFLogger
+
+    rr.init("kscale_vr_teleop_benchmark")
+    rr.memory_recording()
+
+    # Startup of rerun_loader_urdf.py / visualizer.py: build the logger and log the robot once
+    def startup(mesh_cache):
+        start = time.perf_counter()
+        URDFLogger(URDF_PATH, root_path="robot", mesh_cache=mesh_cache).log()
+        return time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        results["urdf_startup_nocache"] = summarize([startup(MeshCache(None, max_workers=1)) for _ in range(3)])
+        cold = []
+        for _ in range(3):
+            MeshCache(cache_dir).clear()
+            cold.append(startup(MeshCache(cache_dir)))
+        results["urdf_startup_cold"] = summarize(cold)
+        results["urdf_startup_warm"] = summarize([startup(MeshCache(cache_dir)) for _ in range(3)])
+
+
+def bench_link_transforms(results: dict, num_frames: int, seed: int):
+    from scipy.spatial.transform import Rotation
+    from kscale_vr_teleop.jax_ik import RobotInverseKinematics
+    from kscale_vr_teleop.link_poses import KinematicTree
+
+    tree = KinematicTree(URDF_PATH)
+    solvers = {backend: RobotInverseKinematics(URDF_PATH, EE_LINKS, 'base', backend=backend)
+               for backend in ("jax", "numpy")}
+    lower = np.asarray(solvers["numpy"].lower_bounds)
+    upper = np.asarray(solvers["numpy"].upper_bounds)
+    joint_path = smooth_joint_path(lower, upper, num_frames, seed=seed)
+
+    # Reference: every link walks its own chain from the root, one joint at a time
+    def per_link(q):
+        transforms = []
+        for i in range(len(tree.link_names)):
+            chain = []
+            while i > 0:
+                chain.append(i)
+                i = tree.parents[i]
+            transform = np.eye(4)
+            for j in reversed(chain):
+                angle = q[tree.joint_indices[j]] if tree.joint_indices[j] >= 0 else 0.0
+                local = tree.origins[j].copy()
+                local[:3, :3] = local[:3, :3] @ Rotation.from_rotvec(angle * tree.axes[j]).as_matrix()
+                transform = transform @ local
+            transforms.append(transform)
+        return np.array(transforms)
+
+    results["link_transforms_per_link"] = summarize(time_each(per_link, [(q,) for q in joint_path]),
+                                                    links=len(tree.link_names))
+    batch = 40
+    batches = [(joint_path[i:i + batch],) for i in range(0, num_frames - batch + 1, batch)]
+    for backend, solver in solvers.items():
+        # Compile for both shapes before timing
+        np.asarray(solver.link_transforms(joint_path[0]))
+        np.asarray(solver.link_transforms(batches[0][0]))
+        results[f"link_transforms_{backend}"] = summarize(time_each(
+            lambda q: np.asarray(solver.link_transforms(q)), [(q,) for q in joint_path]))
+        results[f"link_transforms_{backend}_batch{batch}"] = summarize(time_each(
+            lambda q: np.asarray(solver.link_transforms(q)), batches), configurations=batch)
+
+
+BENCHMARKS = {
+    "kinematics": bench_kinematics,
+    "link_transforms": bench_link_transforms,
+    "hand_and_messages": bench_hand_and_messages,
+    "urdf_logger": bench_urdf_logger,
+    "mesh_loading": bench_mesh_loading,
+}
+
+
+def run(num_frames: int = 400, seed: int = 0, only=None) -> dict:
+    results = {}
+    for name, bench in BENCHMARKS.items():
+        if only and name not in only:
+            continue
+        print(f"Running {name}...", file=sys.stderr)
+        bench(results, num_frames, seed)
+    return {
+        "meta": {
+            "timestamp": time.time(),
+            "frames": num_frames,
+            "seed": seed,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+        },
+        "results": results,
+    }
+
+
+def check_regressions(current: dict, baseline: dict, threshold: float, few_sample_threshold: float = 1.0) -> list[str]:
+    '''
+    Returns a line per benchmark whose median is more than ``threshold`` (fraction)
+    slower than the baseline, or more than ``few_sample_threshold`` for benchmarks
+    with fewer than MIN_SAMPLES runs on either side.
+    '''
+    failures = []
+    for name, stats in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+        samples = min(stats["n"], base["n"])
+        allowed = few_sample_threshold if samples < MIN_SAMPLES else threshold
+        ratio = stats["p50_ms"] / base["p50_ms"] if base["p50_ms"] > 0 else 1.0
+        if ratio > 1 + allowed:
+            failures.append(f"{name}: {stats['p50_ms']:.3f} ms vs baseline {base['p50_ms']:.3f} ms "
+                            f"({ratio:.2f}x, n={samples}, allowed {1 + allowed:.2f}x)")
+    return failures
+
+
+def missing_from_baseline(current: dict, baseline: dict) -> list[str]:
+    '''Names of the benchmarks that ran but have no baseline entry to compare against.'''
+    return [name for name in current["results"] if name not in baseline["results"]]
+
+
+def print_results(report: dict, baseline: dict | None = None):
+    print(f"{'benchmark':<24}{'n':>6}{'p50 ms':>11}{'p90 ms':>11}{'p99 ms':>11}{'vs base':>9}")
+    for name, stats in report["results"].items():
+        ratio = ""
+        if baseline is not None and name in baseline["results"] and baseline["results"][name]["p50_ms"] > 0:
+            ratio = f"{stats['p50_ms'] / baseline['results'][name]['p50_ms']:.2f}x"
+        print(f"{name:<24}{stats['n']:>6}{stats['p50_ms']:>11.3f}{stats['p90_ms']:>11.3f}{stats['p99_ms']:>11.3f}{ratio:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Teleop hot path benchmarks")
+    parser.add_argument("--frames", type=int, default=400, help="Frames per synthetic trajectory")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--only", nargs="*", choices=list(BENCHMARKS), help="Run only these benchmark groups")
+    parser.add_argument("--out", type=str, default=None, help="Write results JSON to this path")
+    parser.add_argument("--baseline", type=str, default=str(BASELINE_PATH))
+    parser.add_argument("--check", action="store_true", help="Fail if slower than the baseline by more than --threshold")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Allowed slowdown as a fraction (default 0.25)")
+    parser.add_argument("--few-sample-threshold", type=float, default=1.0,
+                        help=f"Allowed slowdown of benchmarks with fewer than {MIN_SAMPLES} runs (default 1.0)")
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the new baseline")
+    args = parser.parse_args()
+
+    report = run(args.frames, args.seed, args.only)
+
+    baseline_path = Path(args.baseline)
+    baseline = json.loads(baseline_path.read_text()) if baseline_path.exists() else None
+    print_results(report, baseline)
+
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, indent=2))
+    if args.save_baseline:
+        baseline_path.write_text(json.dumps(report, indent=2))
+        print(f"Saved baseline to {baseline_path}")
+    if args.check:
+        if baseline is None:
+            print(f"No baseline at {baseline_path}")
+            sys.exit(1)
+        missing = missing_from_baseline(report, baseline)
+        if missing:
+            print(f"Not in the baseline, not checked (run --save-baseline): {', '.join(missing)}")
+        failures = check_regressions(report, baseline, args.threshold, args.few_sample_threshold)
+        if failures:
+            print("Performance regressions:")
+            for failure in failures:
+                print(f"  {failure}")
+            sys.exit(1)
+        print("No regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Reproducible synthetic operator data for benchmarks.
+
+Arm trajectories are generated in joint space (smooth, inside the URDF limits) and
+mapped to wrist targets with forward kinematics, so every target is reachable and
+the IK ground truth is known.
+"""
+import numpy as np
+
+# Wrist targets point the opposite way to the end effector along its y and z axes
+# (see the orientation terms of the IK residual), i.e. a 180 degree turn about x.
+EE_TO_TARGET = np.diag([1.0, -1.0, -1.0, 1.0])
+
+
+def smooth_joint_path(lower: np.ndarray, upper: np.ndarray, num_frames: int, rate_hz: float = 40.0,
+                      seed: int = 0, max_frequency_hz: float = 0.5, margin: float = 0.1) -> np.ndarray:
+    '''
+    Sum of a few random low-frequency sinusoids per joint, scaled into [lower, upper]
+    shrunk by ``margin`` of the range on each side. Returns num_frames x num_joints.
+    '''
+    rng = np.random.default_rng(seed)
+    lower = np.asarray(lower, dtype=np.float64)
+    upper = np.asarray(upper, dtype=np.float64)
+    num_joints = len(lower)
+    t = np.arange(num_frames)[:, None] / rate_hz
+
+    num_components = 3
+    frequencies = rng.uniform(0.05, max_frequency_hz, (num_components, num_joints))
+    phases = rng.uniform(0, 2 * np.pi, (num_components, num_joints))
+    amplitudes = rng.uniform(0.5, 1.0, (num_components, num_joints))
+    amplitudes /= amplitudes.sum(axis=0)
+
+    wave = np.zeros((num_frames, num_joints))
+    for k in range(num_components):
+        wave += amplitudes[k] * np.sin(2 * np.pi * frequencies[k] * t + phases[k])
+
+    span = (upper - lower) * (1 - 2 * margin)
+    center = (upper + lower) / 2
+    return center + wave * span / 2
+
+
+def targets_from_joints(forward_kinematics, joint_path: np.ndarray) -> np.ndarray:
+    '''
+    Runs FK on every configuration and converts end effector poses into IK targets.
+    Returns num_frames x num_ee x 4 x 4.
+    '''
+    ee_poses = np.stack([np.asarray(forward_kinematics(q)) for q in joint_path])
+    return ee_poses @ EE_TO_TARGET
+
+
+def synthetic_finger_poses(num_frames: int, seed: int = 0) -> np.ndarray:
+    '''
+    24 finger joint poses per hand (wrist relative, robot frame) with each finger
+    curling smoothly about its x axis. Returns num_frames x 24 x 4 x 4.
+    '''
+    rng = np.random.default_rng(seed)
+    # Joints per finger in the WebXR joint order: thumb 4, other fingers 5
+    finger_sizes = [4, 5, 5, 5, 5]
+    curl = 0.5 + 0.5 * np.sin(np.linspace(0, 4 * np.pi, num_frames)[:, None] + rng.uniform(0, 2 * np.pi, 5))
+
+    poses = np.tile(np.eye(4), (num_frames, 24, 1, 1))
+    joint = 0
+    for finger, size in enumerate(finger_sizes):
+        for k in range(size):
+            angle = curl[:, finger] * 0.5 * k
+            c, s = np.cos(angle), np.sin(angle)
+            poses[:, joint, 1, 1] = c
+            poses[:, joint, 1, 2] = -s
+            poses[:, joint, 2, 1] = s
+            poses[:, joint, 2, 2] = c
+            poses[:, joint, :3, 3] = [0.02 * finger - 0.04, 0.0, 0.03 * k]
+            joint += 1
+    return poses.astype(np.float32)
+
+
+def reaching_wrist_poses(home_poses: np.ndarray, num_frames: int, rate_hz: float = 72.0, seed: int = 0,
+                         reach: float = 0.15, max_turn: float = 0.6, noise: float = 0.001) -> np.ndarray:
+    '''
+    Operator-like wrist motion: point-to-point reaches with minimum-jerk profiles
+    (0.3-1.0 s each, some followed by a pause), each wrist moving within ``reach``
+    metres and ``max_turn`` radians of its home pose (num_ee x 4 x 4), plus tracking
+    noise. Sudden reversals happen at every reach boundary. Returns num_frames x
+    num_ee x 4 x 4.
+    '''
+    from scipy.spatial.transform import Rotation
+
+    rng = np.random.default_rng(seed)
+    home_poses = np.asarray(home_poses, dtype=np.float64)
+    t = np.arange(num_frames) / rate_hz
+    poses = np.tile(home_poses, (num_frames, 1, 1, 1))
+    for ee, home in enumerate(home_poses):
+        offsets = np.zeros((num_frames, 6))
+        start, previous = 0.0, np.zeros(6)
+        while start < t[-1]:
+            duration = rng.uniform(0.3, 1.0)
+            goal = np.concatenate([rng.uniform(-reach, reach, 3), rng.uniform(-max_turn, max_turn, 3) / np.sqrt(3)])
+            tau = np.clip((t - start) / duration, 0.0, 1.0)[:, None]
+            active = t >= start
+            # Minimum jerk: 10 tau^3 - 15 tau^4 + 6 tau^5
+            offsets[active] = (previous + (goal - previous) * (10 * tau**3 - 15 * tau**4 + 6 * tau**5))[active]
+            start += duration + (rng.uniform(0.1, 0.5) if rng.random() < 0.3 else 0.0)
+            previous = goal
+        offsets[:, :3] += rng.normal(0.0, noise, (num_frames, 3))
+        poses[:, ee, :3, 3] += offsets[:, :3]
+        poses[:, ee, :3, :3] = home[:3, :3] @ Rotation.from_rotvec(offsets[:, 3:]).as_matrix()
+    return poses
+
+
+def tracking_message(right_target: np.ndarray, left_target: np.ndarray, right_fingers=None, left_fingers=None) -> dict:
+    '''
+    Builds a UnifiedTrackingResult-shaped message (column-major flat matrices) as the
+    headset sends it. Targets are used as-is in the headset frame.
+    '''
+    message = {"type": "hand" if right_fingers is not None else "controller"}
+    for side, target, fingers in (("right", right_target, right_fingers), ("left", left_target, left_fingers)):
+        side_data = {"targetLocation": np.asarray(target, dtype=np.float64).T.reshape(-1).tolist()}
+        if fingers is not None:
+            side_data["joints"] = np.asarray(fingers, dtype=np.float64).transpose(0, 2, 1).reshape(-1).tolist()
+        else:
+            side_data.update({"joints": [], "trigger": 0.5, "grip": 0.0, "joystickX": 0.0, "joystickY": 0.0,
+                              "buttons": [False] * 6})
+        message[side] = side_data
+    return message
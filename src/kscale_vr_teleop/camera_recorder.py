@@ -0,0 +1,467 @@
+"""Camera capture and recording in sync with teleop sessions.
+
+A capture process reads frames from a source and writes them straight into a
+ring of shared-memory slots, each stamped with its capture time. While a session
+is being recorded, an encoder process reads the same ring and appends JPEG
+frames to disk. Frames never pass through a pipe or a pickle, and the teleop
+process does no per-frame work: it only starts and stops the encoder.
+
+Frames are matched to the ``SessionRecorder`` command rows afterwards by nearest
+timestamp (both sides use ``time.time()`` on the same host).
+
+Layout inside a session directory::
+
+    session_<time>/camera/
+        meta.json
+        frames.bin          concatenated encoded frames
+        offsets.npy         byte offset of every frame in frames.bin (N + 1)
+        timestamps.npy      capture time of every frame
+        command_frames.npy  nearest frame for every recorded command row
+
+Usage:
+    python -m kscale_vr_teleop.camera_recorder [--source synthetic|DEVICE]   # control loop impact benchmark
+"""
+import io
+import json
+import multiprocessing as mp
+import os
+import time
+from multiprocessing import shared_memory
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+# Control block: frames written, frames delivered late by the source
+_CONTROL_FIELDS = 2
+_SLOT_HEADER = np.dtype([('seq', np.int64), ('timestamp', np.float64)])
+# Capture and encoding yield the CPU to the teleop loop
+_BACKGROUND_NICE = 10
+
+
+class SyntheticSource:
+    '''
+    Moving test pattern at a fixed rate, for running without a camera.
+    '''
+    def __init__(self, width: int = 640, height: int = 480, fps: float = 30.0):
+        self.shape = (height, width, 3)
+        self.fps = fps
+
+    def open(self):
+        height, width, _ = self.shape
+        x, y = np.meshgrid(np.linspace(0, 255, width), np.linspace(0, 255, height))
+        self._pattern = np.stack([x, y, (x + y) / 2], axis=-1).astype(np.uint8)
+        self._count = 0
+        self._next = time.perf_counter()
+
+    def read(self, out: np.ndarray) -> float:
+        '''Fills out with the next frame and returns its capture time.'''
+        delay = self._next - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        self._next = max(self._next + 1.0 / self.fps, time.perf_counter() - 1.0 / self.fps)
+        shift = (self._count * 4) % self.shape[1]
+        out[:, :self.shape[1] - shift] = self._pattern[:, shift:]
+        out[:, self.shape[1] - shift:] = self._pattern[:, :shift]
+        # Frame counter as a bright bar so dropped frames are visible when played back
+        out[:16, :(self._count % 64) * 10] = 255
+        self._count += 1
+        return time.time()
+
+    def close(self):
+        pass
+
+
+class OpenCVSource:
+    '''
+    V4L2/USB camera through OpenCV (``pip install opencv-python``).
+    '''
+    def __init__(self, device: int | str = 0, width: int = 640, height: int = 480, fps: float = 30.0):
+        self.device = device
+        self.shape = (height, width, 3)
+        self.fps = fps
+
+    def open(self):
+        import cv2
+        self._cv2 = cv2
+        self._capture = cv2.VideoCapture(self.device)
+        self._capture.set(cv2.CAP_PROP_FRAME_WIDTH, self.shape[1])
+        self._capture.set(cv2.CAP_PROP_FRAME_HEIGHT, self.shape[0])
+        self._capture.set(cv2.CAP_PROP_FPS, self.fps)
+        if not self._capture.isOpened():
+            raise RuntimeError(f"Could not open camera {self.device}")
+        self._bgr = np.empty(self.shape, dtype=np.uint8)
+
+    def read(self, out: np.ndarray) -> float:
+        ok, frame = self._capture.read(self._bgr)
+        timestamp = time.time()
+        if not ok:
+            raise RuntimeError(f"Camera {self.device} stopped delivering frames")
+        self._cv2.cvtColor(frame, self._cv2.COLOR_BGR2RGB, dst=out)
+        return timestamp
+
+    def close(self):
+        self._capture.release()
+
+
+def make_source(spec: str, width: int = 640, height: int = 480, fps: float = 30.0):
+    '''"synthetic" or an OpenCV device index/path.'''
+    if spec == "synthetic":
+        return SyntheticSource(width, height, fps)
+    return OpenCVSource(int(spec) if spec.isdigit() else spec, width, height, fps)
+
+
+class FrameRing:
+    '''
+    Shared-memory ring of frames. Single writer (the capture process); any number of
+    readers. Each slot header holds the sequence number of the frame in it, written
+    last, so a reader detects a slot that was overwritten while it was copying.
+    '''
+    def __init__(self, shape: tuple[int, int, int], num_slots: int, name: Optional[str] = None):
+        self.shape = tuple(shape)
+        self.num_slots = num_slots
+        frame_bytes = int(np.prod(shape))
+        header_bytes = _CONTROL_FIELDS * 8 + num_slots * _SLOT_HEADER.itemsize
+        frames_offset = (header_bytes + 63) // 64 * 64
+        size = frames_offset + num_slots * frame_bytes
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=size if self.owner else 0)
+        self.control = np.ndarray((_CONTROL_FIELDS,), dtype=np.int64, buffer=self.shm.buf)
+        self.headers = np.ndarray((num_slots,), dtype=_SLOT_HEADER, buffer=self.shm.buf, offset=_CONTROL_FIELDS * 8)
+        self.frames = np.ndarray((num_slots, *shape), dtype=np.uint8, buffer=self.shm.buf, offset=frames_offset)
+        if self.owner:
+            self.control[:] = 0
+            self.headers['seq'] = -1
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    @property
+    def frames_written(self) -> int:
+        return int(self.control[0])
+
+    @property
+    def frames_late(self) -> int:
+        return int(self.control[1])
+
+    def begin_write(self) -> tuple[int, np.ndarray]:
+        '''Returns (seq, slot frame view) for the capture process to fill in place.'''
+        seq = int(self.control[0])
+        slot = seq % self.num_slots
+        self.headers['seq'][slot] = -1
+        return seq, self.frames[slot]
+
+    def end_write(self, seq: int, timestamp: float):
+        slot = seq % self.num_slots
+        self.headers['timestamp'][slot] = timestamp
+        self.headers['seq'][slot] = seq
+        self.control[0] = seq + 1
+
+    def read(self, seq: int, out: np.ndarray) -> Optional[float]:
+        '''
+        Copies frame seq into out and returns its timestamp, or None if the slot no
+        longer holds it.
+        '''
+        slot = seq % self.num_slots
+        if self.headers['seq'][slot] != seq:
+            return None
+        timestamp = float(self.headers['timestamp'][slot])
+        out[...] = self.frames[slot]
+        if self.headers['seq'][slot] != seq:
+            return None
+        return timestamp
+
+    def close(self):
+        del self.control, self.headers, self.frames
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def _capture_main(source, ring_name, num_slots, stop_event):
+    os.nice(_BACKGROUND_NICE)
+    ring = FrameRing(source.shape, num_slots, name=ring_name)
+    source.open()
+    period = 1.0 / source.fps
+    last_timestamp = None
+    try:
+        while not stop_event.is_set():
+            seq, slot = ring.begin_write()
+            timestamp = source.read(slot)
+            ring.end_write(seq, timestamp)
+            if last_timestamp is not None and timestamp - last_timestamp > 1.5 * period:
+                ring.control[1] += 1
+            last_timestamp = timestamp
+    finally:
+        source.close()
+        ring.close()
+
+
+def _encoder_main(ring_name, shape, num_slots, fps, out_dir, codec, quality, start_time, stop_event, stats_conn):
+    os.nice(_BACKGROUND_NICE)
+    from PIL import Image
+
+    out_dir = Path(out_dir)
+    ring = FrameRing(shape, num_slots, name=ring_name)
+    frame = np.empty(shape, dtype=np.uint8)
+    timestamps = []
+    offsets = [0]
+    dropped = 0
+    encode_time = 0.0
+    # Spawning takes a moment; start from the first frame captured after record() was called
+    next_seq = ring.frames_written
+    oldest = max(0, next_seq - (num_slots - 1))
+    while next_seq > oldest and ring.headers['timestamp'][(next_seq - 1) % num_slots] >= start_time:
+        next_seq -= 1
+    first_seq = next_seq
+    with open(out_dir / "frames.bin", "wb") as f:
+        while True:
+            stopping = stop_event.is_set()
+            written = ring.frames_written
+            # Frames the capture process has already overwritten are lost
+            if written - next_seq > num_slots - 1:
+                dropped += written - next_seq - (num_slots - 1)
+                next_seq = written - (num_slots - 1)
+            while next_seq < written:
+                timestamp = ring.read(next_seq, frame)
+                next_seq += 1
+                if timestamp is None:
+                    dropped += 1
+                    continue
+                start = time.perf_counter()
+                if codec == "jpeg":
+                    buffer = io.BytesIO()
+                    Image.fromarray(frame).save(buffer, format="JPEG", quality=quality)
+                    data = buffer.getbuffer()
+                else:
+                    data = frame.reshape(-1).data
+                f.write(data)
+                encode_time += time.perf_counter() - start
+                timestamps.append(timestamp)
+                offsets.append(offsets[-1] + len(data))
+            if stopping:
+                break
+            stop_event.wait(0.5 / fps)
+
+    np.save(out_dir / "timestamps.npy", np.array(timestamps, dtype=np.float64))
+    np.save(out_dir / "offsets.npy", np.array(offsets, dtype=np.int64))
+    stats = {
+        "shape": list(shape),
+        "fps": fps,
+        "codec": codec,
+        "frames": len(timestamps),
+        "frames_dropped": dropped,
+        "frames_seen": next_seq - first_seq,
+        "frames_late": ring.frames_late,
+        "encode_ms_mean": encode_time / len(timestamps) * 1e3 if timestamps else 0.0,
+    }
+    (out_dir / "meta.json").write_text(json.dumps(stats, indent=2))
+    ring.close()
+    stats_conn.send(stats)
+    stats_conn.close()
+
+
+class CameraEncoder:
+    '''Handle on a running encoder process; see ``CameraCapture.record``.'''
+    def __init__(self, capture: "CameraCapture", out_dir: Path, codec: str, quality: int):
+        self.out_dir = Path(out_dir)
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        self._stop = capture.ctx.Event()
+        self._stats_recv, stats_send = capture.ctx.Pipe(duplex=False)
+        ring = capture.ring
+        self.process = capture.ctx.Process(
+            target=_encoder_main,
+            args=(ring.name, ring.shape, ring.num_slots, capture.source.fps, str(self.out_dir), codec, quality,
+                  time.time(), self._stop, stats_send),
+            daemon=True,
+        )
+        self.process.start()
+        stats_send.close()
+        self.stats = None
+
+    def stop(self) -> dict:
+        '''Stops after encoding every frame captured so far; returns the encoder stats.'''
+        self._stop.set()
+        if self.stats is None:
+            try:
+                self.stats = self._stats_recv.recv() if self._stats_recv.poll(30) else {}
+            except EOFError:  # Encoder process died
+                self.stats = {}
+            self.process.join(timeout=5)
+        return self.stats
+
+
+class CameraCapture:
+    '''
+    Owns the capture process and its frame ring. One per camera, shared by every
+    teleop session; ``record`` starts an encoder for one recording.
+    '''
+    def __init__(self, source, num_slots: int = 64, codec: str = "jpeg", quality: int = 85):
+        self.source = source
+        self.num_slots = num_slots
+        self.codec = codec
+        self.quality = quality
+        self.ctx = mp.get_context('spawn')
+        self.ring = None
+        self.process = None
+
+    def start(self):
+        self.ring = FrameRing(self.source.shape, self.num_slots)
+        self._stop = self.ctx.Event()
+        self.process = self.ctx.Process(target=_capture_main, args=(self.source, self.ring.name, self.num_slots, self._stop),
+                                        daemon=True)
+        self.process.start()
+
+    def record(self, out_dir) -> CameraEncoder:
+        return CameraEncoder(self, out_dir, self.codec, self.quality)
+
+    def close(self):
+        if self.process is not None:
+            self._stop.set()
+            self.process.join(timeout=5)
+            if self.process.is_alive():
+                self.process.terminate()
+            self.process = None
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def nearest_frames(frame_timestamps: np.ndarray, command_timestamps: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Index of the frame closest in time to every command, and the signed offset
+    (frame time - command time) in seconds.
+    '''
+    frame_timestamps = np.asarray(frame_timestamps)
+    command_timestamps = np.asarray(command_timestamps)
+    if len(frame_timestamps) == 0:
+        return np.full(len(command_timestamps), -1), np.full(len(command_timestamps), np.nan)
+    after = np.clip(np.searchsorted(frame_timestamps, command_timestamps), 1, len(frame_timestamps) - 1)
+    before = after - 1
+    use_after = np.abs(frame_timestamps[after] - command_timestamps) < np.abs(command_timestamps - frame_timestamps[before])
+    indices = np.where(use_after, after, before)
+    if len(frame_timestamps) == 1:
+        indices = np.zeros(len(command_timestamps), dtype=np.int64)
+    return indices, frame_timestamps[indices] - command_timestamps
+
+
+def align_session(session_dir) -> dict:
+    '''
+    Writes camera/command_frames.npy for a recorded session and returns alignment stats.
+    '''
+    from kscale_vr_teleop.session_recorder import load_recording
+
+    session_dir = Path(session_dir)
+    camera_dir = session_dir / "camera"
+    command_timestamps = load_recording(session_dir, fields=("timestamp",))["timestamp"]
+    frame_timestamps = np.load(camera_dir / "timestamps.npy")
+    indices, offsets = nearest_frames(frame_timestamps, command_timestamps)
+    np.save(camera_dir / "command_frames.npy", indices)
+    offsets = np.abs(offsets[~np.isnan(offsets)]) * 1e3
+    return {
+        "commands": len(command_timestamps),
+        "frames": len(frame_timestamps),
+        "offset_ms_p50": float(np.percentile(offsets, 50)) if len(offsets) else None,
+        "offset_ms_max": float(offsets.max()) if len(offsets) else None,
+    }
+
+
+class CameraRecording:
+    '''Random access to the frames of a recorded camera directory.'''
+    def __init__(self, camera_dir):
+        self.camera_dir = Path(camera_dir)
+        self.meta = json.loads((self.camera_dir / "meta.json").read_text())
+        self.timestamps = np.load(self.camera_dir / "timestamps.npy")
+        self.offsets = np.load(self.camera_dir / "offsets.npy")
+        self._data = np.memmap(self.camera_dir / "frames.bin", dtype=np.uint8, mode='r') if self.offsets[-1] > 0 else None
+        command_frames = self.camera_dir / "command_frames.npy"
+        self.command_frames = np.load(command_frames) if command_frames.exists() else None
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def frame(self, i: int) -> np.ndarray:
+        data = self._data[self.offsets[i]:self.offsets[i + 1]]
+        if self.meta["codec"] == "jpeg":
+            from PIL import Image
+            return np.asarray(Image.open(io.BytesIO(data.tobytes())))
+        return data.reshape(self.meta["shape"])
+
+    def frame_for_command(self, row: int) -> np.ndarray:
+        return self.frame(int(self.command_frames[row]))
+
+
+def benchmark(source, duration: float = 5.0, rate_hz: float = 40.0, work_ms: float = 2.0) -> dict:
+    '''
+    Runs a stand-in control loop (rate_hz, ~work_ms of numpy per tick) with no camera,
+    with capture only, and with capture plus encoding, and reports loop timing for each.
+    '''
+    import tempfile
+
+    a = np.random.default_rng(0).standard_normal((100, 100))
+    start = time.perf_counter()
+    for _ in range(100):
+        a @ a
+    repeats = max(1, int(work_ms * 1e-3 / ((time.perf_counter() - start) / 100)))
+
+    def control_loop(seconds):
+        work, lateness = [], []
+        next_tick = time.perf_counter()
+        end = next_tick + seconds
+        while next_tick < end:
+            delay = next_tick - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            woke = time.perf_counter()
+            lateness.append(woke - next_tick)
+            for _ in range(repeats):
+                a @ a
+            work.append(time.perf_counter() - woke)
+            next_tick += 1.0 / rate_hz
+        work, lateness = np.array(work) * 1e3, np.array(lateness) * 1e3
+        return {
+            "work_ms_p50": float(np.percentile(work, 50)), "work_ms_p99": float(np.percentile(work, 99)),
+            "late_ms_p50": float(np.percentile(lateness, 50)), "late_ms_p99": float(np.percentile(lateness, 99)),
+        }
+
+    report = {"baseline": control_loop(duration)}
+    with CameraCapture(source) as capture, tempfile.TemporaryDirectory() as tmp:
+        time.sleep(2.0)  # Let the spawned process import and open the source
+        report["capture"] = control_loop(duration)
+        start = time.perf_counter()
+        encoder = capture.record(Path(tmp) / "camera")
+        record_start_ms = (time.perf_counter() - start) * 1e3
+        report["capture_and_encode"] = control_loop(duration)
+        start = time.perf_counter()
+        stats = encoder.stop()
+        report["capture_and_encode"]["record_start_ms"] = record_start_ms
+        report["capture_and_encode"]["record_stop_ms"] = (time.perf_counter() - start) * 1e3
+        report["encoder"] = stats
+    return report
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Measure what camera capture and encoding cost a control loop")
+    parser.add_argument("--source", type=str, default="synthetic", help="'synthetic' or an OpenCV device")
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--fps", type=float, default=30.0)
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds per phase")
+    args = parser.parse_args()
+
+    report = benchmark(make_source(args.source, args.width, args.height, args.fps), duration=args.duration)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import asyncio
+import collections
+import json
+import time
+
+import numpy as np
+
+
+class ClockSync:
+    '''
+    NTP-style estimate of the headset clock relative to the server clock
+    (``time.perf_counter``), from ping/pong exchanges on the teleop WebSocket.
+
+    The server sends ``{"type": "clock_ping", "t0": server_time}`` and the headset
+    answers ``{"type": "clock_pong", "t0": ..., "t1": headset_ms}`` with its
+    ``performance.now()``. Pongs queue behind tracking frames, so only the exchanges
+    with the lowest round trip are trusted. Offset and drift come from a line fit
+    through those once they span long enough; before that, their median offset.
+    '''
+    def __init__(self, websocket, interval: float = 1.0, burst: int = 8, burst_interval: float = 0.1,
+                 window: int = 120, min_drift_span: float = 20.0):
+        self.websocket = websocket
+        self.interval = interval
+        self.burst = burst
+        self.burst_interval = burst_interval
+        self.min_drift_span = min_drift_span
+        # (server time of the exchange midpoint, headset - server offset, round trip), seconds
+        self._samples = collections.deque(maxlen=window)
+        self._task = None
+        self.offset = 0.0
+        self.drift = 0.0
+        self._reference_time = 0.0
+        self.rtt_min = None
+
+    @property
+    def synchronized(self) -> bool:
+        return len(self._samples) > 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        pings = 0
+        while True:
+            try:
+                await self.websocket.send(json.dumps({"type": "clock_ping", "t0": time.perf_counter()}))
+            except Exception:
+                # Connection is gone; the teleop handler cleans up
+                return
+            pings += 1
+            await asyncio.sleep(self.burst_interval if pings < self.burst else self.interval)
+
+    def on_pong(self, t0: float, t1_ms: float, t2: float = None):
+        '''
+        Adds one exchange: t0 server send time (s), t1_ms headset time (ms), t2 server
+        receive time (s, default now).
+        '''
+        t2 = time.perf_counter() if t2 is None else t2
+        rtt = t2 - t0
+        if not 0 <= rtt < 2.0:
+            return
+        midpoint = 0.5 * (t0 + t2)
+        self._samples.append((midpoint, t1_ms * 1e-3 - midpoint, rtt))
+        self._update()
+
+    def _update(self):
+        samples = np.array(self._samples)
+        rtts = samples[:, 2]
+        self.rtt_min = float(rtts.min())
+        # Exchanges not delayed by queueing, within 50% (or 2 ms) of the fastest
+        good = samples[rtts <= max(1.5 * self.rtt_min, self.rtt_min + 0.002)]
+        self._reference_time = float(good[-1, 0])
+        if len(good) >= 4 and good[-1, 0] - good[0, 0] >= self.min_drift_span:
+            self.drift, self.offset = np.polyfit(good[:, 0] - self._reference_time, good[:, 1], 1)
+        else:
+            self.drift, self.offset = 0.0, float(np.median(good[:, 1]))
+
+    def offset_at(self, server_time: float) -> float:
+        return self.offset + self.drift * (server_time - self._reference_time)
+
+    def to_server_time(self, headset_ms: float) -> float:
+        '''Converts a headset ``performance.now()`` timestamp to server perf_counter seconds.'''
+        headset = headset_ms * 1e-3
+        return headset - self.offset_at(headset - self.offset)
+
+    def summary(self) -> dict:
+        return {
+            "offset_ms": self.offset * 1e3,
+            "drift_ppm": self.drift * 1e6,
+            "rtt_min_ms": None if self.rtt_min is None else self.rtt_min * 1e3,
+            "samples": len(self._samples),
+        }
+
+
+class LatencyStats:
+    '''
+    Rolling distribution of a latency, kept as the last ``size`` samples.
+    '''
+    def __init__(self, size: int = 4096):
+        self._samples = np.zeros(size)
+        self.count = 0
+
+    def add(self, seconds: float):
+        self._samples[self.count % len(self._samples)] = seconds
+        self.count += 1
+
+    def reset(self):
+        self.count = 0
+
+    def values(self) -> np.ndarray:
+        return self._samples[:min(self.count, len(self._samples))]
+
+    def summary(self) -> dict:
+        values = self.values() * 1e3
+        if len(values) == 0:
+            return {"n": 0}
+        return {
+            "n": self.count,
+            "mean_ms": float(values.mean()),
+            "p50_ms": float(np.percentile(values, 50)),
+            "p90_ms": float(np.percentile(values, 90)),
+            "p99_ms": float(np.percentile(values, 99)),
+            "max_ms": float(values.max()),
+        }
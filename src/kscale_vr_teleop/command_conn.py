@@ -1,6 +1,10 @@
 import json
+import random
 import socket
 import math
+import time
+
+from kscale_vr_teleop import tracing
 
 class Commander16:
     def __init__(self, udp_ip: str = "localhost", udp_port: int = 10000):
@@ -58,8 +62,55 @@ class Commander16:
         }
 
     def send_commands(self):
-        new_commands =  (json.dumps({"commands": self.cmds}) + "\n").encode("utf-8")
-        self.sock.sendto(new_commands, (self.UDP_IP, self.UDP_PORT)) 
+        with tracing.span("encode_commands"):
+            new_commands =  (json.dumps({"commands": self.cmds}) + "\n").encode("utf-8")
+        with tracing.span("udp_send"):
+            self.sock.sendto(new_commands, (self.UDP_IP, self.UDP_PORT)) 
 
         # new_commands =  (json.dumps({"commands": self.cmds}) + "\n").encode("utf-8")
-        # self.sock.sendto(new_commands, ("192.168.1.228", 10000)) 
\ No newline at end of file
+        # self.sock.sendto(new_commands, ("192.168.1.228", 10000)) 
+
+
+# Port the robot-side demultiplexer (kscale_vr_teleop.command_demux) listens on
+UNIFIED_PORT = 10002
+
+class UnifiedCommander(Commander16):
+    '''
+    Sends the arm commands and the finger angles of both hands as one datagram per frame,
+    so they cannot arrive out of step and share one sequence number:
+
+        {"session": s, "seq": n, "timestamp": t, "commands": {...}, "right_fingers": [6], "left_fingers": [6]}
+
+    ``commands`` is the Commander16 dictionary. ``session`` is a random id per commander,
+    so the demux restarts sequence tracking when a new connection starts again from 1. kscale_vr_teleop.command_demux splits the
+    frame back into the kinfer and FingerUDPListener datagrams on the robot.
+    '''
+    def __init__(self, udp_ip: str = "localhost", udp_port: int = UNIFIED_PORT):
+        super().__init__(udp_ip=udp_ip, udp_port=udp_port)
+        self.session = random.getrandbits(32)
+        self.seq = 0
+        self.right_fingers = [0.0] * 6
+        self.left_fingers = [0.0] * 6
+
+    def update_fingers(self, right_fingers, left_fingers):
+        '''
+        Finger angles for the next frame: 6 per hand (thumb_metacarpal, thumb, index,
+        middle, ring, pinky), 0-1.
+        '''
+        self.right_fingers = [min(max(float(v), 0.0), 1.0) for v in right_fingers]
+        self.left_fingers = [min(max(float(v), 0.0), 1.0) for v in left_fingers]
+
+    def send_commands(self):
+        self.seq = (self.seq + 1) & 0xFFFFFFFF
+        with tracing.span("encode_commands"):
+            frame = {
+                "session": self.session,
+                "seq": self.seq,
+                "timestamp": time.time(),
+                "commands": self.cmds,
+                "right_fingers": self.right_fingers,
+                "left_fingers": self.left_fingers,
+            }
+            data = (json.dumps(frame) + "\n").encode("utf-8")
+        with tracing.span("udp_send"):
+            self.sock.sendto(data, (self.UDP_IP, self.UDP_PORT))
@@ -0,0 +1,182 @@
+"""
+Robot-side demultiplexer for unified command frames (``UnifiedCommander``).
+
+Receives one datagram per teleop frame carrying the arm, gripper, joystick and
+finger commands, and forwards its parts to the existing consumers on the robot:
+the ``{"commands": ...}`` datagram to the kinfer policy and the finger payload to
+``FingerUDPListener``, both over loopback, so neither consumer changes. Frames
+older than the newest one seen (reordered or duplicated on the network) are
+dropped; gaps in the sequence number are counted as lost. Sequence tracking
+restarts when a frame carries a new session id (every teleop connection has its
+own commander, counting from 1), comes from a different address, or arrives
+after idle_timeout without frames.
+
+Usage (on the robot):
+    python -m kscale_vr_teleop.command_demux [--port 10002] [--kinfer-port 10000] [--finger-port 10001]
+
+and start the server with ``signaling.py --unified-commands``.
+"""
+import argparse
+import json
+import logging
+import socket
+import time
+
+from kscale_vr_teleop.command_conn import UNIFIED_PORT
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class CommandDemux:
+    """Splits unified command frames into the kinfer and finger datagrams."""
+    def __init__(self, udp_host: str = '0.0.0.0', udp_port: int = UNIFIED_PORT, forward_host: str = '127.0.0.1',
+                 kinfer_port: int = 10000, finger_port: int = 10001, report_interval: float = 10.0,
+                 idle_timeout: float = 2.0):
+        """
+        Args:
+            udp_host (str): Host IP to bind (default: 0.0.0.0 for all interfaces).
+            udp_port (int): UDP port for unified frames.
+            forward_host (str): Host running the kinfer policy and FingerUDPListener.
+            kinfer_port (int): UDP port of the kinfer command input.
+            finger_port (int): UDP port of FingerUDPListener.
+            report_interval (float): Seconds between statistics log lines (0 disables).
+            idle_timeout (float): Seconds without frames after which any sequence number is accepted.
+        """
+        self.udp_host = udp_host
+        self.udp_port = udp_port
+        self.kinfer_addr = (forward_host, kinfer_port)
+        self.finger_addr = (forward_host, finger_port)
+        self.report_interval = report_interval
+        self.idle_timeout = idle_timeout
+        self._udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._udp_sock.bind((self.udp_host, self.udp_port))
+        self._out_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+        self.last_seq = None
+        self.session = None
+        self.source = None
+        self._last_frame = None
+        self.received = 0
+        self.forwarded = 0
+        self.stale = 0
+        self.lost = 0
+        self.invalid = 0
+        self.resets = 0
+        self._last_report = time.monotonic()
+
+    def _new_stream(self, session, source, now: float) -> bool:
+        '''
+        True if a frame starts a new stream: another session id or source address than
+        the last accepted frame, or the first frame after idle_timeout.
+        '''
+        if self.last_seq is None:
+            return True
+        if session is not None and session != self.session:
+            return True
+        if source is not None and source != self.source:
+            return True
+        return self.idle_timeout is not None and now - self._last_frame > self.idle_timeout
+
+    def _accept_seq(self, seq: int, session=None, source=None, now: float = None) -> bool:
+        '''
+        True if seq is newer than every frame seen so far in its stream (modulo 2**32
+        wraparound). A new stream is accepted from whatever sequence number it starts at.
+        '''
+        now = time.monotonic() if now is None else now
+        if self._new_stream(session, source, now):
+            if self.last_seq is not None:
+                self.resets += 1
+                logger.info(f"Command demux: new stream (session {session}, from {source}) at seq {seq}")
+            self.last_seq = seq
+            self.session = session
+            self.source = source
+            self._last_frame = now
+            return True
+        delta = (seq - self.last_seq) & 0xFFFFFFFF
+        if delta == 0 or delta >= 0x80000000:
+            self.stale += 1
+            return False
+        self.lost += delta - 1
+        self.last_seq = seq
+        self._last_frame = now
+        return True
+
+    def demux(self, data: bytes, source=None) -> bool:
+        '''
+        Forwards one unified frame received from source (address). Returns False if it was dropped.
+        '''
+        self.received += 1
+        try:
+            frame = json.loads(data)
+            seq = int(frame["seq"])
+            # Frames from senders without session ids are one session per source
+            session = frame.get("session")
+            commands = frame["commands"]
+            right_fingers = frame["right_fingers"]
+            left_fingers = frame["left_fingers"]
+        except (ValueError, KeyError, TypeError):
+            self.invalid += 1
+            return False
+        if not self._accept_seq(seq, session, source):
+            return False
+
+        # Same datagrams Commander16 and FingerUDPHandler send
+        self._out_sock.sendto((json.dumps({"commands": commands}) + "\n").encode("utf-8"), self.kinfer_addr)
+        self._out_sock.sendto(json.dumps({
+            "timestamp": frame.get("timestamp", time.time()),
+            "right_fingers": right_fingers,
+            "left_fingers": left_fingers,
+        }).encode("utf-8"), self.finger_addr)
+        self.forwarded += 1
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "received": self.received,
+            "forwarded": self.forwarded,
+            "stale": self.stale,
+            "lost": self.lost,
+            "invalid": self.invalid,
+            "resets": self.resets,
+        }
+
+    def process_packet(self) -> bool:
+        """
+        Receive and forward a single unified frame.
+
+        Returns: True if a frame was forwarded.
+        """
+        data, source = self._udp_sock.recvfrom(4096)
+        forwarded = self.demux(data, source)
+        if self.report_interval and time.monotonic() - self._last_report >= self.report_interval:
+            self._last_report = time.monotonic()
+            logger.info(f"Command demux: {self.stats()}")
+        return forwarded
+
+    def run(self) -> None:
+        """
+        Main loop to continuously forward incoming frames.
+        """
+        logger.info(f"Command demux listening on {self.udp_host}:{self.udp_port}, "
+                    f"kinfer -> {self.kinfer_addr}, fingers -> {self.finger_addr}")
+        try:
+            while True:
+                self.process_packet()
+        except KeyboardInterrupt:
+            logger.info(f"Command demux stopped: {self.stats()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Forward unified teleop command frames to kinfer and the finger listener")
+    parser.add_argument("--host", type=str, default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=UNIFIED_PORT)
+    parser.add_argument("--forward-host", type=str, default="127.0.0.1")
+    parser.add_argument("--kinfer-port", type=int, default=10000)
+    parser.add_argument("--finger-port", type=int, default=10001)
+    args = parser.parse_args()
+    CommandDemux(args.host, args.port, args.forward_host, args.kinfer_port, args.finger_port).run()
+
+
+if __name__ == "__main__":
+    main()
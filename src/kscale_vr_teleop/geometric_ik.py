@@ -0,0 +1,591 @@
+"""
+Closed-form geometric IK for the K-Bot arms, with optional numeric refinement.
+
+Each arm is shoulder pitch, roll and yaw, elbow and wrist roll. Pitch and roll
+intersect at a shoulder point S, and the end effector sits on the wrist roll
+axis, so its position only depends on the first four joints and its forward
+(z) axis only on the first four joints too:
+
+    1. the swivel (shoulder yaw) is picked from the target forward direction,
+       treating the shoulder as spherical,
+    2. the elbow follows exactly from |p - S| for that yaw (law of cosines
+       about the elbow axis, which includes the URDF offsets),
+    3. pitch and roll rotate the resulting arm vector onto p - S (two
+       intersecting axes, closed form),
+    4. wrist roll aligns the end effector up (y) axis.
+
+Every step has two branches at most. Of the combinations within the joint
+limits the one with the best forward axis wins, ties going to the one closest
+to the previous solution, so there is no warm start to lose after a jump. A
+couple of secant steps on the yaw then correct the swivel for what the
+spherical-shoulder model leaves out, and one or two Levenberg-Marquardt steps
+on the pose error trade position against orientation the way the numeric
+solver's residual does, without giving up position to do it.
+
+The gripper tip is kept above the residual's floor (IKWeights.z_min): targets
+whose tip would be below it are raised first, the refinement carries the floor
+as a hinge term, and any remaining violation is removed by minimum-norm joint
+steps that lift the tip.
+
+The arm geometry (axes, offsets, limits) is read from the URDF and kept in
+product-of-exponentials form by ``ArmChain``, which also gives the forward
+kinematics and the analytic Jacobian.
+
+Usage:
+    ik_solver = GeometricIK(urdf_path, ['PRT0001', 'PRT0001_2'], 'base')
+    joints = ik_solver.inverse_kinematics(targets)   # (2, 4, 4) -> (10,), same order as RobotInverseKinematics
+
+    python -m kscale_vr_teleop.geometric_ik   # compares against RobotInverseKinematics
+"""
+import argparse
+import math
+import time
+from typing import Optional
+
+import numpy as np
+
+from kscale_vr_teleop._assets import ASSETS_DIR
+from kscale_vr_teleop.ik_weights import DEFAULT_WEIGHTS, IKWeights
+from kscale_vr_teleop.link_poses import ACTIVE_JOINTS
+from kscale_vr_teleop.robot_model import RobotModel
+
+DEFAULT_URDF_PATH = str(ASSETS_DIR / "kbot_legless" / "robot.urdf")
+EE_LINKS = ['PRT0001', 'PRT0001_2']
+# Cost of moving away from the previous solution (per rad^2) when choosing between branches,
+# against 1 - cos(forward axis error): a 1 rad jump weighs as much as 1.8 degrees off, so it only
+# breaks near-ties between branches and never trades away orientation
+PREVIOUS_WEIGHT = 0.0005
+# A refinement step may not increase the position error by more than this (m), unless it lifts
+# the gripper tip back above the floor
+POSITION_SLACK = 1e-3
+# Tip height below z_min still accepted (m), and the lifting steps spent getting there
+FLOOR_TOLERANCE = 1e-4
+FLOOR_STEPS = 5
+_I3 = np.eye(3)
+
+
+def _skew(v: np.ndarray) -> np.ndarray:
+    return np.array([[0.0, -v[2], v[1]], [v[2], 0.0, -v[0]], [-v[1], v[0], 0.0]])
+
+
+# np.cross costs several microseconds on 3-vectors, more than the rest of a solve step
+def _cross(u: np.ndarray, v: np.ndarray) -> np.ndarray:
+    return np.array([u[1] * v[2] - u[2] * v[1], u[2] * v[0] - u[0] * v[2], u[0] * v[1] - u[1] * v[0]])
+
+
+def _cross_rows(u: np.ndarray, v: np.ndarray) -> np.ndarray:
+    '''Row-wise cross product of two (n, 3) arrays.'''
+    return np.stack([u[:, 1] * v[:, 2] - u[:, 2] * v[:, 1], u[:, 2] * v[:, 0] - u[:, 0] * v[:, 2],
+                     u[:, 0] * v[:, 1] - u[:, 1] * v[:, 0]], axis=-1)
+
+
+def _rotation(axis: np.ndarray, angle: float) -> np.ndarray:
+    k = _skew(axis)
+    return _I3 + math.sin(angle) * k + (1.0 - math.cos(angle)) * (k @ k)
+
+
+def _angle_about(axis: np.ndarray, u: np.ndarray, v: np.ndarray) -> float:
+    '''Angle rotating u onto v about axis, using only their components perpendicular to it.'''
+    return math.atan2(axis @ _cross(u, v), u @ v - (axis @ u) * (axis @ v))
+
+
+def _two_axis_rotations(a0: np.ndarray, a1: np.ndarray, x: np.ndarray, y: np.ndarray) -> list[tuple[float, float]]:
+    '''
+    Angle pairs with Rot(a0, q0) Rot(a1, q1) x = y for intersecting axes (both through the
+    origin). Two solutions in general; if y is out of reach, the closest single one.
+    '''
+    c = a0 @ a1
+    denominator = c * c - 1.0
+    alpha = (c * (a1 @ x) - a0 @ y) / denominator
+    beta = (c * (a0 @ y) - a1 @ x) / denominator
+    normal = _cross(a0, a1)
+    gamma_sq = (x @ x - alpha * alpha - beta * beta - 2.0 * alpha * beta * c) / (normal @ normal)
+    gammas = (0.0,) if gamma_sq <= 0.0 else (math.sqrt(gamma_sq), -math.sqrt(gamma_sq))
+    solutions = []
+    for gamma in gammas:
+        z = alpha * a0 + beta * a1 + gamma * normal
+        solutions.append((_angle_about(a0, z, y), _angle_about(a1, x, z)))
+    return solutions
+
+
+class ArmChain:
+    '''
+    One serial chain from the URDF root to an end effector link, in product-of-exponentials
+    form: every movable joint is an axis and a point on it at the zero configuration
+    (root frame), and the end effector pose at zero is home. Matches the forward
+    kinematics of RobotInverseKinematics (origin, then rotation about the joint axis).
+    '''
+    def __init__(self, model: RobotModel, ee_link: str, base_link_name: str):
+        self.joint_names, axes, points, lower, upper = [], [], [], [], []
+        transform = np.eye(4)
+        for joint in model.chain(base_link_name, ee_link):
+            transform = transform @ model.joint_origins[joint]
+            if model.joint_types[joint] == 'fixed':
+                continue
+            axis = model.joint_axes[joint]
+            self.joint_names.append(model.joint_names[joint])
+            axes.append(transform[:3, :3] @ (axis / np.linalg.norm(axis)))
+            points.append(transform[:3, 3].copy())
+            lower.append(model.joint_limits[joint, 0])
+            upper.append(model.joint_limits[joint, 1])
+
+        self.axes = np.array(axes)
+        self.points = np.array(points)
+        self.lower = np.array(lower)
+        self.upper = np.array(upper)
+        self.home = transform
+        self._k = np.array([_skew(axis) for axis in self.axes])
+        self._k2 = self._k @ self._k
+        self._identity = np.broadcast_to(np.eye(4), (len(self.axes), 4, 4)).copy()
+
+    def rotation(self, i: int, angle: float) -> np.ndarray:
+        '''Rotation of joint i by angle, in the zero-configuration root frame.'''
+        return _I3 + math.sin(angle) * self._k[i] + (1.0 - math.cos(angle)) * self._k2[i]
+
+    def _exponentials(self, q) -> np.ndarray:
+        '''Rigid transform of every joint (rotation about its zero-configuration axis), (n, 4, 4).'''
+        q = np.asarray(q, dtype=np.float64)[:, None, None]
+        rotations = _I3 + np.sin(q) * self._k + (1.0 - np.cos(q)) * self._k2
+        transforms = self._identity.copy()
+        transforms[:, :3, :3] = rotations
+        transforms[:, :3, 3] = self.points - (rotations @ self.points[:, :, None])[:, :, 0]
+        return transforms
+
+    def forward(self, q) -> np.ndarray:
+        '''End effector pose (4, 4) for joint angles q.'''
+        transforms = self._exponentials(q)
+        pose = transforms[0]
+        for transform in transforms[1:]:
+            pose = pose @ transform
+        return pose @ self.home
+
+    def forward_with_axes(self, q) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        '''
+        End effector pose plus the axis and a point of every joint at q, in the root frame;
+        the Jacobian columns are built from these.
+        '''
+        transforms = self._exponentials(q)
+        # Transform applied to joint i: the product of the joints before it
+        prefixes = self._identity.copy()
+        for i in range(1, len(transforms)):
+            prefixes[i] = prefixes[i - 1] @ transforms[i - 1]
+        pose = prefixes[-1] @ transforms[-1] @ self.home
+        axes = (prefixes[:, :3, :3] @ self.axes[:, :, None])[:, :, 0]
+        points = (prefixes[:, :3, :3] @ self.points[:, :, None])[:, :, 0] + prefixes[:, :3, 3]
+        return pose, axes, points
+
+    def residuals(self, q, target: np.ndarray, jacobian: bool = False, weights: IKWeights = DEFAULT_WEIGHTS):
+        '''
+        This arm's part of the RobotInverseKinematics residual (position, forward and up
+        alignment, floor penalty), and optionally its analytic Jacobian (6, num_joints).
+        '''
+        pose, axes, points = self.forward_with_axes(q)
+        position, up, forward = pose[:3, 3], pose[:3, 1], pose[:3, 2]
+        forward_dot = forward @ -target[:3, 2]
+        up_dot = up @ -target[:3, 1]
+        tip_z = position[2] + weights.gripper_offset * forward[2]
+        x = weights.z_min - tip_z
+        tanh = math.tanh(weights.penalty_sharpness * x)
+        r = np.empty(6)
+        r[:3] = position - target[:3, 3]
+        # arccos(x) ~ pi/2 - x - x^3/6, as in RobotInverseKinematics
+        r[3] = weights.orientation * (math.pi / 2 - forward_dot - forward_dot ** 3 / 6)
+        r[4] = weights.orientation * (math.pi / 2 - up_dot - up_dot ** 3 / 6)
+        r[5] = weights.penalty * x / 2 * (1 + tanh)
+        if not jacobian:
+            return r
+
+        d_position = _cross_rows(axes, position - points)
+        # Rows of axes x v, as axes @ skew(v)
+        d_forward = axes @ _skew(forward)
+        d_up = axes @ _skew(up)
+        j = np.empty((6, len(q)))
+        j[:3] = d_position.T
+        j[3] = -weights.orientation * (1 + forward_dot ** 2 / 2) * (d_forward @ -target[:3, 2])
+        j[4] = -weights.orientation * (1 + up_dot ** 2 / 2) * (d_up @ -target[:3, 1])
+        d_relu = 0.5 * (1 + tanh) + x / 2 * weights.penalty_sharpness * (1 - tanh * tanh)
+        j[5] = -weights.penalty * d_relu * (d_position[:, 2] + weights.gripper_offset * d_forward[:, 2])
+        return r, j
+
+    def tip_height(self, q, weights: IKWeights = DEFAULT_WEIGHTS) -> tuple[float, np.ndarray]:
+        '''Height of the gripper tip (the floor penalty's z) and its gradient in q.'''
+        pose, axes, points = self.forward_with_axes(q)
+        position, forward = pose[:3, 3], pose[:3, 2]
+        d_position = _cross_rows(axes, position - points)
+        d_forward = axes @ _skew(forward)
+        return position[2] + weights.gripper_offset * forward[2], d_position[:, 2] + weights.gripper_offset * d_forward[:, 2]
+
+    def pose_error(self, q, target: np.ndarray, weights: IKWeights = DEFAULT_WEIGHTS):
+        '''
+        Position error, weighted forward/up axis errors and the floor hinge (10,) with their
+        Jacobian. Same minimum as residuals() for a reachable target above the floor, but
+        zero there, which Gauss-Newton needs to converge quickly: the arccos terms of
+        residuals() bottom out above zero.
+        '''
+        pose, axes, points = self.forward_with_axes(q)
+        position, up, forward = pose[:3, 3], pose[:3, 1], pose[:3, 2]
+        d_position = _cross_rows(axes, position - points)
+        d_forward = axes @ _skew(forward)
+        r = np.zeros(10)
+        r[:3] = position - target[:3, 3]
+        r[3:6] = weights.orientation * (forward + target[:3, 2])
+        r[6:9] = weights.orientation * (up + target[:3, 1])
+        j = np.zeros((10, len(q)))
+        j[:3] = d_position.T
+        j[3:6] = weights.orientation * d_forward.T
+        j[6:9] = weights.orientation * (axes @ _skew(up)).T
+        depth = weights.z_min - (position[2] + weights.gripper_offset * forward[2])
+        if depth > 0.0:
+            r[9] = weights.penalty * depth
+            j[9] = -weights.penalty * (d_position[:, 2] + weights.gripper_offset * d_forward[:, 2])
+        return r, j
+
+
+class GeometricArmIK:
+    '''
+    Closed-form IK for one 5-DOF arm (see the module docstring), optionally refined
+    with Levenberg-Marquardt steps on ArmChain.pose_error.
+    '''
+    def __init__(self, chain: ArmChain, refine_iterations: int = 2, damping: float = 1e-3):
+        if len(chain.joint_names) != 5:
+            raise ValueError(f"Expected a 5-DOF arm, got joints {chain.joint_names}")
+        self.chain = chain
+        self.refine_iterations = refine_iterations
+        self.damping = damping
+        self.weights = DEFAULT_WEIGHTS
+        a, o = chain.axes, chain.points
+        # Shoulder point: where the pitch and roll axes meet (midpoint of closest approach)
+        w = o[0] - o[1]
+        b = a[0] @ a[1]
+        s0 = (b * (a[1] @ w) - a[0] @ w) / (1 - b * b)
+        s1 = ((a[1] @ w) - b * (a[0] @ w)) / (1 - b * b)
+        self.shoulder = (o[0] + s0 * a[0] + o[1] + s1 * a[1]) / 2
+        self.home_position = chain.home[:3, 3]
+        self.home_forward = chain.home[:3, 2]
+        # End effector relative to the elbow axis at zero
+        self._elbow_vector = self.home_position - o[3]
+
+    def _rotate_about(self, i: int, angle: float, x: np.ndarray) -> np.ndarray:
+        '''Point x rotated by angle about joint i's axis (zero configuration).'''
+        o = self.chain.points[i]
+        return o + self.chain.rotation(i, angle) @ (x - o)
+
+    def _elbow_angles(self, yaw: float, distance: float) -> tuple[list[float], bool]:
+        '''
+        Elbow angles putting the end effector at distance from the shoulder for this yaw,
+        and whether the distance is reachable (otherwise the closest angle).
+        '''
+        a, o3 = self.chain.axes[3], self.chain.points[3]
+        # Rotating the arm about the yaw axis is rigid, so rotate the shoulder point back instead
+        c = self._rotate_about(2, -yaw, self.shoulder) - o3
+        v = self._elbow_vector
+        ca, av = c @ a, a @ v
+        alpha = c @ v - ca * av
+        beta = c @ _cross(a, v)
+        gamma = (v @ v + c @ c - distance * distance) / 2 - ca * av
+        radius = math.hypot(alpha, beta)
+        phase = math.atan2(beta, alpha)
+        ratio = gamma / radius
+        if abs(ratio) > 1.0:
+            return [phase + (0.0 if ratio > 0 else math.pi)], False
+        offset = math.acos(ratio)
+        return [phase + offset, phase - offset], True
+
+    def _swivel(self, direction: np.ndarray, target_forward: np.ndarray, elbow: float) -> list[float]:
+        '''
+        Shoulder yaws (one per pitch/roll branch) that best point the end effector forward
+        axis at target_forward while the arm points along direction, treating the shoulder
+        as spherical.
+        '''
+        a = self.chain.axes
+        arm = self._rotate_about(3, elbow, self.home_position) - self.shoulder
+        forward = self.chain.rotation(3, elbow) @ self.home_forward
+        arm /= np.linalg.norm(arm)
+        # Shortest rotation taking the arm onto direction, then the free turn about direction
+        axis = _cross(arm, direction)
+        sin_angle = np.linalg.norm(axis)
+        align = _I3 if sin_angle < 1e-9 else _rotation(axis / sin_angle, math.atan2(sin_angle, arm @ direction))
+        g = align @ forward
+        turn = math.atan2(_cross(direction, g) @ target_forward,
+                          g @ target_forward - (g @ direction) * (direction @ target_forward))
+        shoulder_rotation = _rotation(direction, turn) @ align
+        # Shoulder rotation = Rot(pitch) Rot(roll) Rot(yaw), and the yaw rotation leaves its own axis alone
+        reference = _cross(a[2], [1.0, 0.0, 0.0] if abs(a[2][0]) < 0.9 else [0.0, 1.0, 0.0])
+        yaws = []
+        for pitch, roll in _two_axis_rotations(a[0], a[1], a[2], shoulder_rotation @ a[2]):
+            partial = self.chain.rotation(0, pitch) @ self.chain.rotation(1, roll)
+            yaws.append(_angle_about(a[2], reference, partial.T @ shoulder_rotation @ reference))
+        return yaws
+
+    def _limit_violation(self, q: np.ndarray) -> float:
+        return float(np.sum(np.maximum(self.chain.lower - q, 0.0) + np.maximum(q - self.chain.upper, 0.0)))
+
+    def _wrap(self, i: int, angle: float, reference: float) -> float:
+        '''angle shifted by a multiple of 2 pi into joint i's limits if it can be, else nearest reference.'''
+        lower, upper = self.chain.lower[i], self.chain.upper[i]
+        angle = math.remainder(angle, 2 * math.pi)
+        return min((angle - 2 * math.pi, angle, angle + 2 * math.pi),
+                   key=lambda shifted: (max(lower - shifted, shifted - upper, 0.0), abs(shifted - reference)))
+
+    def _nearest_in_limits(self, i: int, angles, reference: float) -> float:
+        '''Of the candidate angles for joint i, the one within (or closest to) its limits and nearest reference.'''
+        lower, upper = self.chain.lower[i], self.chain.upper[i]
+        angles = [self._wrap(i, angle, reference) for angle in angles]
+        return min(angles, key=lambda angle: (max(lower - angle, angle - upper, 0.0), abs(angle - reference)))
+
+    def _candidates(self, yaw: float, offset: np.ndarray, distance: float, target_forward: np.ndarray,
+                    previous: np.ndarray) -> tuple[float, np.ndarray, float]:
+        '''
+        Best exact elbow, pitch and roll for this yaw: (cost, q, turn), where turn is how far
+        the forward axis still is from target_forward about the shoulder-target direction.
+        Candidates that reach the target within the limits win, then the best forward axis,
+        then the one closest to previous.
+        '''
+        a = self.chain.axes
+        direction = offset / max(distance, 1e-9)
+        yaw_rotation = self.chain.rotation(2, yaw)
+        best = None
+        for elbow in self._elbow_angles(yaw, distance)[0]:
+            elbow = self._wrap(3, elbow, previous[3])
+            arm = self._rotate_about(2, yaw, self._rotate_about(3, elbow, self.home_position)) - self.shoulder
+            forward = yaw_rotation @ (self.chain.rotation(3, elbow) @ self.home_forward)
+            for pitch, roll in _two_axis_rotations(a[0], a[1], arm, direction * np.linalg.norm(arm)):
+                q = np.array([self._wrap(0, pitch, previous[0]), self._wrap(1, roll, previous[1]), yaw, elbow, 0.0])
+                shoulder_rotation = self.chain.rotation(0, pitch) @ self.chain.rotation(1, roll)
+                # Pitch and roll cannot always carry the arm onto the target when the yaw came
+                # from the spherical model
+                miss = np.linalg.norm(shoulder_rotation @ arm - offset)
+                g = shoulder_rotation @ forward
+                cost = ((self._limit_violation(q) + miss) * 1e3 + (1.0 - g @ target_forward)
+                        + PREVIOUS_WEIGHT * float(np.sum((q[:4] - previous[:4]) ** 2)))
+                if best is None or cost < best[0]:
+                    best = (cost, q, _angle_about(direction, g, target_forward))
+        return best
+
+    def solve_geometric(self, target: np.ndarray, previous: np.ndarray, yaw_steps: int = 2) -> np.ndarray:
+        '''
+        Closed-form joint angles for a 4x4 target (root frame), branches chosen within the
+        joint limits, by forward axis error and by distance to previous. Unreachable targets
+        get the closest pose.
+        '''
+        lower, upper = self.chain.lower, self.chain.upper
+        offset = target[:3, 3] - self.shoulder
+        distance = np.linalg.norm(offset)
+        direction = offset / max(distance, 1e-9)
+
+        # Swivel from the spherical-shoulder model, with the elbow angle for yaw 0
+        target_forward = -target[:3, 2]
+        elbow = np.clip(self._nearest_in_limits(3, self._elbow_angles(0.0, distance)[0], previous[3]), lower[3], upper[3])
+        yaws = {float(np.clip(self._wrap(2, yaw, previous[2]), lower[2], upper[2]))
+                for yaw in self._swivel(direction, target_forward, elbow)}
+
+        best = min((self._candidates(yaw, offset, distance, target_forward, previous) for yaw in yaws),
+                   key=lambda candidate: candidate[0])
+        # The spherical model is off by the joint offsets, worst near a straight arm. Turning the
+        # yaw turns the forward axis about the target direction nearly one to one, so secant
+        # steps on the remaining turn close the gap.
+        yaw, turn, slope = best[1][2], best[2], 1.0
+        for _ in range(yaw_steps):
+            if abs(turn) < 1e-4:
+                break
+            next_yaw = float(np.clip(yaw - turn / slope, lower[2], upper[2]))
+            if next_yaw == yaw:
+                break
+            candidate = self._candidates(next_yaw, offset, distance, target_forward, previous)
+            if abs(candidate[2] - turn) > 1e-6:
+                slope = float(np.clip((candidate[2] - turn) / (next_yaw - yaw), 0.2, 5.0))
+            yaw, turn = next_yaw, candidate[2]
+            if candidate[0] < best[0]:
+                best = candidate
+        q = np.clip(best[1], lower, upper)
+
+        # Wrist roll turns the up axis towards the target's; the forward axis stays put
+        pose, axes, _ = self.chain.forward_with_axes(q)
+        q[4] = np.clip(self._wrap(4, _angle_about(axes[4], pose[:3, 1], -target[:3, 1]), previous[4]), lower[4], upper[4])
+        return q
+
+    def refine(self, q: np.ndarray, target: np.ndarray, iterations: int) -> np.ndarray:
+        '''
+        Levenberg-Marquardt steps on the pose error, kept within the limits; a step is
+        only taken if it lowers the error without moving the end effector more than
+        POSITION_SLACK further from the target (unless it lifts the tip towards the floor).
+        '''
+        r, j = self.chain.pose_error(q, target, self.weights)
+        cost = r @ r
+        damping = self.damping
+        for _ in range(iterations):
+            h = j.T @ j
+            step = np.linalg.solve(h + damping * (np.diag(np.diag(h)) + 1e-9 * np.eye(len(q))), -j.T @ r)
+            candidate = np.clip(q + step, self.chain.lower, self.chain.upper)
+            candidate_r, candidate_j = self.chain.pose_error(candidate, target, self.weights)
+            candidate_cost = candidate_r @ candidate_r
+            keeps_position = (np.linalg.norm(candidate_r[:3]) <= np.linalg.norm(r[:3]) + POSITION_SLACK
+                              or candidate_r[9] < r[9])
+            if candidate_cost < cost and keeps_position:
+                q, r, j, cost = candidate, candidate_r, candidate_j, candidate_cost
+                damping *= 0.3
+            else:
+                damping *= 10.0
+        return q
+
+    def above_floor(self, target: np.ndarray) -> np.ndarray:
+        '''
+        target raised just enough that the gripper tip of a pose matching it is at or
+        above the floor (the residual points the end effector z axis against the target's).
+        '''
+        depth = self.weights.z_min - (target[2, 3] - self.weights.gripper_offset * target[2, 2])
+        if depth <= 0.0:
+            return target
+        target = target.copy()
+        target[2, 3] += depth
+        return target
+
+    def lift(self, q: np.ndarray) -> np.ndarray:
+        '''
+        Minimum-norm joint steps raising the gripper tip to the floor where the solution
+        still leaves it below (unreachable targets, joint limits).
+        '''
+        for _ in range(FLOOR_STEPS):
+            height, gradient = self.chain.tip_height(q, self.weights)
+            depth = self.weights.z_min - height
+            if depth <= FLOOR_TOLERANCE or not gradient @ gradient > 0.0:
+                break
+            q = np.clip(q + gradient * (depth / (gradient @ gradient)), self.chain.lower, self.chain.upper)
+        return q
+
+    def solve(self, target: np.ndarray, previous: np.ndarray) -> np.ndarray:
+        target = self.above_floor(target)
+        q = self.solve_geometric(target, previous)
+        if self.refine_iterations:
+            q = self.refine(q, target, self.refine_iterations)
+        return self.lift(q)
+
+
+class GeometricIK:
+    '''
+    Drop-in for RobotInverseKinematics (same joint order, inverse_kinematics,
+    forward_kinematics, last_solution and bounds) that solves both arms in closed form.
+    Pure NumPy, so it needs no JAX and no compile step.
+    '''
+    def __init__(self, filepath: str = DEFAULT_URDF_PATH, ee_links: list[str] = EE_LINKS,
+                 base_link_name: str = 'base', refine_iterations: int = 2) -> None:
+        model = RobotModel.load(filepath)
+        self.chains = [ArmChain(model, ee_link, base_link_name) for ee_link in ee_links]
+        self.arms = [GeometricArmIK(chain, refine_iterations) for chain in self.chains]
+        self.active_joints = [name for chain in self.chains for name in chain.joint_names]
+        if self.active_joints != ACTIVE_JOINTS:
+            raise ValueError(f"Unexpected joint order {self.active_joints}")
+        self._slices = []
+        start = 0
+        for chain in self.chains:
+            self._slices.append(slice(start, start + len(chain.joint_names)))
+            start += len(chain.joint_names)
+        self.lower_bounds = np.concatenate([chain.lower for chain in self.chains])
+        self.upper_bounds = np.concatenate([chain.upper for chain in self.chains])
+        self.last_solution = np.zeros(len(self.active_joints))
+
+    def configure(self, weights: Optional[dict] = None, tolerances: Optional[dict] = None) -> dict:
+        '''
+        Changes IKWeights fields (the orientation weight in the refinement, and the floor:
+        z_min, gripper_offset and the penalty weight). There are no solver tolerances. Returns the current settings.
+        '''
+        if tolerances:
+            raise ValueError("The geometric solver has no tolerances")
+        if weights:
+            new_weights = self.arms[0].weights._replace(**{name: float(value) for name, value in weights.items()})
+            for arm in self.arms:
+                arm.weights = new_weights
+        return {"weights": self.arms[0].weights._asdict(), "tolerances": {}}
+
+    def forward_kinematics(self, joint_angles) -> np.ndarray:
+        joint_angles = np.asarray(joint_angles, dtype=np.float64)
+        return np.array([chain.forward(joint_angles[s]) for chain, s in zip(self.chains, self._slices)])
+
+    def inverse_kinematics(self, transform_targets) -> np.ndarray:
+        '''
+        transform_targets is Nx4x4, one per end effector link. Returns all joint angles.
+        '''
+        transform_targets = np.asarray(transform_targets, dtype=np.float64)
+        previous = np.asarray(self.last_solution, dtype=np.float64)
+        solution = np.empty(len(self.active_joints))
+        for arm, s, target in zip(self.arms, self._slices, transform_targets):
+            solution[s] = arm.solve(target, previous[s])
+        self.last_solution = solution
+        return solution
+
+
+def compare(num_targets: int = 300, seed: int = 0, jump_every: int = 10):
+    '''
+    Solves a random-walk target sequence (with a jump every jump_every targets) with
+    GeometricIK (closed form, and refined) and RobotInverseKinematics, and reports
+    time per solve, end effector errors (against the target raised above the floor,
+    where its gripper tip would be below it) and the lowest gripper tip.
+    '''
+    from kscale_vr_teleop.benchmarks.trajectories import targets_from_joints
+    from kscale_vr_teleop.jax_ik import RobotInverseKinematics
+    from kscale_vr_teleop.teleop_core import home_position
+
+    rng = np.random.default_rng(seed)
+    geometric = GeometricIK(refine_iterations=2)
+    lower, upper = geometric.lower_bounds, geometric.upper_bounds
+    q = home_position().astype(np.float64)
+    joint_path = []
+    for i in range(num_targets):
+        if i % jump_every == 0:
+            q = rng.uniform(lower, upper)
+        else:
+            q = np.clip(q + rng.normal(0, 0.03, q.shape), lower, upper)
+        joint_path.append(q)
+    targets = targets_from_joints(geometric.forward_kinematics, np.array(joint_path))
+    feasible = np.array([[arm.above_floor(t) for arm, t in zip(geometric.arms, target)] for target in targets])
+    weights = geometric.arms[0].weights
+
+    solvers = {
+        "geometric": GeometricIK(refine_iterations=0),
+        "geometric+refine": geometric,
+        "jax": RobotInverseKinematics(DEFAULT_URDF_PATH, EE_LINKS, 'base'),
+    }
+    results = {}
+    for name, solver in solvers.items():
+        solver.last_solution = home_position().astype(np.float64)
+        times, position_errors, angle_errors, costs, tips = [], [], [], [], []
+        for target, feasible_target in zip(targets, feasible):
+            start = time.perf_counter()
+            joints = np.asarray(solver.inverse_kinematics(target))
+            times.append(time.perf_counter() - start)
+            achieved = geometric.forward_kinematics(joints)
+            position_errors.append(np.linalg.norm(achieved[:, :3, 3] - feasible_target[:, :3, 3], axis=1).max())
+            tips.append((achieved[:, 2, 3] + weights.gripper_offset * achieved[:, 2, 2]).min())
+            # The residual points the end effector z axis against the target's
+            angle_errors.append(np.degrees(np.arccos(np.clip(-np.sum(achieved[:, :3, 2] * target[:, :3, 2], axis=1), -1, 1))).max())
+            costs.append(sum(float(r @ r) for chain, s, t in zip(geometric.chains, geometric._slices, target)
+                             for r in [chain.residuals(joints[s], t)]))
+        times = np.array(times[1:]) * 1e3
+        results[name] = {
+            "median_ms": float(np.median(times)),
+            "p99_ms": float(np.percentile(times, 99)),
+            "position_error_mm_median": float(np.median(position_errors) * 1e3),
+            "position_error_mm_max": float(np.max(position_errors) * 1e3),
+            "forward_error_deg_median": float(np.median(angle_errors)),
+            "residual_cost_median": float(np.median(costs)),
+            "tip_z_min_mm": float(np.min(tips) * 1e3),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the geometric IK against RobotInverseKinematics")
+    parser.add_argument("--targets", type=int, default=300)
+    parser.add_argument("--jump-every", type=int, default=10, help="Targets between random jumps in joint space")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    results = compare(args.targets, args.seed, args.jump_every)
+    print(f"{'solver':<18}{'median ms':>10}{'p99 ms':>10}{'pos mm':>9}{'max mm':>9}{'fwd deg':>9}{'cost':>10}{'tip mm':>9}")
+    for name, r in results.items():
+        print(f"{name:<18}{r['median_ms']:>10.3f}{r['p99_ms']:>10.3f}{r['position_error_mm_median']:>9.2f}"
+              f"{r['position_error_mm_max']:>9.2f}{r['forward_error_deg_median']:>9.2f}{r['residual_cost_median']:>10.5f}"
+              f"{r['tip_z_min_mm']:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
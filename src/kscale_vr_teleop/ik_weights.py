@@ -0,0 +1,24 @@
+"""
+Residual weights shared by the IK solvers (jax_ik, numpy_kinematics, geometric_ik).
+
+They can be changed at runtime with an ``ik_config`` message on the teleop WebSocket.
+"""
+from typing import NamedTuple
+
+
+class IKWeights(NamedTuple):
+    '''
+    Terms of the RobotInverseKinematics residual, per arm. A NamedTuple is a JAX pytree,
+    so the JAX backend takes it as a traced argument and new values need no recompile.
+    '''
+    # Per unit of forward and up axis misalignment (about a radian)
+    orientation: float = 0.1
+    # Floor penalty: weight, height the gripper tip must stay above (m), and sharpness of its smooth relu
+    penalty: float = 100.0
+    z_min: float = -0.25
+    penalty_sharpness: float = 1e4
+    # End effector to gripper tip, along the end effector z axis (m)
+    gripper_offset: float = 0.21
+
+
+DEFAULT_WEIGHTS = IKWeights()
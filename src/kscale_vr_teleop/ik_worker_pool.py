@@ -0,0 +1,382 @@
+"""Multi-process IK worker pool.
+
+Each worker process holds its own warmed ``RobotInverseKinematics``. Targets and
+results are exchanged through a per-worker ring of shared-memory slots; the only
+thing that crosses the pipes is a tiny fixed-size header naming the slot, so
+nothing is pickled on the hot path.
+
+Sessions (one per teleop client) are pinned to a worker so the warm start from
+the previous frame stays in that worker's memory.
+
+A solve that raises in the worker fails only that request (IKWorkerError). A
+worker that dies or stops answering fails everything pending on it and is
+marked dead; its sessions move to another worker on their next solve, seeded
+with their last solution.
+"""
+import asyncio
+import itertools
+import logging
+import multiprocessing as mp
+import os
+import struct
+import time
+import traceback
+from multiprocessing import shared_memory
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# (slot index, session id). A negative slot is a control message.
+_HEADER = struct.Struct('<iq')
+_RELEASE_SESSION = -1
+_SHUTDOWN = -2
+# Results: (slot index, session id, status)
+_RESULT = struct.Struct('<iqi')
+_OK = 0
+_FAILED = 1
+# Seconds a solve may take before its worker is considered hung (covers a recompile for a new shape)
+SOLVE_TIMEOUT = 5.0
+
+
+class IKWorkerError(RuntimeError):
+    '''An IK solve failed in, or was lost with, a worker process.'''
+
+
+def _slot_dtype(num_joints: int, num_ee: int) -> np.dtype:
+    return np.dtype([
+        ('reseed', np.int64),
+        ('seed', np.float64, (num_joints,)),
+        ('targets', np.float64, (num_ee, 4, 4)),
+        ('joints', np.float64, (num_joints,)),
+        ('ee_poses', np.float64, (num_ee, 4, 4)),
+        ('solve_time', np.float64),
+    ])
+
+
+def _worker_main(shm_name, num_slots, num_joints, urdf_path, ee_links, base_link_name, request_conn, result_conn):
+    # One compute thread per worker, otherwise N workers oversubscribe the cores and solves/s stops scaling
+    os.environ.setdefault('XLA_FLAGS', '--xla_cpu_multi_thread_eigen=false intra_op_parallelism_threads=1')
+    os.environ.setdefault('OMP_NUM_THREADS', '1')
+    os.environ.setdefault('OPENBLAS_NUM_THREADS', '1')
+    from kscale_vr_teleop.jax_ik import RobotInverseKinematics
+    import jax.numpy as jnp
+
+    ik_solver = RobotInverseKinematics(urdf_path, ee_links, base_link_name)
+    home_solution = ik_solver.last_solution
+    shm = shared_memory.SharedMemory(name=shm_name)
+    ring = np.ndarray((num_slots,), dtype=_slot_dtype(num_joints, len(ee_links)), buffer=shm.buf)
+    warm_starts = {}
+
+    result_conn.send_bytes(_RESULT.pack(_SHUTDOWN, os.getpid(), _OK))  # ready
+    try:
+        while True:
+            slot, session_id = _HEADER.unpack(request_conn.recv_bytes())
+            if slot == _SHUTDOWN:
+                break
+            if slot == _RELEASE_SESSION:
+                warm_starts.pop(session_id, None)
+                continue
+
+            try:
+                if ring['reseed'][slot]:
+                    ik_solver.last_solution = jnp.array(ring['seed'][slot])
+                else:
+                    ik_solver.last_solution = warm_starts.get(session_id, home_solution)
+
+                start = time.perf_counter()
+                joints = ik_solver.inverse_kinematics(ring['targets'][slot])
+                ee_poses = ik_solver.forward_kinematics(joints)
+                ring['joints'][slot] = np.asarray(joints)
+                ring['ee_poses'][slot] = np.asarray(ee_poses)
+                ring['solve_time'][slot] = time.perf_counter() - start
+                warm_starts[session_id] = ik_solver.last_solution
+                status = _OK
+            except Exception:
+                # Only this request fails; the session starts again from home
+                traceback.print_exc()
+                warm_starts.pop(session_id, None)
+                status = _FAILED
+
+            result_conn.send_bytes(_RESULT.pack(slot, session_id, status))
+    finally:
+        del ring
+        shm.close()
+
+
+class _Worker:
+    def __init__(self, ctx, index, num_slots, num_joints, num_ee, worker_args):
+        dtype = _slot_dtype(num_joints, num_ee)
+        self.index = index
+        self.shm = shared_memory.SharedMemory(create=True, size=dtype.itemsize * num_slots)
+        self.ring = np.ndarray((num_slots,), dtype=dtype, buffer=self.shm.buf)
+        self.request_recv, self.request_send = ctx.Pipe(duplex=False)
+        self.result_recv, self.result_send = ctx.Pipe(duplex=False)
+        self.process = ctx.Process(
+            target=_worker_main,
+            args=(self.shm.name, num_slots, num_joints, *worker_args, self.request_recv, self.result_send),
+            daemon=True,
+        )
+        self.free_slots = list(range(num_slots))
+        self.slot_available = None
+        self.pending = {}
+        self.num_sessions = 0
+        self.loop = None
+        self.dead = False
+
+    def attach(self, loop):
+        '''
+        Registers the result pipe with the event loop so completions resolve futures
+        without a thread or a blocking read.
+        '''
+        self.loop = loop
+        self.slot_available = asyncio.Condition()
+        loop.add_reader(self.result_recv.fileno(), self._on_result)
+
+    def _on_result(self):
+        try:
+            while self.result_recv.poll():
+                slot, _session_id, status = _RESULT.unpack(self.result_recv.recv_bytes())
+                future = self.pending.pop(slot, None)
+                if future is None or future.done():
+                    continue
+                if status == _OK:
+                    future.set_result(slot)
+                else:
+                    future.set_exception(IKWorkerError(f"IK solve failed in worker {self.index}"))
+        except (EOFError, OSError):
+            self.fail(f"IK worker {self.index} exited")
+
+    def fail(self, reason: str):
+        '''
+        Marks the worker dead and fails every pending solve; sessions pinned to it move
+        to another worker on their next solve.
+        '''
+        if self.dead:
+            return
+        self.dead = True
+        logger.error(reason)
+        if self.loop is not None:
+            self.loop.remove_reader(self.result_recv.fileno())
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(IKWorkerError(reason))
+        self.pending.clear()
+        if self.process.is_alive():
+            self.process.terminate()
+        if self.loop is not None:
+            # Wake anything waiting for a slot, so it sees the worker is dead
+            self.loop.create_task(self._notify_all())
+
+    async def _notify_all(self):
+        async with self.slot_available:
+            self.slot_available.notify_all()
+
+    async def acquire_slot(self):
+        async with self.slot_available:
+            await self.slot_available.wait_for(lambda: self.free_slots or self.dead)
+            if self.dead:
+                raise IKWorkerError(f"IK worker {self.index} is dead")
+            return self.free_slots.pop()
+
+    async def release_slot(self, slot):
+        async with self.slot_available:
+            self.free_slots.append(slot)
+            self.slot_available.notify()
+
+
+class IKPoolSession:
+    '''
+    Per-client handle onto an ``IKWorkerPool``. Stands in for ``RobotInverseKinematics``
+    in ``TeleopCore``: setting ``last_solution`` reseeds the warm start on the next solve.
+    '''
+    def __init__(self, pool: "IKWorkerPool", worker: _Worker, session_id: int):
+        self._pool = pool
+        self._worker = worker
+        self.session_id = session_id
+        self._seed = None
+        self.last_solution = None
+        self.last_solve_time = 0.0
+        self.last_handoff_time = 0.0
+
+    @property
+    def last_solution(self):
+        return self._last_solution
+
+    @last_solution.setter
+    def last_solution(self, value):
+        self._last_solution = value
+        self._seed = None if value is None else np.asarray(value, dtype=np.float64)
+
+    async def solve(self, transform_targets) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        Solves IK for transform_targets (Nx4x4) on the pinned worker.
+        Returns (joint angles, end effector poses from forward kinematics). Raises
+        IKWorkerError if the solve failed or the worker died or hung (SOLVE_TIMEOUT).
+        '''
+        if self._worker.dead:
+            self._pool._repin(self)
+        worker = self._worker
+        if worker.loop is None:
+            worker.attach(asyncio.get_running_loop())
+        start = time.perf_counter()
+        slot = await worker.acquire_slot()
+        try:
+            ring = worker.ring
+            ring['targets'][slot] = transform_targets
+            ring['reseed'][slot] = self._seed is not None
+            if self._seed is not None:
+                ring['seed'][slot] = self._seed
+                self._seed = None
+
+            future = worker.loop.create_future()
+            worker.pending[slot] = future
+            try:
+                worker.request_send.send_bytes(_HEADER.pack(slot, self.session_id))
+            except (BrokenPipeError, OSError):
+                worker.fail(f"IK worker {worker.index} exited")
+            try:
+                await asyncio.wait_for(future, timeout=SOLVE_TIMEOUT)
+            except asyncio.TimeoutError:
+                # The worker may still write this slot, so it is not reused: the worker goes
+                worker.fail(f"IK worker {worker.index} did not answer within {SOLVE_TIMEOUT}s")
+                raise IKWorkerError(f"IK worker {worker.index} timed out") from None
+
+            joints = ring['joints'][slot].copy()
+            ee_poses = ring['ee_poses'][slot].copy()
+            self.last_solve_time = float(ring['solve_time'][slot])
+        finally:
+            await worker.release_slot(slot)
+
+        self._last_solution = joints
+        self.last_handoff_time = time.perf_counter() - start - self.last_solve_time
+        return joints, ee_poses
+
+    def close(self):
+        self._pool._release(self)
+
+
+class IKWorkerPool:
+    '''
+    Pool of IK worker processes. Workers are spawned (not forked) because JAX is
+    not fork-safe once initialized.
+    '''
+    def __init__(self, urdf_path: str, ee_links: list[str], base_link_name: str,
+                 num_workers: int | None = None, slots_per_worker: int = 4, num_joints: int = 10):
+        self.num_workers = num_workers or max(1, (os.cpu_count() or 2) - 1)
+        ctx = mp.get_context('spawn')
+        worker_args = (urdf_path, list(ee_links), base_link_name)
+        self.workers = [
+            _Worker(ctx, i, slots_per_worker, num_joints, len(ee_links), worker_args)
+            for i in range(self.num_workers)
+        ]
+        self._session_ids = itertools.count(1)
+
+    def start(self):
+        '''
+        Starts all workers and blocks until every one has built and JIT-warmed its solver.
+        '''
+        for worker in self.workers:
+            worker.process.start()
+            worker.request_recv.close()
+            worker.result_send.close()
+        for worker in self.workers:
+            worker.result_recv.recv_bytes()
+
+    def _least_loaded(self) -> _Worker:
+        alive = [w for w in self.workers if not w.dead]
+        if not alive:
+            raise IKWorkerError("All IK workers are dead")
+        return min(alive, key=lambda w: w.num_sessions)
+
+    def session(self) -> IKPoolSession:
+        '''
+        Pins a new session to the live worker with the fewest sessions.
+        '''
+        worker = self._least_loaded()
+        worker.num_sessions += 1
+        return IKPoolSession(self, worker, next(self._session_ids))
+
+    def _repin(self, session: IKPoolSession):
+        '''Moves a session off its dead worker, seeding the new one with its last solution.'''
+        worker = self._least_loaded()
+        session._worker.num_sessions -= 1
+        worker.num_sessions += 1
+        session._worker = worker
+        if session._seed is None and session.last_solution is not None:
+            session._seed = np.asarray(session.last_solution, dtype=np.float64)
+        logger.warning(f"IK session {session.session_id} moved to worker {worker.index}")
+
+    def _release(self, session: IKPoolSession):
+        worker = session._worker
+        worker.num_sessions -= 1
+        if worker.dead:
+            return
+        try:
+            worker.request_send.send_bytes(_HEADER.pack(_RELEASE_SESSION, session.session_id))
+        except (BrokenPipeError, OSError):
+            pass
+
+    def close(self):
+        for worker in self.workers:
+            if worker.loop is not None and not worker.dead:
+                worker.loop.remove_reader(worker.result_recv.fileno())
+            try:
+                worker.request_send.send_bytes(_HEADER.pack(_SHUTDOWN, 0))
+            except (BrokenPipeError, OSError):
+                pass
+        for worker in self.workers:
+            worker.process.join(timeout=5)
+            if worker.process.is_alive():
+                worker.process.terminate()
+            del worker.ring
+            worker.shm.close()
+            worker.shm.unlink()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+if __name__ == '__main__':
+    import argparse
+    from kscale_vr_teleop._assets import ASSETS_DIR
+
+    parser = argparse.ArgumentParser(description="Benchmark IK solves/s and handoff overhead vs. worker count")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count())
+    parser.add_argument("--frames", type=int, default=200, help="Frames solved per session")
+    args = parser.parse_args()
+
+    urdf_path = str(ASSETS_DIR / "kbot_legless" / "robot.urdf")
+    rng = np.random.default_rng(0)
+
+    def make_targets(t):
+        targets = np.array([np.eye(4), np.eye(4)])
+        targets[0, :3, 3] = [0.2 + 0.05 * np.sin(t), -0.2, -0.1 + 0.05 * np.cos(t)]
+        targets[1, :3, 3] = [0.2 + 0.05 * np.cos(t), 0.2, -0.1 + 0.05 * np.sin(t)]
+        return targets
+
+    async def run_session(session, frames):
+        handoffs = []
+        for i in range(frames):
+            await session.solve(make_targets(i * 0.05 + rng.random()))
+            handoffs.append(session.last_handoff_time)
+        return handoffs
+
+    async def bench(pool):
+        sessions = [pool.session() for _ in range(pool.num_workers)]
+        start = time.perf_counter()
+        results = await asyncio.gather(*(run_session(s, args.frames) for s in sessions))
+        elapsed = time.perf_counter() - start
+        handoffs = np.concatenate(results) * 1e3
+        return len(sessions) * args.frames / elapsed, np.median(handoffs), np.percentile(handoffs, 99)
+
+    workers = 1
+    while workers <= args.max_workers:
+        with IKWorkerPool(urdf_path, ['PRT0001', 'PRT0001_2'], 'base', num_workers=workers) as pool:
+            rate, p50, p99 = asyncio.run(bench(pool))
+        print(f"{workers:2d} workers: {rate:8.1f} solves/s | handoff p50 {p50:.3f} ms p99 {p99:.3f} ms")
+        workers *= 2
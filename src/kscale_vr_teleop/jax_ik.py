@@ -1,28 +1,120 @@
 import os
 os.environ['JAX_PLATFORM_NAME'] = 'cpu'
-from urdf_parser_py import urdf as urdf_parser
-from pathlib import Path
+import contextlib
+import logging
+import threading
+from collections import Counter
 import jax
 import jax.numpy as np
-from jax.scipy.spatial.transform import Rotation
 import jaxopt
+import numpy as onp
 from tqdm import tqdm
 
 from kscale_vr_teleop._assets import ASSETS_DIR
+from kscale_vr_teleop.ik_weights import DEFAULT_WEIGHTS, IKWeights
+from kscale_vr_teleop.link_poses import KinematicTree
+from kscale_vr_teleop.robot_model import RobotModel
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ('jax', 'numpy')
+# scipy least_squares options that configure() may change; they are passed per solve, so changing them never recompiles
+TOLERANCES = ('xtol', 'gtol', 'ftol', 'max_nfev')
+DEFAULT_TOLERANCES = {'xtol': 1e-4, 'gtol': 1e-4, 'ftol': 1e-4}
+
+_TRACE_EVENT = "/jax/core/compile/jaxpr_trace_duration"
+_COMPILE_EVENT = "/jax/core/compile/backend_compile_duration"
+
+
+class CompileStats:
+    '''
+    Process-wide JAX trace and compile counters, fed by jax.monitoring. Once the
+    server calls warmed_up(), every further trace or compile is a cache miss on the
+    hot path (usually an argument whose shape, dtype or Python type changed) and is
+    counted per function and logged, unless it happens inside expected().
+    '''
+    def __init__(self):
+        self.traces = 0
+        self.trace_seconds = 0.0
+        self.compiles = 0
+        self.compile_seconds = 0.0
+        self.misses = 0
+        self.miss_seconds = 0.0
+        self.missed_functions = Counter()
+        self.warm = False
+        self._local = threading.local()
+        self._installed = False
+        self._lock = threading.Lock()
+
+    def install(self):
+        with self._lock:
+            if not self._installed:
+                jax.monitoring.register_event_duration_secs_listener(self._on_duration)
+                self._installed = True
+
+    def warmed_up(self):
+        '''Marks the end of warm-up; traces and compiles from now on are reported as misses.'''
+        self.warm = True
+
+    @contextlib.contextmanager
+    def expected(self):
+        '''Traces and compiles on this thread inside the block are not reported as misses.'''
+        self._local.depth = getattr(self._local, 'depth', 0) + 1
+        try:
+            yield
+        finally:
+            self._local.depth -= 1
+
+    def _on_duration(self, event: str, duration: float, fun_name: str = '?', **kwargs):
+        if event == _TRACE_EVENT:
+            self.traces += 1
+            self.trace_seconds += duration
+        elif event == _COMPILE_EVENT:
+            self.compiles += 1
+            self.compile_seconds += duration
+        else:
+            return
+        if self.warm and getattr(self._local, 'depth', 0) == 0:
+            self.misses += 1
+            self.miss_seconds += duration
+            self.missed_functions[fun_name] += 1
+            stage = "traced" if event == _TRACE_EVENT else "compiled"
+            logger.warning(f"JAX {stage} {fun_name} after warm-up ({duration * 1e3:.1f} ms)")
+
+    def summary(self) -> dict:
+        return {
+            "traces": self.traces,
+            "trace_s": self.trace_seconds,
+            "compiles": self.compiles,
+            "compile_s": self.compile_seconds,
+            "warm": self.warm,
+            "misses": self.misses,
+            "miss_s": self.miss_seconds,
+            "missed_functions": dict(self.missed_functions),
+        }
+
+
+compile_stats = CompileStats()
 
 
 class RobotInverseKinematics:
-    def __init__(self, filepath: str, ee_links: list[str], base_link_name: str) -> None:
-        urdf_contents = open(filepath, 'r').read()
-        urdf_parent_path =Path(filepath).absolute().parent
-        urdf_contents = urdf_contents.replace('filename="', f'filename="{urdf_parent_path}/')
-        self.urdf: urdf_parser.Robot = urdf_parser.URDF.from_xml_string(urdf_contents)
-
-        # build up kinematic chains as lists of joints
-        kinematic_chain_maps = {base_link_name: []}
-        for link_name, child_info_list in self.urdf.child_map.items():
-            for (joint_name, child_link_name) in child_info_list:
-                kinematic_chain_maps[child_link_name] = kinematic_chain_maps[link_name] + [joint_name]
+    def __init__(self, filepath: str, ee_links: list[str], base_link_name: str, backend: str = 'jax') -> None:
+        '''
+        backend 'jax' jits FK and the residual and differentiates them with JAX; 'numpy'
+        evaluates them in plain NumPy with analytic Jacobians (numpy_kinematics), which
+        avoids JAX dispatch on a problem this small. Both run the same solver.
+        '''
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown IK backend {backend!r}, expected one of {BACKENDS}")
+        self.backend = backend
+        # Residual weights and solver tolerances; configure() changes them between solves without recompiling
+        self.weights = DEFAULT_WEIGHTS
+        self.tolerances = dict(DEFAULT_TOLERANCES)
+        compile_stats.install()
+        # Topology, origins, axes and limits, from the compiled model cache rather than the XML
+        self.model = RobotModel.load(filepath)
+        # build up kinematic chains as lists of joint indices
+        kinematic_chain_maps = {ee_link_name: self.model.chain(base_link_name, ee_link_name) for ee_link_name in ee_links}
 
         self.active_joints = [ # TODO: un-harcode this
             'dof_right_shoulder_pitch_03',
@@ -39,12 +131,9 @@ class RobotInverseKinematics:
 
         # Create mapping from joint name to active joint index
         self.active_joint_indices = {}
-        upper_bounds = []
-        lower_bounds = []
         for i, joint in enumerate(self.active_joints):
             self.active_joint_indices[joint] = i
-            upper_bounds.append(self.urdf.joint_map[joint].limit.upper)
-            lower_bounds.append(self.urdf.joint_map[joint].limit.lower)
+        lower_bounds, upper_bounds = self.model.limits(self.active_joints)
 
         self.upper_bounds = np.array(upper_bounds)
         self.lower_bounds = np.array(lower_bounds)
@@ -83,63 +172,70 @@ class RobotInverseKinematics:
             
             return result
 
-        def make_transform_mat(joint: urdf_parser.Joint, joint_angle: float) -> np.ndarray:
+        def make_transform_mat(joint: int, joint_angle: float) -> np.ndarray:
             '''
             Create a 4x4 transformation matrix from the parent to child link
             Only works for fixed and revolute joints currently
             '''
-            origin_position = joint.origin.position
-            origin_rotation_rpy = joint.origin.rotation  # roll, pitch, yaw (X, Y, Z)
-            
-            # Translation matrix
-            T = np.eye(4)
-            T = T.at[:3, 3].set(origin_position)
-            # T[:3, 3] = origin_position
-            
-            # Origin rotation matrix (fixed frame: roll around X, pitch around Y, yaw around Z)
-            R_origin = np.eye(4)
-            rot_matrix = Rotation.from_euler('xyz', origin_rotation_rpy).as_matrix()
-            R_origin = R_origin.at[:3, :3].set(rot_matrix)
+            # Origin translation and rotation (fixed frame: roll around X, pitch around Y, yaw around Z)
+            T_origin = np.asarray(self.model.joint_origins[joint], dtype=np.float32)
             # Joint rotation matrix
-
             R_joint = np.eye(4)
-            if joint.axis is not None:
-                rot_axis = np.array(joint.axis)
-            else:
-                rot_axis = np.eye(3)[0]
+            rot_axis = np.array(self.model.joint_axes[joint])
             # joint_rot_mat = Rotation.from_rotvec(joint_angle * rot_axis).as_matrix()  # This absolutely shits on the gradient
             joint_rot_mat = make_matrix_from_rotvec(rot_axis, joint_angle)
             R_joint = R_joint.at[:3, :3].set(joint_rot_mat)
-            # R_joint[:3, :3] = joint_rot_mat
-            
+
             # Correct order from test_all_combinations.py: T @ R_origin @ R_joint (no transpose needed)
-            result = T @ R_origin @ R_joint
+            result = T_origin @ R_joint
             return result
 
         def forward_kinematics(joint_angles):
             res = []
             for ee_link_name in ee_links:
                 mat = np.eye(4)
-                for joint_name in kinematic_chain_maps[ee_link_name]:
-                    joint = self.urdf.joint_map[joint_name]
-                    if joint.joint_type == 'fixed':
+                for joint in kinematic_chain_maps[ee_link_name]:
+                    if self.model.joint_types[joint] == 'fixed':
                         joint_angle = 0.0
                     else:
-                        joint_angle = joint_angles[self.active_joint_indices[joint_name]]
+                        joint_angle = joint_angles[self.active_joint_indices[self.model.joint_names[joint]]]
                     joint_mat = make_transform_mat(joint, joint_angle)
                     mat = mat @ joint_mat
                     # break
                 res.append(mat)
             return np.array(res)
 
-        self.forward_kinematics = jax.jit(forward_kinematics)
-        # self.forward_kinematics = forward_kinematics
+        # Every link of the URDF in topological order; link_transforms(q) gives all their transforms
+        tree = KinematicTree(filepath, self.active_joints)
+        self.link_names = tree.link_names
+        self.link_index = tree.link_index
+
+        def link_transforms(joint_angles):
+            # KinematicTree.transforms traced with jax.numpy, once per batch shape
+            return tree.transforms(joint_angles, xp=np)
 
-        # Pre-compile the residuals function and create the solver once
-        self._setup_ik_solver()
+        if backend == 'numpy':
+            from kscale_vr_teleop.numpy_kinematics import NumpyKinematics
+            self.kinematics = NumpyKinematics(filepath, ee_links, base_link_name)
+            if self.kinematics.active_joints != self.active_joints:
+                raise ValueError(f"Unexpected joint order {self.kinematics.active_joints}")
+            self.upper_bounds = onp.asarray(self.upper_bounds, dtype=onp.float64)
+            self.lower_bounds = onp.asarray(self.lower_bounds, dtype=onp.float64)
+            self.last_solution = onp.zeros(len(self.active_joints))
+            self.forward_kinematics = self.kinematics.forward_kinematics
+            self.residuals = self.kinematics.residuals
+            self.link_transforms = tree.transforms
+        else:
+            self.forward_kinematics = jax.jit(forward_kinematics)
+            self.link_transforms = jax.jit(link_transforms)
+            # self.forward_kinematics = forward_kinematics
 
-        # Warmup JIT functions
-        self.inverse_kinematics([np.eye(4), np.eye(4)])
+            # Pre-compile the residuals function and create the solver once
+            self._setup_ik_solver()
+
+        # Warmup JIT functions (NumPy inputs: the numpy backend must not touch JAX here)
+        with compile_stats.expected():
+            self.inverse_kinematics(onp.array([onp.eye(4), onp.eye(4)]))
 
 
 
@@ -147,7 +243,7 @@ class RobotInverseKinematics:
         """Setup the IK solver with pre-compiled residuals function"""
         
         @jax.jit
-        def residuals(joint_angle_vector, transform_targets):
+        def residuals(joint_angle_vector, transform_targets, weights):
             end_effector_mats = self.forward_kinematics(joint_angle_vector)
             right_ee_pose = end_effector_mats[0]
             left_ee_pose = end_effector_mats[1]
@@ -159,9 +255,9 @@ class RobotInverseKinematics:
             left_ee_up = left_ee_pose[:3, 1]
 
             gripper_offset_l = np.eye(4)
-            gripper_offset_l = gripper_offset_l.at[2,3].set(0.21)
+            gripper_offset_l = gripper_offset_l.at[2,3].set(weights.gripper_offset)
             gripper_offset_r = np.eye(4)
-            gripper_offset_r = gripper_offset_r.at[2,3].set(0.21)
+            gripper_offset_r = gripper_offset_r.at[2,3].set(weights.gripper_offset)
 
             right_target_forward = -right_wrist_mat[:3, 2]
             left_target_forward = -left_wrist_mat[:3, 2]
@@ -176,9 +272,9 @@ class RobotInverseKinematics:
 
             right_ee_z_position = (right_ee_pose @ gripper_offset_r)[2, 3]
             left_ee_z_position = (left_ee_pose @ gripper_offset_l)[2, 3]
-            z_min = -0.25
+            z_min = weights.z_min
 
-            relu_approx = lambda x: x/2*(1+np.tanh(1e4*x))
+            relu_approx = lambda x: x/2*(1+np.tanh(weights.penalty_sharpness*x))
 
             penalties = np.array([
                 relu_approx(-(right_ee_z_position - z_min)),
@@ -188,8 +284,8 @@ class RobotInverseKinematics:
             return np.concatenate([
                 right_ee_pose[:3, 3] - right_wrist_mat[:3, 3],
                 left_ee_pose[:3, 3] - left_wrist_mat[:3, 3],
-                np.array([0.1*right_rotation_angle_off, 0.1*right_y_angle_off, 0.1*left_rotation_angle_off, 0.1*left_y_angle_off]),
-                100*penalties
+                weights.orientation*np.array([right_rotation_angle_off, right_y_angle_off, left_rotation_angle_off, left_y_angle_off]),
+                weights.penalty*penalties
             ])
         
         self.residuals = residuals
@@ -213,17 +309,54 @@ class RobotInverseKinematics:
             method='trf',
             options={
                 'jac_sparsity': jac_sparsity_mat,
-                'xtol': 1e-4,
-                'gtol': 1e-4,
-                'ftol': 1e-4,
+                **self.tolerances,
             },
         )
+        # Weights are traced as float32 scalars, so new values reuse the compiled residual
+        self._traced_weights = IKWeights(*(np.float32(w) for w in self.weights))
+
+    def configure(self, weights: dict = None, tolerances: dict = None) -> dict:
+        '''
+        Changes residual weights (IKWeights fields) and solver tolerances (xtol, gtol,
+        ftol, max_nfev) for the following solves. Neither recompiles anything: weights
+        are a traced argument of the residual and tolerances are scipy options. Returns
+        the configuration now in effect.
+        '''
+        if weights:
+            unknown = set(weights) - set(IKWeights._fields)
+            if unknown:
+                raise ValueError(f"Unknown IK weights {sorted(unknown)}, expected {IKWeights._fields}")
+            self.weights = self.weights._replace(**{name: float(value) for name, value in weights.items()})
+            if self.backend == 'jax':
+                self._traced_weights = IKWeights(*(np.float32(w) for w in self.weights))
+        if tolerances:
+            unknown = set(tolerances) - set(TOLERANCES)
+            if unknown:
+                raise ValueError(f"Unknown IK tolerances {sorted(unknown)}, expected {TOLERANCES}")
+            self.tolerances.update({name: (None if value is None else int(value)) if name == 'max_nfev' else float(value)
+                                    for name, value in tolerances.items()})
+            if self.backend == 'jax':
+                self.solver.options.update(self.tolerances)
+        return {"weights": self.weights._asdict(), "tolerances": dict(self.tolerances)}
+
+    def jit_stats(self) -> dict:
+        '''Process-wide trace/compile counters, plus how many variants of each jitted function exist.'''
+        stats = compile_stats.summary()
+        if self.backend == 'jax':
+            stats["cache_sizes"] = {name: getattr(self, name)._cache_size()
+                                    for name in ("forward_kinematics", "link_transforms")}
+        return stats
 
     def inverse_kinematics(self, transform_targets: np.ndarray):
         '''
         transform_targets is Nx4x4 
         ee_links is N long
         '''
+        if self.backend == 'numpy':
+            self.last_solution = self.kinematics.solve(self.last_solution, self.lower_bounds, self.upper_bounds,
+                                                       transform_targets, self.weights, self.tolerances)
+            return self.last_solution
+
         # Convert to JAX array if needed
         transform_targets = np.array(transform_targets)
         
@@ -234,7 +367,8 @@ class RobotInverseKinematics:
                 self.lower_bounds,
                 self.upper_bounds
             ),
-            transform_targets
+            transform_targets,
+            self._traced_weights
         )
         
         # Update last solution for warm starting
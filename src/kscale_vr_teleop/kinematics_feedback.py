@@ -0,0 +1,197 @@
+import asyncio
+import json
+import logging
+import struct
+import time
+
+import numpy as np
+import websockets
+
+from kscale_vr_teleop import tracing
+
+# Field groups of the kinematics payload, in the order they appear in the binary form.
+# (json path, number of floats)
+FEEDBACK_FIELDS = (
+    (("joints", "right"), 5),
+    (("joints", "left"), 5),
+    (("joysticks", "right"), 2),
+    (("joysticks", "left"), 2),
+    (("distances", "right"), 1),
+    (("distances", "left"), 1),
+    # How far reachability projection moved each target before IK (m), 0 when it was reachable
+    (("reach_offsets", "right"), 1),
+    (("reach_offsets", "left"), 1),
+)
+
+BINARY_MAGIC = 0x4B  # 'K'
+# magic (uint8), field bitmask (uint8, so at most 8 field groups), pad, sequence number (uint32), ack
+# (uint32, the JSON form's client frame id, NO_ACK if none), then float32 values of the present fields.
+# 12 bytes, so the floats can be viewed in place on the client (frontend/src/lib/feedback.ts).
+BINARY_HEADER = struct.Struct('<BBxxII')
+NO_ACK = 0xFFFFFFFF
+
+logger = logging.getLogger(__name__)
+
+
+class KinematicsFeedback:
+    '''
+    Sends the kinematics feedback payload (joints, joysticks, distances, reach offsets) to the headset
+    from its own task, at a rate the client picks independently of the command rate.
+
+    The control loop only calls ``publish``, which stores the latest values and returns.
+    Only the newest state is ever sent, so a slow socket delays feedback but never queues
+    up work or blocks the control path. Field groups that have not changed since the last
+    send are omitted, except on periodic keyframes.
+
+    With ``links`` enabled, every send whose joints changed is followed by a binary
+    link pose message (link_poses.LinkPoseModel) so the headset can place the robot
+    overlay without its own kinematics; the link order is sent once as ``link_layout``.
+    '''
+    def __init__(self, websocket, rate_hz: float = 20.0, delta: bool = True, binary: bool = False,
+                 tolerance: float = 1e-4, keyframe_interval: float = 1.0, links: bool = False, link_model=None):
+        self.websocket = websocket
+        self.rate_hz = rate_hz
+        self.delta = delta
+        self.binary = binary
+        self.tolerance = tolerance
+        self.keyframe_interval = keyframe_interval
+
+        self._latest = None
+        self._frame_id = None
+        self._last_sent = [None] * len(FEEDBACK_FIELDS)
+        self._last_keyframe_time = 0.0
+        self._seq = 0
+        self.links = links
+        self.link_model = link_model
+        self._layout_sent = False
+        self._joints_changed = False
+        self._new_data = asyncio.Event()
+        self._task = None
+        self.messages_sent = 0
+        self.bytes_sent = 0
+
+    def configure(self, rate=None, format=None, delta=None, links=None):
+        '''
+        Applies a ``feedback_config`` message from the client. A rate of 0 disables feedback.
+        '''
+        if rate is not None:
+            self.rate_hz = max(0.0, float(rate))
+        if format is not None:
+            self.binary = format == "binary"
+        if delta is not None:
+            self.delta = bool(delta)
+        if links is not None:
+            self.links = bool(links)
+            self._layout_sent = False
+        # Next send is a full frame so the client can rebuild its state in the new format
+        self._last_sent = [None] * len(FEEDBACK_FIELDS)
+        self._new_data.set()
+
+    def publish(self, right_arm_joints, left_arm_joints, right_joystick, left_joystick, right_distance, left_distance,
+                frame_id=None, reach_offsets=(0.0, 0.0)):
+        '''
+        Stores the latest feedback values. Cheap and non-blocking, safe to call every frame.
+        frame_id is the id of the client frame these values were computed from, if it sent one.
+        '''
+        self._frame_id = frame_id
+        self._latest = (right_arm_joints, left_arm_joints, right_joystick, left_joystick, right_distance, left_distance,
+                        reach_offsets[0], reach_offsets[1])
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        self._new_data.set()
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def _changed_fields(self, values, keyframe):
+        changed = []
+        for i, value in enumerate(values):
+            last = self._last_sent[i]
+            if keyframe or not self.delta or last is None or np.max(np.abs(value - last)) > self.tolerance:
+                changed.append(i)
+        return changed
+
+    @tracing.traced("feedback_encode")
+    def encode(self, keyframe: bool = False):
+        '''
+        Encodes the latest state as a JSON string or bytes, or returns None if nothing changed.
+        '''
+        values = [np.asarray(v, dtype=np.float64).reshape(-1) for v in self._latest]
+        changed = self._changed_fields(values, keyframe)
+        if not changed:
+            return None
+        for i in changed:
+            self._last_sent[i] = values[i]
+        self._seq += 1
+        self._joints_changed = 0 in changed or 1 in changed
+
+        if self.binary:
+            mask = 0
+            for i in changed:
+                mask |= 1 << i
+            body = np.concatenate([values[i] for i in changed]).astype('<f4').tobytes()
+            ack = NO_ACK if self._frame_id is None else int(self._frame_id) & 0xFFFFFFFF
+            return BINARY_HEADER.pack(BINARY_MAGIC, mask, self._seq & 0xFFFFFFFF, ack) + body
+
+        payload = {"type": "kinematics", "seq": self._seq}
+        if self._frame_id is not None:
+            payload["ack"] = self._frame_id
+        for i in changed:
+            (group, side), size = FEEDBACK_FIELDS[i]
+            value = values[i].tolist()
+            if group == "joysticks":
+                value = {"x": value[0], "y": value[1]}
+            elif size == 1:
+                value = value[0]
+            payload.setdefault(group, {})[side] = value
+        return json.dumps(payload)
+
+    @tracing.traced("link_poses_encode")
+    def encode_links(self) -> bytes:
+        '''
+        Encodes the link poses of the latest joints (right arm then left arm, IK order).
+        '''
+        if self.link_model is None:
+            from kscale_vr_teleop.link_poses import LinkPoseModel
+            self.link_model = LinkPoseModel()
+        joints = np.concatenate([np.asarray(self._latest[0], dtype=np.float64).reshape(-1),
+                                 np.asarray(self._latest[1], dtype=np.float64).reshape(-1)])
+        return self.link_model.encode(joints, self._seq)
+
+    async def _send(self, message):
+        with tracing.span("ws_send"):
+            await self.websocket.send(message)
+        self.messages_sent += 1
+        self.bytes_sent += len(message)
+
+    async def _run(self):
+        while True:
+            await self._new_data.wait()
+            self._new_data.clear()
+            if self.rate_hz <= 0 or self._latest is None:
+                continue
+
+            now = time.monotonic()
+            keyframe = now - self._last_keyframe_time >= self.keyframe_interval
+            if keyframe:
+                self._last_keyframe_time = now
+            try:
+                message = self.encode(keyframe)
+                if message is not None:
+                    await self._send(message)
+                    if self.links and self._joints_changed:
+                        link_message = self.encode_links()
+                        if not self._layout_sent:
+                            await self._send(self.link_model.layout_message())
+                            self._layout_sent = True
+                        await self._send(link_message)
+            except websockets.ConnectionClosed:
+                # Connection is gone; the teleop handler cleans up. publish() may start a new task.
+                self._task = None
+                return
+            except Exception:
+                # A bad frame must not end feedback for the rest of the session
+                logger.exception("Kinematics feedback send failed")
+            await asyncio.sleep(1.0 / self.rate_hz)
@@ -0,0 +1,145 @@
+import json
+import struct
+
+import numpy as np
+from scipy.spatial.transform import Rotation
+
+from kscale_vr_teleop._assets import ASSETS_DIR
+from kscale_vr_teleop.robot_model import RobotModel
+
+DEFAULT_URDF_PATH = str(ASSETS_DIR / "kbot_legless" / "robot.urdf")
+# IK joint order (RobotInverseKinematics.active_joints)
+ACTIVE_JOINTS = [
+    'dof_right_shoulder_pitch_03',
+    'dof_right_shoulder_roll_03',
+    'dof_right_shoulder_yaw_02',
+    'dof_right_elbow_02',
+    'dof_right_wrist_00',
+    'dof_left_shoulder_pitch_03',
+    'dof_left_shoulder_roll_03',
+    'dof_left_shoulder_yaw_02',
+    'dof_left_elbow_02',
+    'dof_left_wrist_00',
+]
+
+LINK_POSE_MAGIC = 0x4C  # 'L'
+# magic (uint8), pad, link count (uint16), sequence number (uint32), then per link float32
+# px, py, pz, qx, qy, qz, qw. 8 bytes, so the floats can be viewed in place on the client.
+LINK_POSE_HEADER = struct.Struct('<BxHI')
+
+
+def _skew(axis: np.ndarray) -> np.ndarray:
+    return np.array([[0, -axis[2], axis[1]], [axis[2], 0, -axis[0]], [-axis[1], axis[0], 0]])
+
+
+class KinematicTree:
+    '''
+    Every link of a URDF in topological order (root first, each link after its parent),
+    with how it is reached from its parent, so the transforms of all links come out of
+    one pass over the tree (vectorized over any leading batch dimensions).
+
+    link_index maps link names to their index in link_names and in the transforms.
+    '''
+    def __init__(self, urdf_path: str = DEFAULT_URDF_PATH, active_joints: list[str] = ACTIVE_JOINTS):
+        model = RobotModel.load(urdf_path)
+        self.model = model
+        self.root = model.root
+        active_index = {name: i for i, name in enumerate(active_joints)}
+
+        self.link_names = [self.root]
+        self.joint_names = [None]
+        # The root's transform is the identity: parent -1, no joint
+        parents, origins, joint_indices, axes = [-1], [np.eye(4)], [-1], [np.array([1.0, 0.0, 0.0])]
+        self.link_index = {self.root: 0}
+        frontier = [self.root]
+        while frontier:
+            parent = frontier.pop(0)
+            for joint_name, child in model.child_map.get(parent, []):
+                joint = model.joint_index[joint_name]
+                self.link_index[child] = len(self.link_names)
+                self.link_names.append(child)
+                self.joint_names.append(joint_name)
+                parents.append(self.link_index[parent])
+                origins.append(model.joint_origins[joint])
+                axis = model.joint_axes[joint]
+                axes.append(axis / np.linalg.norm(axis))
+                # Fixed joints and joints the IK does not drive stay at zero
+                movable = model.joint_types[joint] in ('revolute', 'continuous')
+                joint_indices.append(active_index.get(joint_name, -1) if movable else -1)
+                frontier.append(child)
+
+        self.parents = np.array(parents)
+        self.origins = np.array(origins)
+        self.joint_indices = np.array(joint_indices)
+        self.axes = np.array(axes)
+        # Rodrigues terms per link: R = I + sin(q) K + (1 - cos(q)) K^2, padded to 4x4
+        # so the local transform is just origin @ R
+        self.k = np.zeros((len(axes), 4, 4))
+        self.k[:, :3, :3] = [_skew(axis) for axis in axes]
+        self.k2 = self.k @ self.k
+
+    def transforms(self, joint_angles, xp=np) -> np.ndarray:
+        '''
+        Transforms of all links (link_names order) relative to the root:
+        (..., num_active_joints) -> (..., num_links, 4, 4).
+
+        xp is the array module: numpy, or jax.numpy to trace this under jax.jit (no
+        in-place updates, so the same code serves both).
+        '''
+        joint_angles = xp.asarray(joint_angles)
+        # Joint rotations of all links at once; fixed and undriven joints get angle 0
+        driven = self.joint_indices >= 0
+        angles = xp.where(driven, joint_angles[..., np.maximum(self.joint_indices, 0)], 0.0)[..., None, None]
+        local = self.origins @ (np.eye(4) + xp.sin(angles) * self.k + (1 - xp.cos(angles)) * self.k2)
+
+        transforms = [local[..., 0, :, :]]
+        for i in range(1, len(self.link_names)):
+            transforms.append(transforms[self.parents[i]] @ local[..., i, :, :])
+        return xp.stack(transforms, axis=-3)
+
+
+class LinkPoseModel:
+    '''
+    World poses of every visual link of a URDF, for the headset robot overlay.
+
+    All link transforms come from KinematicTree in one pass (vectorized over any
+    leading batch dimensions), and are packed as float32 position + quaternion so
+    the client applies them without any kinematics. Poses are relative to the URDF
+    root link, which is the robot object on the client.
+    '''
+    def __init__(self, urdf_path: str = DEFAULT_URDF_PATH, active_joints: list[str] = ACTIVE_JOINTS):
+        self.tree = KinematicTree(urdf_path, active_joints)
+        self.root = self.tree.root
+        # Non-root links; the root is the robot object itself on the client
+        self.link_names = self.tree.link_names[1:]
+
+        with_visuals = self.tree.model.links_with_visuals()
+        self.visual_links = [name for name in self.link_names if name in with_visuals]
+        self._visual_indices = np.array([self.tree.link_index[name] for name in self.visual_links])
+
+    def transforms(self, joint_angles) -> np.ndarray:
+        '''
+        Transforms of all non-root links (link_names order) relative to the root:
+        (..., num_active_joints) -> (..., num_links, 4, 4).
+        '''
+        return self.tree.transforms(joint_angles)[..., 1:, :, :]
+
+    def poses(self, joint_angles) -> np.ndarray:
+        '''
+        Visual link poses as float32 (..., num_visual_links, 7): x, y, z, qx, qy, qz, qw.
+        '''
+        transforms = self.tree.transforms(joint_angles)[..., self._visual_indices, :, :]
+        poses = np.empty(transforms.shape[:-2] + (7,), dtype=np.float32)
+        poses[..., :3] = transforms[..., :3, 3]
+        poses[..., 3:] = Rotation.from_matrix(transforms[..., :3, :3].reshape(-1, 3, 3)).as_quat().reshape(
+            transforms.shape[:-2] + (4,))
+        return poses
+
+    def encode(self, joint_angles, seq: int) -> bytes:
+        '''Binary link pose message for one configuration.'''
+        return LINK_POSE_HEADER.pack(LINK_POSE_MAGIC, len(self.visual_links), seq & 0xFFFFFFFF) + \
+            self.poses(joint_angles).astype('<f4').tobytes()
+
+    def layout_message(self) -> str:
+        '''Names of the links in the order the binary messages list them.'''
+        return json.dumps({"type": "link_layout", "root": self.root, "links": self.visual_links})
@@ -0,0 +1,314 @@
+"""
+Operator motion prediction to hide pipeline latency.
+
+The robot reaches a target the sum of WiFi, server and robot delays after the
+headset captured it, so without prediction it follows the operator's hand that
+far behind. ``MotionPredictor`` fits a constant linear and angular velocity per
+wrist over the last ~100 ms of targets and extrapolates each target by the
+latency before IK.
+
+Extrapolation overshoots when the hand stops or turns back, so each wrist has a
+gain in [0, 1] scaling its prediction. The gain drops as soon as the newest
+motion stops agreeing with the fitted velocity (deceleration, reversal) and
+recovers over ``fade_in`` seconds once the motion is steady again. Slow motion,
+where tracking noise would dominate the velocity, is not extrapolated, and the
+lead is capped in distance and angle.
+
+    teleop_core.predictor = MotionPredictor(horizon=0.08)   # or None: measured motion-to-UDP latency
+
+    python -m kscale_vr_teleop.motion_prediction [SESSION_DIR_OR_RRD] [--latency-ms 80]
+"""
+import argparse
+import json
+from collections import deque
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+# Horizon used before any latency has been measured, and the longest one used at all
+DEFAULT_HORIZON = 0.05
+MAX_HORIZON = 0.2
+
+
+def _log_rotations(rotations: np.ndarray) -> np.ndarray:
+    '''Rotation vectors of rotation matrices (..., 3, 3) turned by less than pi.'''
+    cos = np.clip((np.trace(rotations, axis1=-2, axis2=-1) - 1.0) / 2.0, -1.0, 1.0)
+    angle = np.arccos(cos)
+    skew = np.stack([rotations[..., 2, 1] - rotations[..., 1, 2],
+                     rotations[..., 0, 2] - rotations[..., 2, 0],
+                     rotations[..., 1, 0] - rotations[..., 0, 1]], axis=-1)
+    sin = np.sin(angle)
+    # angle / (2 sin angle) tends to 1/2 for small angles
+    factor = np.where(sin > 1e-6, angle / (2.0 * np.maximum(sin, 1e-6)), 0.5)
+    return skew * factor[..., None]
+
+
+def _exp_rotation(rotvec: np.ndarray) -> np.ndarray:
+    '''Rotation matrix of a rotation vector (Rodrigues).'''
+    angle = np.linalg.norm(rotvec)
+    if angle < 1e-9:
+        return np.eye(3)
+    x, y, z = rotvec / angle
+    k = np.array([[0.0, -z, y], [z, 0.0, -x], [-y, x, 0.0]])
+    return np.eye(3) + np.sin(angle) * k + (1.0 - np.cos(angle)) * (k @ k)
+
+
+class WristPredictor:
+    '''
+    Short-horizon SE(3) extrapolation of one wrist target with a fade-out gain.
+    '''
+    def __init__(self, window: float = 0.1, max_samples: int = 8, max_gap: float = 0.25,
+                 min_speed: float = 0.03, min_angular_speed: float = 0.3, min_agreement: float = 0.4,
+                 fade_in: float = 0.1, max_offset: float = 0.08, max_angle: float = 0.5):
+        '''
+        window: seconds of history the velocities are fitted over (at most max_samples
+        samples); a gap longer than max_gap starts the history again.
+        min_speed (m/s), min_angular_speed (rad/s): below these nothing is extrapolated.
+        min_agreement: how far the newest velocity, projected on the fitted one, may
+        fall (1 = steady) before the gain reaches 0.
+        max_offset (m), max_angle (rad): cap on the lead.
+        '''
+        self.window = window
+        self.max_gap = max_gap
+        self.min_speed = min_speed
+        self.min_angular_speed = min_angular_speed
+        self.min_agreement = min_agreement
+        self.fade_in = fade_in
+        self.max_offset = max_offset
+        self.max_angle = max_angle
+        self._times = deque(maxlen=max_samples)
+        self._positions = deque(maxlen=max_samples)
+        self._rotations = deque(maxlen=max_samples)
+        self._velocity = np.zeros(3)
+        self._angular_velocity = np.zeros(3)
+        self.gain = 0.0
+
+    def reset(self):
+        self._times.clear()
+        self._positions.clear()
+        self._rotations.clear()
+        self.gain = 0.0
+
+    def _agreement(self, fitted: np.ndarray, newest: np.ndarray, min_speed: float) -> float:
+        '''Gain allowed by how well the newest velocity continues the fitted one.'''
+        speed_sq = fitted @ fitted
+        if speed_sq < min_speed**2:
+            # Too slow to tell a turn from noise; nothing is extrapolated anyway
+            return 1.0
+        agreement = (fitted @ newest) / speed_sq
+        return float(np.clip((agreement - self.min_agreement) / (1.0 - self.min_agreement), 0.0, 1.0))
+
+    def predict(self, t: float, pose: np.ndarray, horizon: float) -> np.ndarray:
+        '''
+        Adds the target pose (4x4) observed at time t (seconds) and returns it
+        extrapolated by horizon seconds times the gain.
+        '''
+        if self._times and t <= self._times[-1]:
+            # Repeated frame: nothing new to fit
+            return self._extrapolate(pose, horizon)
+        if self._times and t - self._times[-1] > self.max_gap:
+            self.reset()
+        dt = t - self._times[-1] if self._times else 0.0
+        self._times.append(t)
+        self._positions.append(np.array(pose[:3, 3], dtype=np.float64))
+        self._rotations.append(np.array(pose[:3, :3], dtype=np.float64))
+        while t - self._times[0] > self.window and len(self._times) > 3:
+            self._times.popleft()
+            self._positions.popleft()
+            self._rotations.popleft()
+        if len(self._times) < 3:
+            self._velocity = self._angular_velocity = np.zeros(3)
+            self.gain = 0.0
+            return pose
+
+        times = np.array(self._times) - t
+        positions = np.array(self._positions)
+        # Rotations relative to the newest one, in its frame: R_i = R_n exp(w (t_i - t_n))
+        relative = _log_rotations(self._rotations[-1].T @ np.array(self._rotations))
+        centered = times - times.mean()
+        scale = 1.0 / (centered @ centered)
+        self._velocity = scale * (centered @ (positions - positions.mean(axis=0)))
+        self._angular_velocity = scale * (centered @ (relative - relative.mean(axis=0)))
+
+        # Newest motion over the last two intervals
+        newest_velocity = (positions[-1] - positions[-3]) / -times[-3]
+        newest_angular_velocity = relative[-3] / times[-3]
+        target = min(self._agreement(self._velocity, newest_velocity, self.min_speed),
+                     self._agreement(self._angular_velocity, newest_angular_velocity, self.min_angular_speed))
+        # Fade out at once, back in over fade_in
+        self.gain = min(target, self.gain + dt / self.fade_in)
+        return self._extrapolate(pose, horizon)
+
+    def _extrapolate(self, pose: np.ndarray, horizon: float) -> np.ndarray:
+        if self.gain <= 0.0 or horizon <= 0.0:
+            return pose
+        lead = self.gain * horizon
+        predicted = np.array(pose, dtype=np.float64)
+
+        speed = np.linalg.norm(self._velocity)
+        if speed > self.min_speed:
+            # Ramp in above the noise floor instead of switching on
+            offset = self._velocity * lead * min(1.0, (speed - self.min_speed) / self.min_speed)
+            distance = np.linalg.norm(offset)
+            if distance > self.max_offset:
+                offset *= self.max_offset / distance
+            predicted[:3, 3] += offset
+
+        angular_speed = np.linalg.norm(self._angular_velocity)
+        if angular_speed > self.min_angular_speed:
+            turn = self._angular_velocity * lead * min(1.0, (angular_speed - self.min_angular_speed)
+                                                      / self.min_angular_speed)
+            angle = np.linalg.norm(turn)
+            if angle > self.max_angle:
+                turn *= self.max_angle / angle
+            predicted[:3, :3] = predicted[:3, :3] @ _exp_rotation(turn)
+        return predicted.astype(pose.dtype)
+
+
+class MotionPredictor:
+    '''
+    Predicts both wrist targets (right, left) by a fixed horizon or, with horizon
+    None, by the measured motion-to-UDP latency (set_measured_latency) plus
+    robot_latency, the command-to-motion delay on the robot that the server cannot
+    measure.
+    '''
+    def __init__(self, horizon: Optional[float] = None, robot_latency: float = 0.0, **wrist_options):
+        self.fixed_horizon = horizon
+        self.robot_latency = robot_latency
+        self.measured_latency: Optional[float] = None
+        self.wrists = (WristPredictor(**wrist_options), WristPredictor(**wrist_options))
+
+    @property
+    def horizon(self) -> float:
+        if self.fixed_horizon is not None:
+            return self.fixed_horizon
+        if self.measured_latency is None:
+            return DEFAULT_HORIZON
+        return float(np.clip(self.measured_latency + self.robot_latency, 0.0, MAX_HORIZON))
+
+    @property
+    def gains(self) -> tuple[float, float]:
+        return self.wrists[0].gain, self.wrists[1].gain
+
+    def set_measured_latency(self, seconds: float):
+        self.measured_latency = seconds
+
+    def reset(self):
+        for wrist in self.wrists:
+            wrist.reset()
+
+    def predict(self, t: float, right_pose: np.ndarray, left_pose: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        '''Wrist targets observed at time t (seconds), each extrapolated by the horizon.'''
+        horizon = self.horizon
+        return self.wrists[0].predict(t, right_pose, horizon), self.wrists[1].predict(t, left_pose, horizon)
+
+
+def _rotation_angles(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    '''Angle between rotation matrices a and b (..., 3, 3), radians.'''
+    cos = (np.einsum('...ij,...ij->...', a, b) - 1.0) / 2.0
+    return np.arccos(np.clip(cos, -1.0, 1.0))
+
+
+def evaluate(timestamps: np.ndarray, wrist_poses: np.ndarray, latency: float, max_lead: float = None,
+             **predictor_options) -> dict:
+    '''
+    Replays recorded wrist targets (N x 2 x 4 x 4 at timestamps in seconds) through a
+    MotionPredictor with horizon latency and compares each command with where the
+    operator's wrist actually was latency seconds later, when the robot gets there.
+
+    Effective latency is latency minus the time shift that best aligns the commands
+    with the operator's motion (searched up to max_lead, default 1.5 x latency): the
+    raw targets trail by the whole latency, ideal prediction by none.
+    '''
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    wrist_poses = np.asarray(wrist_poses, dtype=np.float64)
+    predictor = MotionPredictor(horizon=latency, **predictor_options)
+    predicted = np.empty_like(wrist_poses)
+    gains = np.empty((len(timestamps), 2))
+    for i, t in enumerate(timestamps):
+        predicted[i] = predictor.predict(t, wrist_poses[i, 0], wrist_poses[i, 1])
+        gains[i] = predictor.gains
+
+    def poses_at(times):
+        # Positions interpolated, rotations from the nearest earlier frame
+        positions = np.stack([np.stack([np.interp(times, timestamps, wrist_poses[:, side, :3, 3][:, axis])
+                                        for axis in range(3)], axis=-1) for side in range(2)], axis=1)
+        index = np.clip(np.searchsorted(timestamps, times, side='right') - 1, 0, len(timestamps) - 1)
+        return positions, wrist_poses[index, :, :3, :3]
+
+    inside = timestamps + latency <= timestamps[-1]
+    future_positions, future_rotations = poses_at(timestamps[inside] + latency)
+    report = {"latency_ms": latency * 1e3, "frames": int(inside.sum())}
+    max_lead = 1.5 * latency if max_lead is None else max_lead
+    shifts = np.arange(0.0, max_lead + 1e-9, 0.005)
+    for name, commands in (("raw", wrist_poses), ("predicted", predicted)):
+        commands = commands[inside]
+        position_error = np.linalg.norm(commands[:, :, :3, 3] - future_positions, axis=-1)
+        angle_error = _rotation_angles(commands[:, :, :3, :3], future_rotations)
+        alignment = [np.mean(np.linalg.norm(commands[:, :, :3, 3] - poses_at(timestamps[inside] + s)[0], axis=-1))
+                     for s in shifts]
+        report[name] = {
+            "position_error_mm": {"rms": float(np.sqrt(np.mean(position_error**2)) * 1e3),
+                                  "p95": float(np.percentile(position_error, 95) * 1e3),
+                                  "max": float(position_error.max() * 1e3)},
+            "angle_error_deg": {"rms": float(np.degrees(np.sqrt(np.mean(angle_error**2)))),
+                                "p95": float(np.degrees(np.percentile(angle_error, 95)))},
+            "effective_latency_ms": float((latency - shifts[int(np.argmin(alignment))]) * 1e3),
+        }
+    report["predicted"]["gain_mean"] = float(gains[inside].mean())
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure motion prediction on a recorded (or synthetic) session")
+    parser.add_argument("session", type=str, nargs="?", default=None,
+                        help="SessionRecorder directory or rerun .rrd file (default: synthetic reaching motion)")
+    parser.add_argument("--latency-ms", type=float, default=None,
+                        help="Latency to hide (default: the session's median motion-to-UDP latency + --robot-latency-ms)")
+    parser.add_argument("--robot-latency-ms", type=float, default=30.0,
+                        help="Command-to-motion delay on the robot, added to the recorded latency")
+    parser.add_argument("--duration", type=float, default=60.0, help="Seconds of synthetic motion")
+    parser.add_argument("--rate", type=float, default=72.0, help="Synthetic headset frame rate")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", type=str, default=None, help="Write the report as JSON to this path")
+    args = parser.parse_args()
+
+    recorded_latency = None
+    if args.session is None:
+        from kscale_vr_teleop.benchmarks.headset_simulator import HEAD_HEIGHT, HOME_TARGETS
+        from kscale_vr_teleop.benchmarks.trajectories import reaching_wrist_poses
+        home = np.array([HOME_TARGETS["right"], HOME_TARGETS["left"]])
+        home[:, 2, 3] -= HEAD_HEIGHT
+        num_frames = int(args.duration * args.rate)
+        timestamps = np.arange(num_frames) / args.rate
+        wrist_poses = reaching_wrist_poses(home, num_frames, args.rate, seed=args.seed)
+        print(f"Synthetic reaching motion: {num_frames} frames at {args.rate:g} Hz")
+    else:
+        from kscale_vr_teleop.analysis.replay import load_session
+        session = load_session(args.session)
+        timestamps, wrist_poses = np.asarray(session["timestamp"]), np.asarray(session["wrist_poses"])
+        if "motion_to_udp" in session and np.isfinite(session["motion_to_udp"]).any():
+            recorded_latency = float(np.nanmedian(session["motion_to_udp"]))
+        print(f"Loaded {len(timestamps)} frames from {args.session}")
+
+    if args.latency_ms is not None:
+        latency = args.latency_ms * 1e-3
+    else:
+        latency = (DEFAULT_HORIZON if recorded_latency is None else recorded_latency) + args.robot_latency_ms * 1e-3
+
+    report = evaluate(timestamps, wrist_poses, latency)
+    print(f"Latency to hide: {report['latency_ms']:.0f} ms over {report['frames']} frames")
+    print(f"{'':<10}{'pos rms mm':>11}{'pos p95 mm':>11}{'pos max mm':>11}{'rot rms deg':>12}{'effective ms':>13}")
+    for name in ("raw", "predicted"):
+        stats = report[name]
+        print(f"{name:<10}{stats['position_error_mm']['rms']:>11.1f}{stats['position_error_mm']['p95']:>11.1f}"
+              f"{stats['position_error_mm']['max']:>11.1f}{stats['angle_error_deg']['rms']:>12.2f}"
+              f"{stats['effective_latency_ms']:>13.0f}")
+    print(f"Mean prediction gain: {report['predicted']['gain_mean']:.2f}")
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""
+NumPy kinematics backend for RobotInverseKinematics.
+
+The IK problem is 10 joints and 12 residuals, small enough that JAX dispatch and
+host/device array conversions cost more than the math. This backend evaluates
+the same forward kinematics and residual in plain NumPy, takes the Jacobian
+analytically from the joint axes (ArmChain), and runs the same bounded
+trust-region solve (scipy ``least_squares`` 'trf', as jaxopt does) on top. The
+residual and its Jacobian come out of one forward pass and are written into
+preallocated buffers, and scipy's Jacobian request at the point it just
+evaluated reuses them.
+
+    ik_solver = RobotInverseKinematics(urdf_path, ee_links, 'base', backend='numpy')
+
+    python -m kscale_vr_teleop.numpy_kinematics   # validates against the JAX backend and times both
+"""
+import argparse
+import time
+
+import numpy as np
+import scipy.optimize
+
+from kscale_vr_teleop._assets import ASSETS_DIR
+from kscale_vr_teleop.geometric_ik import ArmChain
+from kscale_vr_teleop.ik_weights import DEFAULT_WEIGHTS, IKWeights
+from kscale_vr_teleop.robot_model import RobotModel
+
+DEFAULT_URDF_PATH = str(ASSETS_DIR / "kbot_legless" / "robot.urdf")
+EE_LINKS = ['PRT0001', 'PRT0001_2']
+# Solver options of RobotInverseKinematics
+SOLVER_OPTIONS = {'method': 'trf', 'xtol': 1e-4, 'gtol': 1e-4, 'ftol': 1e-4}
+
+
+class NumpyKinematics:
+    '''
+    Forward kinematics, IK residual and analytic Jacobian for a set of arms, laid out
+    like RobotInverseKinematics: positions (3 per arm), then forward and up alignment
+    (2 per arm), then floor penalties (1 per arm).
+    '''
+    def __init__(self, filepath: str, ee_links: list[str], base_link_name: str) -> None:
+        model = RobotModel.load(filepath)
+        self.chains = [ArmChain(model, ee_link, base_link_name) for ee_link in ee_links]
+        self.active_joints = [name for chain in self.chains for name in chain.joint_names]
+        num_arms = len(self.chains)
+        self._slices = []
+        # Residual rows of each arm's position, forward, up and penalty terms
+        self._rows = []
+        start = 0
+        for k, chain in enumerate(self.chains):
+            self._slices.append(slice(start, start + len(chain.joint_names)))
+            start += len(chain.joint_names)
+            self._rows.append(np.array([3 * k, 3 * k + 1, 3 * k + 2,
+                                        3 * num_arms + 2 * k, 3 * num_arms + 2 * k + 1, 5 * num_arms + k]))
+        self.num_residuals = 6 * num_arms
+        self._residuals = np.empty(self.num_residuals)
+        # Arms do not share joints, so the blocks between arms stay zero
+        self._jacobian = np.zeros((self.num_residuals, start))
+        self._evaluated_at = None
+        self._evaluated_weights = None
+
+    def forward_kinematics(self, joint_angles) -> np.ndarray:
+        joint_angles = np.asarray(joint_angles, dtype=np.float64)
+        return np.array([chain.forward(joint_angles[s]) for chain, s in zip(self.chains, self._slices)])
+
+    def _evaluate(self, joint_angles: np.ndarray, transform_targets: np.ndarray, weights: IKWeights):
+        for chain, s, rows, target in zip(self.chains, self._slices, self._rows, transform_targets):
+            r, j = chain.residuals(joint_angles[s], target, jacobian=True, weights=weights)
+            self._residuals[rows] = r
+            self._jacobian[rows, s] = j
+        self._evaluated_at = joint_angles.copy()
+        self._evaluated_weights = weights
+
+    def residuals(self, joint_angles, transform_targets, weights: IKWeights = DEFAULT_WEIGHTS) -> np.ndarray:
+        joint_angles = np.asarray(joint_angles, dtype=np.float64)
+        self._evaluate(joint_angles, transform_targets, weights)
+        return self._residuals.copy()
+
+    def jacobian(self, joint_angles, transform_targets, weights: IKWeights = DEFAULT_WEIGHTS) -> np.ndarray:
+        '''d residuals / d joint_angles, (num_residuals, num_joints).'''
+        joint_angles = np.asarray(joint_angles, dtype=np.float64)
+        # The solver asks for the Jacobian at the point it has just evaluated
+        if (self._evaluated_at is None or weights != self._evaluated_weights
+                or not np.array_equal(joint_angles, self._evaluated_at)):
+            self._evaluate(joint_angles, transform_targets, weights)
+        return self._jacobian.copy()
+
+    def solve(self, initial, lower_bounds, upper_bounds, transform_targets, weights: IKWeights = DEFAULT_WEIGHTS,
+              tolerances: dict = None) -> np.ndarray:
+        '''
+        Bounded least squares from initial, with the options RobotInverseKinematics
+        gives jaxopt (tolerances overrides xtol, gtol, ftol). Returns the joint angles.
+        '''
+        transform_targets = np.asarray(transform_targets, dtype=np.float64)
+        # least_squares rejects a start outside the bounds, which the float32 JAX path rounds into
+        initial = np.clip(np.asarray(initial, dtype=np.float64), lower_bounds, upper_bounds)
+        result = scipy.optimize.least_squares(self.residuals, initial, jac=self.jacobian,
+                                              bounds=(lower_bounds, upper_bounds), args=(transform_targets, weights),
+                                              **{**SOLVER_OPTIONS, **(tolerances or {})})
+        return result.x
+
+
+def validate(num_configurations: int = 200, seed: int = 0) -> dict:
+    '''
+    Largest differences between the NumPy and JAX backends over random configurations
+    and targets: FK, residual, Jacobian (against JAX autodiff) and IK solution, plus
+    time per call of each.
+    '''
+    import jax
+    from kscale_vr_teleop.benchmarks.trajectories import smooth_joint_path, targets_from_joints
+    from kscale_vr_teleop.jax_ik import RobotInverseKinematics
+
+    solvers = {backend: RobotInverseKinematics(DEFAULT_URDF_PATH, EE_LINKS, 'base', backend=backend)
+               for backend in ("jax", "numpy")}
+    jax_solver, numpy_solver = solvers["jax"], solvers["numpy"]
+    lower, upper = np.asarray(numpy_solver.lower_bounds), np.asarray(numpy_solver.upper_bounds)
+    rng = np.random.default_rng(seed)
+    configurations = rng.uniform(lower, upper, (num_configurations, len(lower)))
+    targets = targets_from_joints(numpy_solver.forward_kinematics, rng.uniform(lower, upper, configurations.shape))
+    jax_jacobian = jax.jit(jax.jacfwd(jax_solver.residuals))
+
+    # The floor penalty's tanh is steep enough that JAX's float32 differs visibly near the floor,
+    # so its Jacobian rows are compared separately
+    penalty_rows = slice(-len(numpy_solver.kinematics.chains), None)
+    differences = {"fk": 0.0, "residuals": 0.0, "jacobian": 0.0, "jacobian_penalty": 0.0}
+    for q, target in zip(configurations, targets):
+        differences["fk"] = max(differences["fk"], float(np.abs(
+            np.asarray(jax_solver.forward_kinematics(q)) - numpy_solver.forward_kinematics(q)).max()))
+        differences["residuals"] = max(differences["residuals"], float(np.abs(
+            np.asarray(jax_solver.residuals(q, target, jax_solver.weights))
+            - numpy_solver.kinematics.residuals(q, target)).max()))
+        jacobian_error = np.abs(np.asarray(jax_jacobian(q, target, jax_solver.weights))
+                                - numpy_solver.kinematics.jacobian(q, target))
+        differences["jacobian"] = max(differences["jacobian"], float(jacobian_error[:penalty_rows.start].max()))
+        differences["jacobian_penalty"] = max(differences["jacobian_penalty"], float(jacobian_error[penalty_rows].max()))
+
+    # Tracking a smooth trajectory, as in teleop
+    joint_path = smooth_joint_path(lower, upper, num_configurations, seed=seed)
+    path_targets = targets_from_joints(numpy_solver.forward_kinematics, joint_path)
+    report = {"max_difference": differences}
+    solutions = {}
+    for backend, solver in solvers.items():
+        fk_times, ik_times, position_errors = [], [], []
+        solver.last_solution = joint_path[0]
+        solutions[backend] = []
+        for q, target in zip(joint_path, path_targets):
+            start = time.perf_counter()
+            np.asarray(solver.forward_kinematics(q))
+            fk_times.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            joints = np.asarray(solver.inverse_kinematics(target))
+            ik_times.append(time.perf_counter() - start)
+            solutions[backend].append(joints)
+            achieved = numpy_solver.forward_kinematics(joints)
+            position_errors.append(np.linalg.norm(achieved[:, :3, 3] - target[:, :3, 3], axis=1).max())
+        report[backend] = {
+            "fk_median_ms": float(np.median(fk_times) * 1e3),
+            "ik_median_ms": float(np.median(ik_times) * 1e3),
+            "ik_p99_ms": float(np.percentile(ik_times, 99) * 1e3),
+            "position_error_mm_median": float(np.median(position_errors) * 1e3),
+        }
+    differences["ik_solution"] = float(np.abs(np.array(solutions["jax"]) - np.array(solutions["numpy"])).max())
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Validate the NumPy kinematics backend against JAX and time both")
+    parser.add_argument("--configurations", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    report = validate(args.configurations, args.seed)
+    print("Largest difference from JAX: " + ", ".join(f"{name} {value:.2e}" for name, value in report["max_difference"].items()))
+    print(f"{'backend':<8}{'fk ms':>10}{'ik ms':>10}{'ik p99 ms':>12}{'pos mm':>9}")
+    for backend in ("jax", "numpy"):
+        stats = report[backend]
+        print(f"{backend:<8}{stats['fk_median_ms']:>10.3f}{stats['ik_median_ms']:>10.3f}{stats['ik_p99_ms']:>12.3f}"
+              f"{stats['position_error_mm_median']:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
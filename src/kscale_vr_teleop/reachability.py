@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+Workspace reachability maps, to project out-of-reach IK targets before solving.
+
+A target beyond the arm's reach makes the solver spend its whole iteration
+budget failing to converge. The map is a voxel grid over the root frame per
+arm, built offline by sampling joint configurations within the limits and
+marking the voxels the end effector lands in (with batched full-tree FK). Each
+voxel also stores the best manipulability seen there (Yoshikawa's
+sqrt(det(J J^T)) of the position Jacobian), and the index of the nearest
+reachable voxel, from a Euclidean distance transform. Projecting a target is
+then a voxel lookup and a clamp into the nearest reachable voxel, whatever the
+distance.
+
+The reachable set is eroded by a margin of a few voxels: at the very edge of
+the workspace the arm is straight and cannot also match the target orientation,
+so targets are pulled slightly inside, where the solver gets much closer.
+
+Maps are cached on disk keyed by a hash of the URDF contents and the build
+parameters, so the first start builds it and later ones load it.
+
+Usage:
+    reachability = ReachabilityMap.load_or_build(urdf_path, ee_links)
+    targets, offsets = reachability.project(targets)   # (N, 4, 4) -> projected copy, metres moved per arm
+
+    python -m kscale_vr_teleop.reachability [URDF] [--samples N] [--voxel 0.02]   # build and benchmark
+"""
+import argparse
+import hashlib
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+from scipy import ndimage
+
+from kscale_vr_teleop._assets import ASSETS_DIR
+from kscale_vr_teleop.link_poses import ACTIVE_JOINTS, KinematicTree
+
+DEFAULT_URDF_PATH = str(ASSETS_DIR / "kbot_legless" / "robot.urdf")
+EE_LINKS = ['PRT0001', 'PRT0001_2']
+DEFAULT_CACHE_DIR = Path("~/.cache/kscale_vr_teleop/reachability").expanduser()
+# Bump when the stored layout or the build changes
+CACHE_VERSION = 1
+DEFAULT_SAMPLES = 500_000
+DEFAULT_VOXEL_SIZE = 0.02
+# Voxels trimmed off the edge of the sampled workspace
+DEFAULT_MARGIN = 2
+# Configurations per batched FK call while building
+BUILD_CHUNK = 20_000
+
+
+def _cross(u: np.ndarray, v: np.ndarray) -> np.ndarray:
+    return np.stack([u[..., 1] * v[..., 2] - u[..., 2] * v[..., 1],
+                     u[..., 2] * v[..., 0] - u[..., 0] * v[..., 2],
+                     u[..., 0] * v[..., 1] - u[..., 1] * v[..., 0]], axis=-1)
+
+
+class ReachabilityMap:
+    '''
+    Per-arm voxel grids over one shared box: reachable (bool), manipulability (float32)
+    and nearest (flat index of the nearest reachable voxel), all (num_arms, nx, ny, nz).
+    '''
+    def __init__(self, origin: np.ndarray, voxel_size: float, reachable: np.ndarray, manipulability: np.ndarray,
+                 nearest: Optional[np.ndarray] = None):
+        self.origin = np.asarray(origin, dtype=np.float64)
+        self.voxel_size = float(voxel_size)
+        self.reachable = reachable
+        self.manipulability = manipulability
+        self.shape = np.array(reachable.shape[1:])
+        if nearest is None:
+            nearest = np.empty(reachable.shape, dtype=np.int32)
+            for k, grid in enumerate(reachable):
+                # Per voxel, the coordinates of the closest reachable voxel (itself if reachable)
+                indices = ndimage.distance_transform_edt(~grid, return_distances=False, return_indices=True)
+                nearest[k] = np.ravel_multi_index(tuple(indices), grid.shape)
+        self.nearest = nearest
+        self._flat_reachable = reachable.reshape(len(reachable), -1)
+        self._flat_nearest = nearest.reshape(len(nearest), -1)
+        self._flat_manipulability = manipulability.reshape(len(manipulability), -1)
+        # Lookup helpers: flat index strides and the low corner of every voxel
+        self._strides = np.array([self.shape[1] * self.shape[2], self.shape[2], 1])
+        self._corners = self.origin + np.indices(tuple(self.shape)).reshape(3, -1).T * self.voxel_size
+        self._arms = np.arange(len(reachable))
+
+    @classmethod
+    def build(cls, urdf_path: str = DEFAULT_URDF_PATH, ee_links: list[str] = EE_LINKS,
+              num_samples: int = DEFAULT_SAMPLES, voxel_size: float = DEFAULT_VOXEL_SIZE,
+              margin: int = DEFAULT_MARGIN, seed: int = 0,
+              active_joints: list[str] = ACTIVE_JOINTS) -> "ReachabilityMap":
+        '''
+        Samples num_samples configurations uniformly within the joint limits (all arms at
+        once, they are independent) and voxelizes where each end effector lands, less
+        margin voxels from the edge.
+        '''
+        tree = KinematicTree(urdf_path, active_joints)
+        lower, upper = tree.model.limits(active_joints)
+        ee_indices = [tree.link_index[link] for link in ee_links]
+        # Link driven by each active joint, and the active joints on each end effector's chain
+        joint_links = np.array([int(np.flatnonzero(tree.joint_indices == i)[0]) for i in range(len(active_joints))])
+        arm_joints = []
+        for ee in ee_indices:
+            chain, link = [], ee
+            while link > 0:
+                if tree.joint_indices[link] >= 0:
+                    chain.append(int(tree.joint_indices[link]))
+                link = tree.parents[link]
+            arm_joints.append(sorted(chain))
+
+        rng = np.random.default_rng(seed)
+        positions = np.empty((len(ee_links), num_samples, 3))
+        measures = np.empty((len(ee_links), num_samples))
+        for start in range(0, num_samples, BUILD_CHUNK):
+            q = rng.uniform(lower, upper, (min(BUILD_CHUNK, num_samples - start), len(lower)))
+            transforms = tree.transforms(q)
+            # Joint axes and points in the root frame; a link's frame rotates about its own joint axis
+            joint_transforms = transforms[:, joint_links]
+            axes = (joint_transforms[..., :3, :3] @ tree.axes[joint_links][:, :, None])[..., 0]
+            points = joint_transforms[..., :3, 3]
+            for k, (ee, joints) in enumerate(zip(ee_indices, arm_joints)):
+                position = transforms[:, ee, :3, 3]
+                jacobian = _cross(axes[:, joints], position[:, None, :] - points[:, joints])
+                gram = np.einsum('nji,njk->nik', jacobian, jacobian)
+                positions[k, start:start + len(q)] = position
+                measures[k, start:start + len(q)] = np.sqrt(np.maximum(np.linalg.det(gram), 0.0))
+
+        # One voxel of margin, so every reachable voxel has an unreachable neighbour
+        origin = positions.reshape(-1, 3).min(axis=0) - voxel_size
+        shape = np.floor((positions.reshape(-1, 3).max(axis=0) + voxel_size - origin) / voxel_size).astype(int) + 1
+        reachable = np.zeros((len(ee_links), *shape), dtype=bool)
+        manipulability = np.zeros((len(ee_links), *shape), dtype=np.float32)
+        for k in range(len(ee_links)):
+            flat = np.ravel_multi_index(tuple(np.floor((positions[k] - origin) / voxel_size).astype(int).T), tuple(shape))
+            reachable[k].flat[flat] = True
+            np.maximum.at(manipulability[k].reshape(-1), flat, measures[k].astype(np.float32))
+            # Sampling leaves pinholes inside the workspace; a closing fills them without growing it
+            reachable[k] = ndimage.binary_closing(reachable[k], iterations=1) | reachable[k]
+            if margin > 0:
+                reachable[k] = ndimage.binary_erosion(reachable[k], iterations=margin)
+        return cls(origin, voxel_size, reachable, manipulability)
+
+    def save(self, path):
+        '''Writes to a temporary file of its own and renames it into place (safe against concurrent saves).'''
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=path.parent, prefix=f".{path.stem}.", suffix=".tmp.npz",
+                                         delete=False) as tmp:
+            try:
+                np.savez_compressed(tmp, origin=self.origin, voxel_size=self.voxel_size, reachable=self.reachable,
+                                    manipulability=self.manipulability, nearest=self.nearest)
+            except BaseException:
+                tmp.close()
+                os.unlink(tmp.name)
+                raise
+        os.replace(tmp.name, path)
+
+    @classmethod
+    def load(cls, path) -> "ReachabilityMap":
+        with np.load(path) as data:
+            return cls(data["origin"], float(data["voxel_size"]), data["reachable"], data["manipulability"],
+                       data["nearest"])
+
+    @staticmethod
+    def cache_path(urdf_path: str = DEFAULT_URDF_PATH, ee_links: list[str] = EE_LINKS,
+                   num_samples: int = DEFAULT_SAMPLES, voxel_size: float = DEFAULT_VOXEL_SIZE,
+                   margin: int = DEFAULT_MARGIN, cache_dir=DEFAULT_CACHE_DIR) -> Path:
+        digest = hashlib.blake2b(Path(urdf_path).read_bytes(), digest_size=16)
+        digest.update(repr((CACHE_VERSION, list(ee_links), num_samples, voxel_size, margin)).encode())
+        return Path(cache_dir) / f"reachability_{digest.hexdigest()}.npz"
+
+    @classmethod
+    def load_or_build(cls, urdf_path: str = DEFAULT_URDF_PATH, ee_links: list[str] = EE_LINKS,
+                      num_samples: int = DEFAULT_SAMPLES, voxel_size: float = DEFAULT_VOXEL_SIZE,
+                      margin: int = DEFAULT_MARGIN, cache_dir=DEFAULT_CACHE_DIR,
+                      rebuild: bool = False) -> "ReachabilityMap":
+        '''
+        The cached map for this URDF and these parameters, building and caching it on a
+        miss (or always, with rebuild).
+        '''
+        path = cls.cache_path(urdf_path, ee_links, num_samples, voxel_size, margin, cache_dir)
+        if path.exists() and not rebuild:
+            return cls.load(path)
+        reachability = cls.build(urdf_path, ee_links, num_samples, voxel_size, margin)
+        try:
+            reachability.save(path)
+        except OSError:
+            # Another process cached the same map meanwhile, or the cache is not writable
+            if not path.exists():
+                raise
+        return reachability
+
+    def _voxels(self, positions: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        '''Flat voxel index of each position (clamped into the grid), and whether it was inside.'''
+        index = np.floor((positions - self.origin) / self.voxel_size).astype(np.int64)
+        clamped = np.clip(index, 0, self.shape - 1)
+        inside = np.all(index == clamped, axis=-1)
+        return clamped @ self._strides, inside
+
+    def project(self, transform_targets) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        Moves every target (one 4x4 per arm) that is out of its arm's reach into the
+        nearest reachable voxel, keeping its orientation. Returns the targets (a copy)
+        and how far each was moved, in metres (0 for reachable targets).
+        '''
+        targets = np.array(transform_targets, dtype=np.float64)
+        positions = targets[:, :3, 3]
+        flat, inside = self._voxels(positions)
+        offsets = np.zeros(len(targets))
+        for k in np.flatnonzero(~(inside & self._flat_reachable[self._arms[:len(targets)], flat])):
+            # Closest point of the nearest reachable voxel
+            low = self._corners[self._flat_nearest[k, flat[k]]]
+            projected = np.clip(positions[k], low, low + self.voxel_size)
+            offsets[k] = np.linalg.norm(projected - positions[k])
+            targets[k, :3, 3] = projected
+        return targets, offsets
+
+    def manipulability_at(self, positions) -> np.ndarray:
+        '''Best manipulability sampled in the voxel of each arm's position (0 if unreachable).'''
+        positions = np.asarray(positions, dtype=np.float64)
+        flat, inside = self._voxels(positions)
+        return np.where(inside, self._flat_manipulability[self._arms[:len(positions)], flat], 0.0)
+
+
+def benchmark(reachability: ReachabilityMap, num_targets: int = 200, seed: int = 0, backend: str = "jax") -> dict:
+    '''
+    IK time and error on out-of-reach targets (reachable ones pushed 10-40 cm further
+    from the shoulder), solved as they are and after projection, plus the projection time.
+    '''
+    from kscale_vr_teleop.benchmarks.trajectories import smooth_joint_path, targets_from_joints
+    from kscale_vr_teleop.jax_ik import RobotInverseKinematics
+
+    ik_solver = RobotInverseKinematics(DEFAULT_URDF_PATH, EE_LINKS, 'base', backend=backend)
+    lower, upper = np.asarray(ik_solver.lower_bounds), np.asarray(ik_solver.upper_bounds)
+    joint_path = smooth_joint_path(lower, upper, num_targets, seed=seed)
+    targets = targets_from_joints(ik_solver.forward_kinematics, joint_path)
+    tree = KinematicTree(DEFAULT_URDF_PATH)
+    # Shoulder pitch joint position of each arm
+    shoulder_links = [int(np.flatnonzero(tree.joint_indices == i)[0]) for i in (0, 5)]
+    shoulders = tree.transforms(np.zeros(len(ACTIVE_JOINTS)))[shoulder_links][:, :3, 3]
+    rng = np.random.default_rng(seed)
+    outward = targets[:, :, :3, 3] - shoulders
+    outward /= np.linalg.norm(outward, axis=-1, keepdims=True)
+    targets[:, :, :3, 3] += outward * rng.uniform(0.1, 0.4, (num_targets, 2, 1))
+
+    report = {}
+    start = time.perf_counter()
+    projected = [reachability.project(target) for target in targets]
+    report["project_us"] = (time.perf_counter() - start) / num_targets * 1e6
+    report["median_offset_mm"] = float(np.median([offsets for _, offsets in projected]) * 1e3)
+    for name, sequence in (("raw", targets), ("projected", np.array([target for target, _ in projected]))):
+        ik_solver.last_solution = joint_path[0]
+        times, errors = [], []
+        for target in sequence:
+            start = time.perf_counter()
+            joints = np.asarray(ik_solver.inverse_kinematics(target))
+            times.append(time.perf_counter() - start)
+            achieved = np.asarray(ik_solver.forward_kinematics(joints))
+            errors.append(np.linalg.norm(achieved[:, :3, 3] - target[:, :3, 3], axis=-1).max())
+        report[name] = {"median_ms": float(np.median(times) * 1e3), "p99_ms": float(np.percentile(times, 99) * 1e3),
+                        "median_error_mm": float(np.median(errors) * 1e3)}
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the reachability map and time IK on out-of-reach targets")
+    parser.add_argument("urdf", nargs="?", default=DEFAULT_URDF_PATH)
+    parser.add_argument("--samples", type=int, default=DEFAULT_SAMPLES)
+    parser.add_argument("--voxel", type=float, default=DEFAULT_VOXEL_SIZE, help="Voxel size in metres")
+    parser.add_argument("--margin", type=int, default=DEFAULT_MARGIN, help="Voxels trimmed off the workspace edge")
+    parser.add_argument("--rebuild", action="store_true", help="Build and cache the map even if it is cached already")
+    parser.add_argument("--backend", choices=["jax", "numpy"], default="jax", help="IK backend for the benchmark")
+    parser.add_argument("--targets", type=int, default=200)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    reachability = ReachabilityMap.load_or_build(args.urdf, EE_LINKS, args.samples, args.voxel, args.margin,
+                                                 rebuild=args.rebuild)
+    print(f"Map {tuple(int(n) for n in reachability.shape)} voxels of {args.voxel * 100:.0f} cm, "
+          f"{reachability.reachable.sum(axis=(1, 2, 3)).tolist()} reachable per arm, "
+          f"loaded in {time.perf_counter() - start:.2f}s")
+    report = benchmark(reachability, args.targets, backend=args.backend)
+    print(f"Projection {report['project_us']:.1f} us per frame, median move {report['median_offset_mm']:.0f} mm")
+    for name in ("raw", "projected"):
+        stats = report[name]
+        print(f"IK on {name:<10} targets: median {stats['median_ms']:.2f} ms, p99 {stats['p99_ms']:.2f} ms, "
+              f"error {stats['median_error_mm']:.1f} mm")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+"""
+Compiled robot model shared by the IK solvers, link pose streaming and the rerun tools.
+
+Everything they take from a URDF (link/joint topology, joint origins, axes and
+limits, visuals with their mesh references and materials) is parsed once into
+plain arrays and cached as an ``.npz`` keyed by a hash of the URDF's contents,
+so later loads are one file read with no XML parsing. Within a process the model
+is also kept in memory, so every consumer shares one instance.
+
+    model = RobotModel.load(urdf_path)
+    model.joint_origins[model.joint_index['dof_right_elbow_02']]
+
+    python -m kscale_vr_teleop.robot_model [URDF ...]   # builds the cache and times parse vs load
+"""
+import argparse
+import hashlib
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+import numpy as np
+from scipy.spatial.transform import Rotation
+
+from kscale_vr_teleop._assets import ASSETS_DIR
+
+DEFAULT_URDF_PATH = str(ASSETS_DIR / "kbot_legless" / "robot.urdf")
+DEFAULT_CACHE_DIR = Path("~/.cache/kscale_vr_teleop/robot_model").expanduser()
+# Bump when the stored layout or what is extracted from the URDF changes
+CACHE_VERSION = 1
+
+
+class Visual(NamedTuple):
+    link: int
+    origin: np.ndarray      # 4x4, relative to the link
+    geometry: str           # 'mesh', 'box', 'cylinder', 'sphere', or '' if unsupported
+    filename: str           # mesh file as written in the URDF ('' unless geometry is 'mesh')
+    scale: np.ndarray       # mesh scale (ones if not given)
+    size: np.ndarray        # box extents, (radius, length, 0) of a cylinder, (radius, 0, 0) of a sphere
+    color: Optional[np.ndarray]  # RGBA, from the visual's material or the named top-level one
+    texture: str            # texture file as written in the URDF, or ''
+
+
+def _origin_matrix(origin) -> np.ndarray:
+    transform = np.eye(4)
+    if origin is not None:
+        if origin.rpy is not None:
+            transform[:3, :3] = Rotation.from_euler('xyz', origin.rpy).as_matrix()
+        if origin.xyz is not None:
+            transform[:3, 3] = origin.xyz
+    return transform
+
+
+def _table(columns: dict) -> np.ndarray:
+    '''
+    Structured array with one field per column (strings become fixed-width unicode), so a
+    whole table is one array in the cache and loads without pickle.
+    '''
+    columns = {name: np.asarray(values) for name, values in columns.items()}
+    length = len(next(iter(columns.values())))
+    dtype = []
+    for name, values in columns.items():
+        if values.dtype.kind == 'U':
+            dtype.append((name, f'<U{max(values.dtype.itemsize // 4, 1)}'))
+        else:
+            dtype.append((name, values.dtype, values.shape[1:]))
+    table = np.zeros(length, dtype=dtype)
+    for name, values in columns.items():
+        table[name] = values
+    return table
+
+
+class RobotModel:
+    '''
+    Arrays describing a URDF. Joints and links are indexed in URDF order:
+
+    - joint_parents, joint_children: link index on each side of every joint
+    - joint_types, joint_origins (4x4), joint_axes (as written, [1, 0, 0] if absent)
+    - joint_limits: lower, upper, velocity, effort per joint (NaN where the URDF has none)
+    - visuals: Visual per link visual
+
+    It is stored as four tables (robot, links, joints, visuals); link_index, joint_index,
+    child_map and parent_map are derived on load.
+    '''
+    def __init__(self, tables: dict, urdf_path: Optional[str] = None):
+        self.urdf_path = None if urdf_path is None else str(Path(urdf_path).absolute())
+        self._tables = tables
+        robot, links, joints, visuals = (tables[name] for name in ("robot", "links", "joints", "visuals"))
+        self.name = str(robot["name"][0])
+        self.root = str(robot["root"][0])
+        self.link_names = links["name"].tolist()
+        self.joint_names = joints["name"].tolist()
+        self.joint_types = joints["type"].tolist()
+        self.joint_parents = joints["parent"].copy()
+        self.joint_children = joints["child"].copy()
+        self.joint_origins = joints["origin"].copy()
+        self.joint_axes = joints["axis"].copy()
+        self.joint_limits = joints["limits"].copy()
+
+        self.link_index = {name: i for i, name in enumerate(self.link_names)}
+        self.joint_index = {name: i for i, name in enumerate(self.joint_names)}
+        # Same shape as urdf_parser_py's: link -> [(joint, child)], child -> (joint, parent)
+        self.child_map: dict[str, list[tuple[str, str]]] = {}
+        self.parent_map: dict[str, tuple[str, str]] = {}
+        for joint, parent, child in zip(self.joint_names, self.joint_parents.tolist(), self.joint_children.tolist()):
+            self.child_map.setdefault(self.link_names[parent], []).append((joint, self.link_names[child]))
+            self.parent_map[self.link_names[child]] = (joint, self.link_names[parent])
+        self.visuals = [
+            Visual(int(visual["link"]), visual["origin"].copy(), str(visual["geometry"]), str(visual["filename"]),
+                   visual["scale"].copy(), visual["size"].copy(),
+                   None if np.isnan(visual["color"]).any() else visual["color"].copy(), str(visual["texture"]))
+            for visual in visuals
+        ]
+
+    @classmethod
+    def from_urdf(cls, urdf_path: str) -> "RobotModel":
+        '''Parses the URDF (the slow path that load() caches).'''
+        from urdf_parser_py import urdf as urdf_parser
+
+        robot = urdf_parser.URDF.from_xml_string(Path(urdf_path).read_text())
+        link_names = [link.name for link in robot.links]
+        link_index = {name: i for i, name in enumerate(link_names)}
+        materials = {material.name: material for material in robot.materials}
+
+        limits = []
+        for joint in robot.joints:
+            limit = joint.limit
+            limits.append([np.nan if limit is None or getattr(limit, field) is None else getattr(limit, field)
+                           for field in ("lower", "upper", "velocity", "effort")])
+
+        visuals = {name: [] for name in
+                   ("link", "origin", "geometry", "filename", "scale", "size", "color", "texture")}
+        for link in robot.links:
+            for visual in link.visuals:
+                shape = visual.geometry
+                size, scale, filename = np.zeros(3), np.ones(3), ""
+                if isinstance(shape, urdf_parser.Mesh):
+                    kind, filename = "mesh", shape.filename
+                    if shape.scale is not None:
+                        scale = np.broadcast_to(np.asarray(shape.scale, dtype=np.float64), (3,))
+                elif isinstance(shape, urdf_parser.Box):
+                    kind, size = "box", np.asarray(shape.size, dtype=np.float64)
+                elif isinstance(shape, urdf_parser.Cylinder):
+                    kind, size = "cylinder", np.array([shape.radius, shape.length, 0.0])
+                elif isinstance(shape, urdf_parser.Sphere):
+                    kind, size = "sphere", np.array([shape.radius, 0.0, 0.0])
+                else:
+                    kind = ""
+                material = visual.material
+                if material is not None and material.color is None and material.texture is None:
+                    # Reference to a material defined at the top level
+                    material = materials.get(material.name)
+                color = np.full(4, np.nan)
+                texture = ""
+                if material is not None and material.color is not None:
+                    color = np.asarray(material.color.rgba, dtype=np.float64)
+                elif material is not None and material.texture is not None:
+                    texture = material.texture.filename
+                for name, value in (("link", link_index[link.name]), ("origin", _origin_matrix(visual.origin)),
+                                    ("geometry", kind), ("filename", filename), ("scale", scale), ("size", size),
+                                    ("color", color), ("texture", texture)):
+                    visuals[name].append(value)
+        if not visuals["link"]:
+            visuals = {"link": np.zeros(0, dtype=np.int64), "origin": np.zeros((0, 4, 4)),
+                       "geometry": np.zeros(0, dtype='<U1'), "filename": np.zeros(0, dtype='<U1'),
+                       "scale": np.zeros((0, 3)), "size": np.zeros((0, 3)), "color": np.zeros((0, 4)),
+                       "texture": np.zeros(0, dtype='<U1')}
+
+        tables = {
+            "robot": _table({"name": [robot.name or ""], "root": [robot.get_root()]}),
+            "links": _table({"name": link_names}),
+            "joints": _table({
+                "name": [joint.name for joint in robot.joints],
+                "type": [joint.type for joint in robot.joints],
+                "parent": np.array([link_index[joint.parent] for joint in robot.joints], dtype=np.int64),
+                "child": np.array([link_index[joint.child] for joint in robot.joints], dtype=np.int64),
+                "origin": np.array([_origin_matrix(joint.origin) for joint in robot.joints]),
+                "axis": np.array([joint.axis if joint.axis is not None else [1.0, 0.0, 0.0]
+                                  for joint in robot.joints], dtype=np.float64),
+                "limits": np.array(limits, dtype=np.float64),
+            }),
+            "visuals": _table(visuals),
+        }
+        return cls(tables, urdf_path)
+
+    def save(self, path):
+        '''
+        Writes to a temporary file of its own and renames it into place, so processes
+        saving the same model at once (IK workers, the rerun tools, the server) never
+        see each other's partial files.
+        '''
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=path.parent, prefix=f".{path.stem}.", suffix=".tmp.npz",
+                                         delete=False) as tmp:
+            try:
+                np.savez(tmp, **self._tables)
+            except BaseException:
+                tmp.close()
+                os.unlink(tmp.name)
+                raise
+        os.replace(tmp.name, path)
+
+    @staticmethod
+    def cache_path(urdf_path: str = DEFAULT_URDF_PATH, cache_dir=DEFAULT_CACHE_DIR) -> Path:
+        digest = hashlib.blake2b(Path(urdf_path).read_bytes(), digest_size=16)
+        digest.update(repr(CACHE_VERSION).encode())
+        return Path(cache_dir) / f"robot_model_{digest.hexdigest()}.npz"
+
+    @classmethod
+    def load(cls, urdf_path: str = DEFAULT_URDF_PATH, cache_dir=DEFAULT_CACHE_DIR,
+             rebuild: bool = False) -> "RobotModel":
+        '''
+        The model of this URDF: from memory if this process already loaded it, else from
+        the cache, else parsed and cached. Treat it as read-only, it is shared.
+        '''
+        path = cls.cache_path(urdf_path, cache_dir)
+        # Mesh paths resolve against the URDF's directory, which the content hash does not cover
+        key = (path, str(Path(urdf_path).absolute().parent))
+        model = _loaded.get(key)
+        if model is not None and not rebuild:
+            return model
+        if path.exists() and not rebuild:
+            with np.load(path, allow_pickle=False) as data:
+                model = cls({name: data[name] for name in data.files}, urdf_path)
+        else:
+            model = cls.from_urdf(urdf_path)
+            try:
+                model.save(path)
+            except OSError:
+                # Another process cached the same model meanwhile, or the cache is not writable
+                if not path.exists():
+                    raise
+        _loaded[key] = model
+        return model
+
+    def resolve(self, filename: str) -> str:
+        '''A file referenced by the URDF (mesh or texture) relative to the URDF's directory.'''
+        if not filename or "://" in filename or Path(filename).is_absolute() or self.urdf_path is None:
+            return filename
+        return str(Path(self.urdf_path).parent / filename)
+
+    def chain(self, base_link: str, link: str) -> list[int]:
+        '''Indices of the joints from base_link out to link, in order.'''
+        joints = []
+        while link != base_link:
+            joint, link = self.parent_map[link]
+            joints.append(self.joint_index[joint])
+        return joints[::-1]
+
+    def limits(self, joint_names: list[str]) -> tuple[np.ndarray, np.ndarray]:
+        '''Lower and upper position limits of the named joints.'''
+        indices = [self.joint_index[name] for name in joint_names]
+        return self.joint_limits[indices, 0], self.joint_limits[indices, 1]
+
+    def links_with_visuals(self) -> set[str]:
+        return {self.link_names[visual.link] for visual in self.visuals}
+
+
+# Models already loaded in this process, by cache file and URDF directory
+_loaded: dict[tuple[Path, str], RobotModel] = {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the compiled robot model cache and time it against parsing")
+    parser.add_argument("urdfs", type=str, nargs="*", default=[DEFAULT_URDF_PATH])
+    parser.add_argument("--cache-dir", type=str, default=str(DEFAULT_CACHE_DIR))
+    parser.add_argument("--rebuild", action="store_true")
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    for urdf_path in args.urdfs:
+        model = RobotModel.load(urdf_path, args.cache_dir, rebuild=args.rebuild)
+        parse_times, load_times = [], []
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            RobotModel.from_urdf(urdf_path)
+            parse_times.append(time.perf_counter() - start)
+            _loaded.clear()
+            start = time.perf_counter()
+            RobotModel.load(urdf_path, args.cache_dir)
+            load_times.append(time.perf_counter() - start)
+        print(f"{urdf_path}: {len(model.link_names)} links, {len(model.joint_names)} joints, "
+              f"{len(model.visuals)} visuals; parse {np.median(parse_times) * 1e3:.2f} ms, "
+              f"cached load {np.median(load_times) * 1e3:.2f} ms ({RobotModel.cache_path(urdf_path, args.cache_dir)})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+"""Low-overhead recorder for teleop sessions.
+
+Every frame of ``TeleopCore`` (tracking inputs and IK outputs) is copied into a
+preallocated ring of numpy records. A background thread drains the ring into
+fixed-size chunks and writes each chunk as one ``.npy`` file per column, so a
+recording can be opened with ``np.load(..., mmap_mode='r')`` without parsing.
+
+Layout::
+
+    <date>/session_<time>-<ms>/
+        meta.json
+        chunk_00000/timestamp.npy
+        chunk_00000/joints.npy
+        ...
+"""
+import json
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+from kscale_vr_teleop import tracing
+
+RECORD_DTYPE = np.dtype([
+    ('timestamp', np.float64),            # time.time() when the frame was computed
+    ('compute_time', np.float64),         # seconds spent in compute_and_send_joints
+    ('wrist_poses', np.float32, (2, 4, 4)),   # right, left tracked targets in the robot frame
+    ('ik_targets', np.float32, (2, 4, 4)),    # right, left targets handed to the IK solver
+    ('finger_poses', np.float32, (2, 24, 4, 4)),  # right, left finger poses relative to the wrist
+    ('use_fingers', np.bool_),
+    ('joints', np.float32, (10,)),        # IK solution, right arm then left arm
+    ('distances', np.float32, (2,)),      # right, left position residual after IK
+    ('grippers', np.float32, (2,)),       # right, left gripper joint commands
+    ('finger_angles', np.float32, (2, 6)),
+    ('joysticks', np.float32, (2, 2)),    # right (x, y), left (x, y)
+    ('converged', np.bool_),
+    ('motion_to_udp', np.float32),        # headset capture to UDP send (s), NaN if not measured
+    ('prediction_gains', np.float32, (2,)),   # right, left motion prediction gain (0: ik_targets not extrapolated)
+    ('reach_offsets', np.float32, (2,)),  # right, left distance (m) reachability moved ik_targets into the workspace
+])
+
+DEFAULT_LOGS_DIR = Path('~/.vr_teleop_logs').expanduser()
+
+
+class _Recording:
+    '''
+    Ring, writer thread and counters of one session. Each session owns its state so a
+    stopped session's writer can flush its last chunk detached while the next one runs.
+    '''
+    def __init__(self, session_dir: Path, metadata: dict, ring_size: int, chunk_frames: int):
+        self.session_dir = session_dir
+        self.metadata = metadata
+        self.ring_size = ring_size
+        self.chunk_frames = chunk_frames
+        self.ring = np.zeros(ring_size, dtype=RECORD_DTYPE)
+        # Single producer (event loop) / single consumer (writer thread). Each index is
+        # only ever written by one side, so no lock is needed.
+        self.write_index = 0
+        self.read_index = 0
+        self.frames_written = 0
+        self.frames_dropped = 0
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self._writer_loop, name="session-recorder", daemon=True)
+
+    def _writer_loop(self):
+        chunk = np.zeros(self.chunk_frames, dtype=RECORD_DTYPE)
+        chunk_fill = 0
+        num_chunks = 0
+        while True:
+            stopping = self.stop.is_set()
+            available = self.write_index - self.read_index
+            while available > 0:
+                start = self.read_index % self.ring_size
+                count = min(available, self.ring_size - start, self.chunk_frames - chunk_fill)
+                chunk[chunk_fill:chunk_fill + count] = self.ring[start:start + count]
+                chunk_fill += count
+                self.read_index += count
+                available -= count
+                if chunk_fill == self.chunk_frames:
+                    self.write_chunk(num_chunks, chunk, chunk_fill)
+                    num_chunks += 1
+                    chunk_fill = 0
+            if stopping:
+                break
+            self.stop.wait(0.01)
+
+        if chunk_fill > 0:
+            self.write_chunk(num_chunks, chunk, chunk_fill)
+            num_chunks += 1
+        self.write_meta(num_chunks)
+        print(f"Stopped recording {self.session_dir.name}: "
+              f"{self.frames_written} frames written, {self.frames_dropped} dropped")
+
+    @tracing.traced("record_write_chunk")
+    def write_chunk(self, index: int, chunk: np.ndarray, count: int):
+        chunk_dir = self.session_dir / f"chunk_{index:05d}"
+        chunk_dir.mkdir(exist_ok=True)
+        for name in RECORD_DTYPE.names:
+            np.save(chunk_dir / f"{name}.npy", np.ascontiguousarray(chunk[name][:count]))
+        self.frames_written += count
+
+    def write_meta(self, num_chunks: int):
+        meta = {
+            **self.metadata,
+            "num_chunks": num_chunks,
+            "num_frames": self.frames_written,
+            "frames_dropped": self.frames_dropped,
+        }
+        with open(self.session_dir / "meta.json", "w") as f:
+            json.dump(meta, f, indent=2)
+
+
+class SessionRecorder:
+    '''
+    Records teleop frames to disk without blocking the control loop.
+
+    ``record`` is called from the event loop and only writes into the ring; it never
+    waits on the writer thread. If the writer falls a full ring behind, frames are
+    dropped and counted rather than stalling the teleop loop. ``stop`` doesn't wait
+    either: the writer flushes the final chunk and meta.json on its own thread.
+    '''
+    def __init__(self, logs_dir: Path = DEFAULT_LOGS_DIR, ring_size: int = 1024, chunk_frames: int = 2048):
+        self.logs_dir = Path(logs_dir)
+        self.ring_size = ring_size
+        self.chunk_frames = chunk_frames
+        self._active = None
+        # Most recent session, kept after stop() so its directory and counters stay readable
+        self._last = None
+        # Optional camera_recorder.CameraCapture; its frames are recorded alongside every session
+        self.camera = None
+        self._camera_encoder = None
+
+    @property
+    def recording(self) -> bool:
+        return self._active is not None
+
+    @property
+    def session_dir(self) -> Path | None:
+        return None if self._last is None else self._last.session_dir
+
+    @property
+    def frames_written(self) -> int:
+        return 0 if self._last is None else self._last.frames_written
+
+    @property
+    def frames_dropped(self) -> int:
+        return 0 if self._last is None else self._last.frames_dropped
+
+    def _new_session_dir(self) -> Path:
+        now = time.time()
+        day_dir = self.logs_dir / time.strftime("%Y-%m-%d", time.localtime(now))
+        day_dir.mkdir(parents=True, exist_ok=True)
+        name = f'session_{time.strftime("%H-%M-%S", time.localtime(now))}-{int(now * 1000) % 1000:03d}'
+        # Never reuse a directory: a restart in the same millisecond gets a counter suffix
+        for attempt in range(1000):
+            session_dir = day_dir / (name if attempt == 0 else f"{name}_{attempt}")
+            try:
+                session_dir.mkdir()
+            except FileExistsError:
+                continue
+            return session_dir
+        raise FileExistsError(f"No free session directory for {day_dir / name}")
+
+    def start(self, metadata: dict | None = None) -> Path:
+        if self.recording:
+            return self._active.session_dir
+        metadata = {
+            "start_time": time.time(),
+            "fields": {name: [RECORD_DTYPE[name].base.str, list(RECORD_DTYPE[name].shape)] for name in RECORD_DTYPE.names},
+            **(metadata or {}),
+        }
+        session = _Recording(self._new_session_dir(), metadata, self.ring_size, self.chunk_frames)
+        session.write_meta(num_chunks=0)
+        session.thread.start()
+        self._active = self._last = session
+        if self.camera is not None:
+            self._camera_encoder = self.camera.record(session.session_dir / "camera")
+        print(f"Recording session to {session.session_dir}")
+        return session.session_dir
+
+    def stop(self):
+        if not self.recording:
+            return
+        session, self._active = self._active, None
+        # The writer drains what is left in the ring and writes the last chunk and
+        # meta.json on its own thread; joining it here would stall the teleop loop
+        session.stop.set()
+        if self._camera_encoder is not None:
+            # The encoder drains the frames still in the ring; don't hold up the teleop loop for it
+            threading.Thread(target=self._finish_camera, args=(self._camera_encoder, session),
+                             name="camera-finish", daemon=True).start()
+            self._camera_encoder = None
+
+    def wait(self, timeout: float | None = None):
+        '''Blocks until the last session's writer has flushed everything to disk.'''
+        if self._last is not None:
+            self._last.thread.join(timeout)
+
+    @staticmethod
+    def _finish_camera(encoder, session: _Recording):
+        from kscale_vr_teleop.camera_recorder import align_session
+
+        stats = encoder.stop()
+        # Alignment reads the command timestamps, which need the final chunk
+        session.thread.join()
+        alignment = align_session(session.session_dir)
+        offset = alignment["offset_ms_p50"]
+        print(f"Camera: {stats.get('frames', 0)} frames, {stats.get('frames_dropped', 0)} dropped, "
+              f"median command-to-frame offset {'n/a' if offset is None else f'{offset:.1f} ms'}")
+
+    def toggle(self):
+        if self.recording:
+            self.stop()
+        else:
+            self.start()
+
+    @tracing.traced("record")
+    def record(self, **fields):
+        '''
+        Copies one frame into the ring. Keyword names are RECORD_DTYPE fields; missing
+        fields are zeroed.
+        '''
+        session = self._active
+        if session is None:
+            return
+        if session.write_index - session.read_index >= session.ring_size:
+            session.frames_dropped += 1
+            return
+        row = session.write_index % session.ring_size
+        session.ring[row] = 0
+        for name, value in fields.items():
+            session.ring[name][row] = value
+        # Publish the row only after it is fully written
+        session.write_index += 1
+
+
+def load_recording(session_dir, mmap: bool = True, fields=None) -> dict[str, np.ndarray]:
+    '''
+    Loads a recorded session as a dict of column arrays with one row per frame.
+    Chunks are memory-mapped and concatenated per column. fields limits the columns
+    loaded (default: all).
+    '''
+    session_dir = Path(session_dir)
+    meta = json.loads((session_dir / "meta.json").read_text())
+    chunk_dirs = sorted(session_dir.glob("chunk_*"))[:meta["num_chunks"]]
+    mmap_mode = 'r' if mmap else None
+    columns = {}
+    for name in (fields if fields is not None else meta["fields"]):
+        parts = [np.load(d / f"{name}.npy", mmap_mode=mmap_mode) for d in chunk_dirs]
+        if len(parts) == 1:
+            columns[name] = parts[0]
+        elif parts:
+            columns[name] = np.concatenate(parts)
+        else:
+            dtype, shape = meta["fields"][name]
+            columns[name] = np.zeros((0, *shape), dtype=dtype)
+    return columns
@@ -1,18 +1,142 @@
+import time
+process_start = time.perf_counter()
+
+import argparse
 import asyncio
 import json
+import signal
 import websockets
 from typing import Optional
 import logging
-from kscale_vr_teleop.tracking_handler import TrackingHandler
+from kscale_vr_teleop import tracing
 from kscale_vr_teleop._assets import ASSETS_DIR
-from kscale_vr_teleop.jax_ik import RobotInverseKinematics
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-tracking_handler = None
 urdf_path  = str(ASSETS_DIR / "kbot_legless" / "robot.urdf")
-ik_solver = RobotInverseKinematics(urdf_path, ['PRT0001', 'PRT0001_2'], 'base')
+ee_links = ['PRT0001', 'PRT0001_2']
+# Seconds between "warming_up" status messages sent to teleop clients that connect early
+WARMUP_STATUS_INTERVAL = 0.25
+# Frames carrying tracking data; everything else a teleop client sends is a setting or request
+TRACKING_TYPES = ("hand", "controller")
+# Length of a trace capture started with SIGUSR1 (override with --trace-seconds)
+trace_seconds = 10.0
+
+
+class SolverWarmup:
+    """
+    Builds the IK solver (and imports JAX, scipy and the teleop modules) on a background
+    thread so the server can accept connections immediately.
+    """
+    def __init__(self, num_workers: int = 0, ik: str = "jax", reachability: bool = False,
+                 ik_config: Optional[str] = None):
+        self.num_workers = num_workers
+        # "jax" or "numpy" (numeric, RobotInverseKinematics backends) or "geometric" (closed form, GeometricIK)
+        self.ik = ik
+        # Load (or build on first use) the workspace map that out-of-reach targets are projected onto
+        self.use_reachability = reachability
+        self.reachability = None
+        # JSON file of IK weights and tolerances, applied once the solver is built and again on SIGHUP
+        self.ik_config = ik_config
+        self.stage = "starting"
+        self.progress = 0.0
+        self.ready = asyncio.Event()
+        self.error: Optional[str] = None
+        self.stage_times: dict[str, float] = {}
+        self._stage_start = process_start
+        self.ready_time: Optional[float] = None
+        self.ik_solver = None
+        # Optional pool of IK worker processes; when set, each teleop client gets a pinned session
+        self.ik_pool = None
+        self.tracking_handler_cls = None
+
+    def _set_stage(self, stage: str, progress: float):
+        now = time.perf_counter()
+        self.stage_times[self.stage] = now - self._stage_start
+        self._stage_start = now
+        self.stage = stage
+        self.progress = progress
+
+    def _build(self):
+        self._set_stage("importing", 0.05)
+        import numpy as np
+        from kscale_vr_teleop.tracking_handler import TrackingHandler
+        self.tracking_handler_cls = TrackingHandler
+
+        if self.num_workers > 0:
+            from kscale_vr_teleop.ik_worker_pool import IKWorkerPool
+            self._set_stage("starting_workers", 0.2)
+            ik_pool = IKWorkerPool(urdf_path, ee_links, 'base', num_workers=self.num_workers)
+            ik_pool.start()
+            self.ik_pool = ik_pool
+        elif self.ik == "geometric":
+            from kscale_vr_teleop.geometric_ik import GeometricIK
+            self._set_stage("loading_solver", 0.2)
+            self.ik_solver = GeometricIK(urdf_path, ee_links, 'base')
+        else:
+            from kscale_vr_teleop.jax_ik import RobotInverseKinematics
+            self._set_stage("loading_solver", 0.2)
+            ik_solver = RobotInverseKinematics(urdf_path, ee_links, 'base', backend=self.ik)
+            # Trace and compile FK and IK now instead of on the first tracking frame
+            self._set_stage("compiling", 0.8)
+            targets = np.asarray(ik_solver.forward_kinematics(ik_solver.last_solution))
+            np.asarray(ik_solver.inverse_kinematics(targets))
+            self.ik_solver = ik_solver
+        if self.ik_config is not None:
+            self.load_ik_config()
+        if self.use_reachability:
+            from kscale_vr_teleop.reachability import ReachabilityMap
+            self._set_stage("loading_reachability", 0.9)
+            self.reachability = ReachabilityMap.load_or_build(urdf_path, ee_links)
+        if self.ik_solver is not None and self.ik != "geometric":
+            # Any JAX trace or compile from here on is a cache miss on the hot path
+            from kscale_vr_teleop.jax_ik import compile_stats
+            compile_stats.warmed_up()
+        self._set_stage("ready", 1.0)
+
+    async def run(self):
+        try:
+            await asyncio.to_thread(self._build)
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+            logger.exception("IK solver warm-up failed")
+            return
+        self.ready_time = time.perf_counter() - process_start
+        stages = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.stage_times.items())
+        logger.info(f"IK solver ready {self.ready_time:.2f}s after start ({stages})")
+        self.ready.set()
+
+    def status(self) -> dict:
+        if self.error is not None:
+            return {"type": "status", "status": "error", "error": self.error}
+        if self.ready.is_set():
+            return {"type": "status", "status": "ready", "startup_s": self.ready_time}
+        return {"type": "status", "status": "warming_up", "stage": self.stage, "progress": self.progress}
+
+    def load_ik_config(self) -> dict:
+        '''Reads the --ik-config file into the shared solver. Returns the settings now in effect.'''
+        with open(self.ik_config) as f:
+            config = json.load(f)
+        settings = self.ik_solver.configure(config.get("weights"), config.get("tolerances"))
+        logger.info(f"IK config from {self.ik_config}: {settings}")
+        return settings
+
+    def new_solver(self):
+        return self.ik_pool.session() if self.ik_pool is not None else self.ik_solver
+
+    def close(self):
+        if self.ik_pool is not None:
+            self.ik_pool.close()
+
+
+warmup = SolverWarmup()
+# Optional camera_recorder.CameraCapture recorded alongside every teleop session
+camera = None
+# Send UnifiedCommander frames to command_demux instead of Commander16 datagrams
+unified_commands = False
+# MotionPredictor options for every teleop session ({"horizon": seconds or None, "robot_latency": seconds}), or None
+prediction = None
 
 class SimpleConnection:
     def __init__(self):
@@ -139,15 +263,43 @@ async def handle_app(websocket, robot_ip: str):
                 connection.app_ws = None
                 connection.robot_ws = None
 
-async def handle_teleop(websocket):
+async def wait_for_solver(websocket) -> Optional[list]:
+    """
+    Reports warm-up progress to a teleop client until the IK solver is ready. Tracking
+    frames received meanwhile are dropped so the client does not start with a backlog;
+    other messages (feedback_config, recording, ...) are returned to be applied once the
+    session starts. Returns None if the solver failed to build.
+    """
+    held = []
+    while not warmup.ready.is_set():
+        await websocket.send(json.dumps(warmup.status()))
+        if warmup.error is not None:
+            return None
+        try:
+            message = await asyncio.wait_for(websocket.recv(), timeout=WARMUP_STATUS_INTERVAL)
+        except asyncio.TimeoutError:
+            continue
+        try:
+            data = json.loads(message)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(data, dict) and data.get("type") not in TRACKING_TYPES:
+            held.append(data)
+    await websocket.send(json.dumps(warmup.status()))
+    return held
+
+async def handle_teleop(websocket, tracking_handler, held: list = ()):
     """Handle teleop connection - forwards messages over UDP"""
-    global tracking_handler
     tracking_handler.teleop_core.reset_to_home()
     try:
+        # Settings the client sent while the solver was warming up
+        for data in held:
+            await tracking_handler.handle_tracking(data)
         async for message in websocket:
             try:
                 # Parse the incoming message
-                data = json.loads(message)
+                with tracing.span("decode"):
+                    data = json.loads(message)
                 await tracking_handler.handle_tracking(data)
 
                 logger.debug(f"Forwarded teleop message to UDP ")
@@ -157,11 +309,49 @@ async def handle_teleop(websocket):
                 
     except websockets.ConnectionClosed:
         logger.info(f"Teleop client for robot disconnected")
+    finally:
+        tracking_handler.teleop_core.feedback.stop()
+        tracking_handler.teleop_core.clock_sync.stop()
+        latency = tracking_handler.teleop_core.motion_latency.summary()
+        if latency["n"] > 0:
+            logger.info(f"Session motion-to-UDP latency: {latency}")
+        tracking_handler.teleop_core.recorder.stop()
+        if warmup.ik_pool is not None:
+            tracking_handler.teleop_core.ik_solver.close()
+
+def start_trace(seconds: float) -> Optional[str]:
+    path = tracing.start_capture(seconds)
+    if path is None:
+        logger.warning("Trace capture already running")
+        return None
+    logger.info(f"Capturing a {seconds:g}s trace to {path}")
+    return str(path)
+
+def reload_ik_config():
+    if warmup.ik_config is None or not warmup.ready.is_set() or warmup.ik_solver is None:
+        logger.warning("No IK config to reload")
+        return
+    try:
+        warmup.load_ik_config()
+    except (OSError, ValueError, TypeError) as e:
+        logger.error(f"Could not reload IK config {warmup.ik_config}: {e}")
+
+async def handle_control(websocket, data: dict):
+    """One-shot control requests, e.g. {"role": "control", "action": "trace", "seconds": 10}"""
+    action = data.get("action")
+    if action == "trace":
+        seconds = float(data.get("seconds", trace_seconds))
+        await websocket.send(json.dumps({"type": "trace", "seconds": seconds, "path": start_trace(seconds)}))
+    elif action in ("ik_config", "ik_stats") and warmup.ik_solver is not None and warmup.ready.is_set():
+        from kscale_vr_teleop.tracking_handler import configure_ik, ik_stats
+        reply = configure_ik(warmup.ik_solver, data) if action == "ik_config" else ik_stats(warmup.ik_solver)
+        await websocket.send(json.dumps(reply))
+    else:
+        await websocket.send(json.dumps({"type": "error", "error": "Invalid action"}))
 
 async def handler(websocket):
     """Route connections based on role"""
     try:
-        global tracking_handler
         # Wait for initial message to determine role
         logger.info(f"New connection, Waiting for initial message")
         initial_msg = await websocket.recv()
@@ -173,8 +363,19 @@ async def handler(websocket):
         if role == "app":
             await handle_app(websocket, robot_ip)
         elif role == "teleop":
-            tracking_handler = TrackingHandler(websocket, udp_host=robot_ip, ik_solver=ik_solver)
-            await handle_teleop(websocket)
+            held = await wait_for_solver(websocket)
+            if held is None:
+                return
+            tracking_handler = warmup.tracking_handler_cls(websocket, udp_host=robot_ip, ik_solver=warmup.new_solver(),
+                                                          unified_commands=unified_commands)
+            tracking_handler.teleop_core.recorder.camera = camera
+            tracking_handler.teleop_core.reachability = warmup.reachability
+            if prediction is not None:
+                from kscale_vr_teleop.motion_prediction import MotionPredictor
+                tracking_handler.teleop_core.predictor = MotionPredictor(**prediction)
+            await handle_teleop(websocket, tracking_handler, held)
+        elif role == "control":
+            await handle_control(websocket, data)
         else:
             await websocket.send(json.dumps({"type": "error", "error": "Invalid role"}))
             
@@ -184,14 +385,68 @@ async def handler(websocket):
         logger.error("Invalid JSON in initial message")
 
 async def main():
+    global warmup, camera, unified_commands, trace_seconds, prediction
+    parser = argparse.ArgumentParser(description="Signaling and teleop server")
+    parser.add_argument("--ik-workers", type=int, default=0,
+                        help="Number of IK worker processes (0 solves in the server process)")
+    parser.add_argument("--ik", choices=["jax", "numpy", "geometric"], default="jax",
+                        help="IK solver: numeric least squares with the JAX or NumPy kinematics backend, "
+                             "or closed-form geometric (NumPy, no compile step)")
+    parser.add_argument("--reachability", action="store_true",
+                        help="Project out-of-reach targets into the arm workspace before IK (the map is built once and cached)")
+    parser.add_argument("--ik-config", type=str, default=None,
+                        help="JSON file of IK residual weights and solver tolerances, "
+                             '{"weights": {"orientation": 0.1, ...}, "tolerances": {"xtol": 1e-4, ...}}; reloaded on SIGHUP')
+    parser.add_argument("--predict", type=str, default=None, metavar="MS|auto",
+                        help="Extrapolate wrist targets by this many milliseconds before IK to hide latency, or 'auto' "
+                             "for the measured motion-to-UDP latency plus --robot-latency-ms")
+    parser.add_argument("--robot-latency-ms", type=float, default=0.0,
+                        help="Command-to-motion delay of the robot, added to the measured latency by --predict auto")
+    parser.add_argument("--camera", type=str, default=None,
+                        help="Record this camera with every session: 'synthetic' or an OpenCV device index/path")
+    parser.add_argument("--unified-commands", action="store_true",
+                        help="Send arm and finger commands as one frame per update (run command_demux on the robot)")
+    parser.add_argument("--trace-seconds", type=float, default=trace_seconds,
+                        help="Length of the Chrome trace captured on SIGUSR1 (written to ~/.vr_teleop_logs/traces)")
+    args = parser.parse_args()
+    if args.ik != "jax" and args.ik_workers > 0:
+        parser.error("--ik-workers only applies to the JAX solver")
+    if args.ik_config is not None and args.ik_workers > 0:
+        parser.error("--ik-config cannot be applied to IK worker processes")
+    unified_commands = args.unified_commands
+    if args.predict is not None:
+        try:
+            horizon = None if args.predict == "auto" else float(args.predict) * 1e-3
+        except ValueError:
+            parser.error("--predict takes milliseconds or 'auto'")
+        prediction = {"horizon": horizon, "robot_latency": args.robot_latency_ms * 1e-3}
+    trace_seconds = args.trace_seconds
+    asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, lambda: start_trace(trace_seconds))
+    asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, reload_ik_config)
+    warmup = SolverWarmup(num_workers=args.ik_workers, ik=args.ik, reachability=args.reachability,
+                          ik_config=args.ik_config)
+    if args.camera is not None:
+        from kscale_vr_teleop.camera_recorder import CameraCapture, make_source
+        camera = CameraCapture(make_source(args.camera))
+        camera.start()
+    warmup_task = asyncio.create_task(warmup.run())
+
     server = await websockets.serve(handler, "0.0.0.0", 8013, ping_interval=10, ping_timeout=300)
-    logger.info(f"Simple Robot-App signaling server running on ws://0.0.0.0:8013")
+    logger.info(f"Simple Robot-App signaling server running on ws://0.0.0.0:8013 "
+                f"({time.perf_counter() - process_start:.2f}s after start)")
     logger.info("Supports one app and one robot connection")
-    
+    if args.ik_workers > 0:
+        logger.info(f"Starting {args.ik_workers} IK worker processes in the background")
+
     try:
         await server.wait_closed()
     except KeyboardInterrupt:
         logger.info("Server shutting down...")
+    finally:
+        await warmup_task
+        warmup.close()
+        if camera is not None:
+            camera.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -1,18 +1,49 @@
 import numpy as np
-import json
 import time
 import math
 
-from line_profiler import profile
+from kscale_vr_teleop import tracing
 
-from kscale_vr_teleop.command_conn import Commander16
+from kscale_vr_teleop.clock_sync import ClockSync, LatencyStats
+from kscale_vr_teleop.command_conn import Commander16, UnifiedCommander
+from kscale_vr_teleop.ik_worker_pool import IKPoolSession, IKWorkerError
+from kscale_vr_teleop.kinematics_feedback import KinematicsFeedback
+from kscale_vr_teleop.session_recorder import SessionRecorder
 from kscale_vr_teleop.hand_inverse_kinematics import calculate_hand_joints_no_ik
 
+# Seconds between motion-to-command latency reports in the server log
+LATENCY_REPORT_INTERVAL = 10.0
+# Seconds between updates of the motion prediction horizon from the measured latency
+PREDICTION_LATENCY_INTERVAL = 1.0
+
+def home_position() -> np.ndarray:
+    '''
+    Home arm configuration in IK joint order (see TeleopCore.reset_to_home).
+    '''
+    home = np.zeros(10, dtype=np.float32)
+    home[1] = math.radians(-10.0)  # Right shoulder roll
+    home[3] = math.radians(90.0)   # Right elbow pitch
+    home[6] = math.radians(10.0)   # Left shoulder roll
+    home[8] = math.radians(-90.0)  # Left elbow pitch
+    return home
+
 class TeleopCore:
-    def __init__(self, websocket, udp_host, udp_port, ik_solver):
-        self.kinfer_command_handler = Commander16(udp_ip=udp_host, udp_port=udp_port)
+    def __init__(self, websocket, udp_host, udp_port, ik_solver, unified_commands: bool = False):
+        # Unified frames also carry the finger angles, for command_demux on the robot
+        self.unified_commands = unified_commands
+        if unified_commands:
+            self.kinfer_command_handler = UnifiedCommander(udp_ip=udp_host, udp_port=udp_port)
+        else:
+            self.kinfer_command_handler = Commander16(udp_ip=udp_host, udp_port=udp_port)
         self.websocket = websocket
         self.ik_solver = ik_solver
+        self.feedback = KinematicsFeedback(websocket)
+        self.recorder = SessionRecorder()
+        # Headset clock estimate and the capture-to-UDP-send latency of every command sent
+        self.clock_sync = ClockSync(websocket)
+        self.motion_latency = LatencyStats()
+        self.capture_time = None
+        self._last_latency_report = time.perf_counter()
 
         self.base_to_head_transform = np.eye(4)
         self.base_to_head_transform[:3,3] = np.array([0, 0, 0.25])
@@ -30,7 +61,19 @@ class TeleopCore:
         self.left_joystick_y = 0.0
 
         self.use_fingers = False
+        self.last_distances = (0.0, 0.0)
+        self.frame_id = None
+        self.right_finger_poses = np.tile(np.eye(4, dtype=np.float32), (24, 1, 1))
+        self.left_finger_poses = np.tile(np.eye(4, dtype=np.float32), (24, 1, 1))
         self.converged = False
+        # Optional reachability.ReachabilityMap: out-of-reach targets are moved into the
+        # workspace before IK, and reach_offsets says how far (metres, right and left)
+        self.reachability = None
+        self.reach_offsets = (0.0, 0.0)
+        # Optional motion_prediction.MotionPredictor: wrist targets are extrapolated by the
+        # pipeline latency before IK so the robot arrives where the hand is, not where it was
+        self.predictor = None
+        self._last_prediction_update = time.perf_counter()
         
         # Track message timing to detect gaps (unpause)
         self.last_message_time = None
@@ -61,15 +104,9 @@ class TeleopCore:
         8: dof_left_elbow_02
         9: dof_left_wrist_00
         """
-        home_position = np.zeros(10, dtype=np.float32)
-        home_position[1] = math.radians(-10.0)  # Right shoulder roll
-        home_position[3] = math.radians(90.0)   # Right elbow pitch
-        home_position[6] = math.radians(10.0)   # Left shoulder roll
-        home_position[8] = math.radians(-90.0)  # Left elbow pitch
-        
-        # Set the IK solver's last solution to home position
-        import jax.numpy as jnp
-        self.ik_solver.last_solution = jnp.array(home_position)
+        # Set the IK solver's last solution to home position. A NumPy seed works for every
+        # backend and keeps the geometric one from importing JAX on the event loop.
+        self.ik_solver.last_solution = home_position().astype(np.float64)
 
     def update_joints(self, side: str, fingers: np.ndarray):
         if side == 'left':
@@ -111,6 +148,28 @@ class TeleopCore:
         
         self.last_message_time = current_time
     
+    def latency_summary(self) -> dict:
+        return {"motion_to_udp": self.motion_latency.summary(), "clock": self.clock_sync.summary()}
+
+    def _report_latency(self):
+        now = time.perf_counter()
+        if now - self._last_latency_report < LATENCY_REPORT_INTERVAL:
+            return
+        self._last_latency_report = now
+        stats = self.motion_latency.summary()
+        clock = self.clock_sync.summary()
+        print(f"Motion-to-UDP latency: p50 {stats['p50_ms']:.1f} ms, p90 {stats['p90_ms']:.1f} ms, "
+              f"p99 {stats['p99_ms']:.1f} ms (n={stats['n']}, clock ±{clock['rtt_min_ms'] / 2:.1f} ms)")
+
+    def _update_prediction_latency(self):
+        if self.predictor is None:
+            return
+        now = time.perf_counter()
+        if now - self._last_prediction_update < PREDICTION_LATENCY_INTERVAL:
+            return
+        self._last_prediction_update = now
+        self.predictor.set_measured_latency(float(np.median(self.motion_latency.values())))
+
     def _compute_gripper_from_fingers(self):
         '''
         Map finger spacing to gripper joint positions
@@ -129,23 +188,50 @@ class TeleopCore:
     
         return self.right_gripper_value * 0.9, self.left_gripper_value * 0.9  
 
-    @profile
+    @tracing.traced()
     async def compute_and_send_joints(self):
         '''
         Peforms IK on left_wrist_pose and right_writst_pose.
         Updates all the commands in the kinfer_command_handler.
-        Sends kinematics info back to client, including joint angles and error distance.
+        Publishes kinematics info for the client, including joint angles and error distance.
         '''
-        hand_target_left = self.base_to_head_transform @ self.left_wrist_pose
-        hand_target_right = self.base_to_head_transform @ self.right_wrist_pose
+        start_time = time.perf_counter()
+        right_wrist_pose, left_wrist_pose = self.right_wrist_pose, self.left_wrist_pose
+        if self.predictor is not None:
+            with tracing.span("prediction"):
+                # Headset capture time when the client sends it, so network jitter does not look like motion
+                frame_time = self.capture_time * 1e-3 if self.capture_time is not None else start_time
+                right_wrist_pose, left_wrist_pose = self.predictor.predict(frame_time, right_wrist_pose, left_wrist_pose)
+        hand_target_left = self.base_to_head_transform @ left_wrist_pose
+        hand_target_right = self.base_to_head_transform @ right_wrist_pose
 
         hand_target_left[2, 3] = max(hand_target_left[2, 3], -0.25)
         hand_target_right[2, 3] = max(hand_target_right[2, 3], -0.25)
+        ik_targets = np.array([hand_target_right, hand_target_left])
+        if self.reachability is not None:
+            # Give the solver a target it can reach instead of one it can only fail to converge on
+            with tracing.span("reachability"):
+                ik_targets, offsets = self.reachability.project(ik_targets)
+            self.reach_offsets = (float(offsets[0]), float(offsets[1]))
+        else:
+            self.reach_offsets = (0.0, 0.0)
         
         # Compute inverse kinematics
-        joints = self.ik_solver.inverse_kinematics(np.array([hand_target_right, hand_target_left]))
-        # Convert JAX array to NumPy for faster slicing operations
-        joints = np.asarray(joints)
+        if isinstance(self.ik_solver, IKPoolSession):
+            # Solved in a worker process, which also returns the forward kinematics
+            with tracing.span("ik_pool"):
+                try:
+                    joints, actual_poses = await self.ik_solver.solve(ik_targets)
+                except IKWorkerError as e:
+                    # Skip the frame; the next solve goes to a live worker
+                    print(f"IK solve failed, frame skipped: {e}")
+                    return
+        else:
+            with tracing.span("ik"):
+                joints = self.ik_solver.inverse_kinematics(ik_targets)
+                # Convert JAX array to NumPy for faster slicing operations
+                joints = np.asarray(joints)
+            actual_poses = None
         left_arm_joints = joints[5:]
         right_arm_joints = joints[:5]
 
@@ -156,7 +242,8 @@ class TeleopCore:
 
         # Compute finger joint angles (6 per hand: thumb_metacarpal + thumb + 4 fingers)
         if self.use_fingers:
-            left_finger_angles, right_finger_angles = calculate_hand_joints_no_ik(self.left_finger_poses, self.right_finger_poses)
+            with tracing.span("finger_angles"):
+                left_finger_angles, right_finger_angles = calculate_hand_joints_no_ik(self.left_finger_poses, self.right_finger_poses)
         else:
             left_finger_angles = np.zeros(6, dtype=np.float32)
             right_finger_angles = np.zeros(6, dtype=np.float32)
@@ -170,40 +257,26 @@ class TeleopCore:
 
         # Compute actual end effector poses using forward kinematics
         # Combine right and left arm joints (5 each) into the expected 10-element array
-        all_joint_angles = np.concatenate([right_arm_joints, left_arm_joints])
-        actual_poses = self.ik_solver.forward_kinematics(all_joint_angles)
+        if actual_poses is None:
+            all_joint_angles = np.concatenate([right_arm_joints, left_arm_joints])
+            with tracing.span("fk"):
+                actual_poses = np.asarray(self.ik_solver.forward_kinematics(all_joint_angles))
         
         # Extract actual poses for right and left arms
         actual_right_pose = actual_poses[0]  # First end effector (right arm)
         actual_left_pose = actual_poses[1]   # Second end effector (left arm)
         
-        # Calculate distances between target and actual positions
+        # Calculate distances between target and actual positions. They include how far a target
+        # was out of reach, which is what the headset shows the operator.
         right_distance = np.linalg.norm(hand_target_right[:3, 3] - actual_right_pose[:3, 3])
         left_distance = np.linalg.norm(hand_target_left[:3, 3] - actual_left_pose[:3, 3])
+        self.last_distances = (float(right_distance), float(left_distance))
         
-        payload = {
-            "type": "kinematics",
-            "joysticks": {
-                "right":{
-                    "x": self.right_joystick_x, 
-                    "y": self.right_joystick_y
-                },
-                "left": {
-                    "x": self.left_joystick_x,
-                    "y": self.left_joystick_y
-                }
-            },
-            "joints": {
-                "right": right_arm_joints.tolist(), 
-                "left": left_arm_joints.tolist()
-            },
-            "distances": {
-                "right": float(right_distance),
-                "left": float(left_distance)
-            }
-        }
         self._check_message_timing()
-        if (right_distance < 0.05 and left_distance < 0.05):
+        motion_to_udp = np.nan
+        # Convergence is judged against the targets the solver was given
+        if (np.linalg.norm(ik_targets[0, :3, 3] - actual_right_pose[:3, 3]) < 0.05
+                and np.linalg.norm(ik_targets[1, :3, 3] - actual_left_pose[:3, 3]) < 0.05):
             self.converged = True
         if self.converged:
             self.kinfer_command_handler.update_commands (
@@ -212,8 +285,44 @@ class TeleopCore:
                 (self.right_joystick_x, self.right_joystick_y),
                 (self.left_joystick_x, self.left_joystick_y)
                 )
-            await self.websocket.send(json.dumps(payload))
+            if self.unified_commands:
+                self.kinfer_command_handler.update_fingers(right_finger_angles, left_finger_angles)
             self.kinfer_command_handler.send_commands()
+            if self.capture_time is not None and self.clock_sync.synchronized:
+                motion_to_udp = time.perf_counter() - self.clock_sync.to_server_time(self.capture_time)
+                self.motion_latency.add(motion_to_udp)
+                self._report_latency()
+                self._update_prediction_latency()
+            # Feedback goes out from its own task at the client's rate, after the command is sent
+            self.feedback.publish(
+                right_arm_joints,
+                left_arm_joints,
+                (self.right_joystick_x, self.right_joystick_y),
+                (self.left_joystick_x, self.left_joystick_y),
+                right_distance,
+                left_distance,
+                self.frame_id,
+                self.reach_offsets,
+            )
+
+        if self.recorder.recording:
+            self.recorder.record(
+                timestamp=time.time(),
+                compute_time=time.perf_counter() - start_time,
+                wrist_poses=(self.right_wrist_pose, self.left_wrist_pose),
+                ik_targets=ik_targets,
+                reach_offsets=self.reach_offsets,
+                finger_poses=(self.right_finger_poses, self.left_finger_poses),
+                use_fingers=self.use_fingers,
+                joints=joints,
+                distances=(right_distance, left_distance),
+                grippers=(right_gripper_joint, left_gripper_joint),
+                finger_angles=(right_finger_angles, left_finger_angles),
+                joysticks=((self.right_joystick_x, self.right_joystick_y), (self.left_joystick_x, self.left_joystick_y)),
+                converged=self.converged,
+                motion_to_udp=motion_to_udp,
+                prediction_gains=self.predictor.gains if self.predictor is not None else (0.0, 0.0),
+            )
 
         
 
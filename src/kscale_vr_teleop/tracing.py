@@ -0,0 +1,214 @@
+"""
+Low-overhead tracing with on-demand Chrome/Perfetto trace capture.
+
+Code is instrumented with ``span`` context managers and the ``traced`` decorator.
+While no capture is running they return a shared no-op object after a single
+global check, so instrumentation can stay in the hot path. A capture records
+every span for N seconds and writes a Chrome trace event JSON file that opens
+in https://ui.perfetto.dev or chrome://tracing.
+
+Spans opened inside an asyncio task are put on a track per task, so interleaved
+coroutines show up side by side instead of as broken nesting on one thread.
+
+    with tracing.span("ik"):
+        joints = solver.inverse_kinematics(targets)
+
+    @tracing.traced()
+    async def handle_tracking(self, event): ...
+
+    tracing.start_capture(10)   # also: SIGUSR1 or {"type": "trace"} on the teleop/control WebSocket
+"""
+import asyncio
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+DEFAULT_TRACE_DIR = Path('~/.vr_teleop_logs/traces').expanduser()
+# Spans kept per capture; later spans are counted but dropped so a long capture cannot exhaust memory.
+# At the teleop loop's few hundred spans per second this is several minutes, and writes in well under a second.
+MAX_EVENTS = 200_000
+# Events serialized per json.dumps call when writing. The C encoder holds the GIL for a whole call,
+# so small batches (well under a millisecond each) keep the event loop running during the write.
+WRITE_BATCH = 256
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class TraceCapture:
+    '''
+    Collects complete ("X") trace events until stopped, then writes them as JSON.
+    '''
+    def __init__(self, path: Path, max_events: int = MAX_EVENTS):
+        self.path = Path(path)
+        self.max_events = max_events
+        self.events = []
+        self.dropped = 0
+        self.start_time = time.perf_counter()
+        self.pid = os.getpid()
+        self._track_names: dict[int, str] = {}
+        self._task_tracks: dict[int, int] = {}
+        self._lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+
+    def track(self) -> int:
+        '''Track id for the caller: its asyncio task if it has one, else its thread.'''
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        if task is None:
+            tid = threading.get_ident()
+            if tid not in self._track_names:
+                self._track_names[tid] = threading.current_thread().name
+            return tid
+        key = id(task)
+        tid = self._task_tracks.get(key)
+        if tid is None:
+            with self._lock:
+                # Thread idents are large, so small numbers cannot clash with them
+                tid = self._task_tracks.setdefault(key, len(self._task_tracks) + 1)
+                self._track_names[tid] = f"task {task.get_name()}"
+        return tid
+
+    def add(self, name: str, start: float, end: float, tid: int, args: Optional[dict] = None):
+        if len(self.events) >= self.max_events:
+            self.dropped += 1
+            return
+        event = {"name": name, "ph": "X", "ts": (start - self.start_time) * 1e6, "dur": (end - start) * 1e6,
+                 "pid": self.pid, "tid": tid}
+        if args:
+            event["args"] = args
+        self.events.append(event)
+
+    def write(self) -> Path:
+        # Spans that were open when the capture stopped may still append; write a snapshot
+        events = list(self.events)
+        metadata = [{"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid, "args": {"name": name}}
+                    for tid, name in self._track_names.items()]
+        metadata.append({"name": "process_name", "ph": "M", "pid": self.pid, "args": {"name": "kscale_vr_teleop"}})
+        other = {"dropped_events": self.dropped, "duration_s": time.perf_counter() - self.start_time}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        with open(tmp, "w") as f:
+            f.write('{"displayTimeUnit": "ms", "otherData": %s, "traceEvents": [' % json.dumps(other))
+            f.write(json.dumps(metadata)[1:-1])
+            for first in range(0, len(events), WRITE_BATCH):
+                f.write(",")
+                f.write(json.dumps(events[first:first + WRITE_BATCH])[1:-1])
+                # Hand the GIL back between batches
+                time.sleep(0)
+            f.write("]}")
+        os.replace(tmp, self.path)
+        return self.path
+
+
+# The running capture, or None. Checked once per span; everything else only runs while capturing.
+_capture: Optional[TraceCapture] = None
+_capture_lock = threading.Lock()
+
+
+class _Span:
+    __slots__ = ("capture", "name", "args", "start", "tid")
+
+    def __init__(self, capture: TraceCapture, name: str, args: Optional[dict]):
+        self.capture = capture
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.tid = self.capture.track()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.capture.add(self.name, self.start, time.perf_counter(), self.tid, self.args)
+        return False
+
+
+def span(name: str, args: Optional[dict] = None):
+    '''
+    Context manager timing a block as one trace event, or a shared no-op when not capturing.
+    '''
+    capture = _capture
+    if capture is None:
+        return _NULL_SPAN
+    return _Span(capture, name, args)
+
+
+def traced(name: Optional[str] = None):
+    '''
+    Decorator putting every call of a function (sync or async) in a span named after it.
+    '''
+    def decorator(fn):
+        span_name = name or fn.__qualname__
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                if _capture is None:
+                    return await fn(*args, **kwargs)
+                with span(span_name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _capture is None:
+                return fn(*args, **kwargs)
+            with span(span_name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def capturing() -> bool:
+    return _capture is not None
+
+
+def start_capture(seconds: float, path=None, trace_dir=DEFAULT_TRACE_DIR) -> Optional[Path]:
+    '''
+    Starts recording spans and writes the trace after seconds (on a timer thread).
+    Returns the file the trace will be written to, or None if a capture is already running.
+    '''
+    global _capture
+    with _capture_lock:
+        if _capture is not None:
+            return None
+        if path is None:
+            # Milliseconds too, so back-to-back captures do not overwrite each other
+            path = Path(trace_dir) / f'trace_{time.strftime("%Y-%m-%d_%H-%M-%S")}_{int(time.time() * 1000) % 1000:03d}.json'
+        capture = TraceCapture(path)
+        capture._timer = threading.Timer(seconds, stop_capture)
+        capture._timer.daemon = True
+        _capture = capture
+    capture._timer.start()
+    return capture.path
+
+
+def stop_capture() -> Optional[Path]:
+    '''
+    Ends the running capture early (or on its timer) and writes it. Returns the file written.
+    '''
+    global _capture
+    with _capture_lock:
+        capture, _capture = _capture, None
+    if capture is None:
+        return None
+    if capture._timer is not None:
+        capture._timer.cancel()
+    return capture.write()
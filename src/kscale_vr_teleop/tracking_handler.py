@@ -1,7 +1,12 @@
+import json
+import time
+
 import numpy as np
 from scipy.spatial.transform import Rotation
 
+from kscale_vr_teleop import tracing
 from kscale_vr_teleop.util import fast_mat_inv
+from kscale_vr_teleop.command_conn import UNIFIED_PORT
 from kscale_vr_teleop.teleop_core import TeleopCore
 from kscale_vr_teleop.finger_udp_server import FingerUDPHandler
 
@@ -19,12 +24,44 @@ hand_xr_to_urdf_frame = np.array([
     [0, 0, 0, 1]   # Homogeneous coordinate
 ], dtype=np.float32)
 
+# Left controller Y button toggles session recording (X is pause in the frontend)
+RECORD_TOGGLE_SIDE = 'left'
+RECORD_TOGGLE_BUTTON = 5
+
+
+def configure_ik(ik_solver, config: dict) -> dict:
+    '''
+    Applies {"weights": {...}, "tolerances": {...}} to an IK solver that supports it
+    (RobotInverseKinematics, GeometricIK) and returns an "ik_config" or "error" reply.
+    '''
+    if not hasattr(ik_solver, "configure"):
+        return {"type": "error", "error": f"{type(ik_solver).__name__} cannot be configured at runtime"}
+    try:
+        settings = ik_solver.configure(config.get("weights"), config.get("tolerances"))
+    except (TypeError, ValueError) as e:
+        return {"type": "error", "error": str(e)}
+    return {"type": "ik_config", **settings}
+
+
+def ik_stats(ik_solver) -> dict:
+    '''JIT trace/compile counters of the IK solver as an "ik_stats" reply (empty for solvers without JAX).'''
+    stats = ik_solver.jit_stats() if hasattr(ik_solver, "jit_stats") else {}
+    return {"type": "ik_stats", **stats}
+
 class TrackingHandler:
-    def __init__(self, websocket, udp_host, ik_solver=None, udp_port=10000):
+    def __init__(self, websocket, udp_host, ik_solver=None, udp_port=10000, unified_commands=False):
+        '''
+        unified_commands sends arm and finger commands as one frame per update to
+        command_demux on the robot (port UNIFIED_PORT unless udp_port is given).
+        '''
+        if unified_commands and udp_port == 10000:
+            udp_port = UNIFIED_PORT
         self.udp_host = udp_host
         self.udp_port = udp_port
+        self._record_button_pressed = False
 
-        self.teleop_core = TeleopCore(websocket, udp_host, udp_port, ik_solver)
+        self.websocket = websocket
+        self.teleop_core = TeleopCore(websocket, udp_host, udp_port, ik_solver, unified_commands=unified_commands)
         self.finger_server = FingerUDPHandler(udp_host=udp_host, udp_port=10001)
     
     def _handle_target_location(self, tracking_data, side, tracking_type):
@@ -83,21 +120,77 @@ class TrackingHandler:
         
         self.teleop_core.update_buttons(side, gripper_value, joystick_x, joystick_y)
 
+        if side == RECORD_TOGGLE_SIDE:
+            buttons = tracking_data.get('buttons', [])
+            pressed = len(buttons) > RECORD_TOGGLE_BUTTON and bool(buttons[RECORD_TOGGLE_BUTTON])
+            # Toggle on press, not hold
+            if pressed and not self._record_button_pressed:
+                self.teleop_core.recorder.toggle()
+            self._record_button_pressed = pressed
+
+    @tracing.traced()
     async def handle_tracking(self, event):
         '''
         Handles unified tracking data structure.
         Always processes targetLocation, then handles joints (hand) or buttons (controller).
         '''
         tracking_type = event.get("type", None)
+        if tracking_type == "clock_pong":
+            self.teleop_core.clock_sync.on_pong(event["t0"], event["t1"], time.perf_counter())
+            return
+        if tracking_type == "echo":
+            # Answered in order with the tracking frames, for client-side round-trip measurement
+            await self.websocket.send(json.dumps({"type": "echo", "id": event.get("id")}))
+            return
+        if tracking_type == "latency":
+            if event.get("reset"):
+                self.teleop_core.motion_latency.reset()
+            await self.websocket.send(json.dumps({"type": "latency", **self.teleop_core.latency_summary()}))
+            return
+        if tracking_type == "trace":
+            # Chrome trace of the next N seconds; path is null if a capture is already running
+            seconds = float(event.get("seconds", 10.0))
+            path = tracing.start_capture(seconds)
+            await self.websocket.send(json.dumps({"type": "trace", "seconds": seconds,
+                                                  "path": str(path) if path is not None else None}))
+            return
+        if tracking_type == "ik_config":
+            # Live weight/tolerance changes; the reply carries the settings now in effect
+            await self.websocket.send(json.dumps(configure_ik(self.teleop_core.ik_solver, event)))
+            return
+        if tracking_type == "ik_stats":
+            await self.websocket.send(json.dumps(ik_stats(self.teleop_core.ik_solver)))
+            return
+        # Optional client frame id, echoed back in the kinematics feedback as "ack"
+        self.teleop_core.frame_id = event.get("id", None)
+        # Optional headset capture time (performance.now() ms); starts clock sync on first use
+        self.teleop_core.capture_time = event.get("t", None)
+        if self.teleop_core.capture_time is not None:
+            self.teleop_core.clock_sync.start()
+
+        if tracking_type == "feedback_config":
+            self.teleop_core.feedback.configure(event.get("rate"), event.get("format"), event.get("delta"),
+                                                event.get("links"))
+            return
+        if tracking_type == "recording":
+            action = event.get("action", "toggle")
+            if action == "start":
+                self.teleop_core.recorder.start()
+            elif action == "stop":
+                self.teleop_core.recorder.stop()
+            else:
+                self.teleop_core.recorder.toggle()
+            return
         
-        for side in ["left", "right"]:
-            tracking_data = event.get(side, None)
-            if tracking_data is not None:
-                self._handle_target_location(tracking_data, side, tracking_type)
-                self._handle_buttons(tracking_data, side)      
-                self._handle_joints(tracking_data, side)
+        with tracing.span("tracking_input"):
+            for side in ["left", "right"]:
+                tracking_data = event.get(side, None)
+                if tracking_data is not None:
+                    self._handle_target_location(tracking_data, side, tracking_type)
+                    self._handle_buttons(tracking_data, side)      
+                    self._handle_joints(tracking_data, side)
 
         await self.teleop_core.compute_and_send_joints()
 
-        # Send finger commands via new UDP server
+        # Send finger commands via new UDP server (unified command frames already carry them)
         # self.finger_server.send_finger_commands(right_finger_angles, left_finger_angles)
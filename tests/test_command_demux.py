@@ -0,0 +1,59 @@
+import json
+import unittest
+
+from kscale_vr_teleop.command_conn import UnifiedCommander
+from kscale_vr_teleop.command_demux import CommandDemux
+
+
+def frame(seq: int, session=None) -> bytes:
+    data = {"seq": seq, "commands": {}, "right_fingers": [0.0] * 6, "left_fingers": [0.0] * 6}
+    if session is not None:
+        data["session"] = session
+    return json.dumps(data).encode("utf-8")
+
+
+class CommandDemuxTest(unittest.TestCase):
+    def setUp(self):
+        # Forwarded datagrams go to ports nobody listens on
+        self.demux = CommandDemux(udp_host="127.0.0.1", udp_port=0, kinfer_port=9, finger_port=9, report_interval=0)
+        self.demux._udp_sock.settimeout(1.0)
+        self.port = self.demux._udp_sock.getsockname()[1]
+
+    def tearDown(self):
+        self.demux._udp_sock.close()
+        self.demux._out_sock.close()
+
+    def test_stale_and_lost(self):
+        source = ("10.0.0.2", 5000)
+        self.assertTrue(self.demux.demux(frame(1, 7), source))
+        self.assertTrue(self.demux.demux(frame(4, 7), source))
+        self.assertFalse(self.demux.demux(frame(3, 7), source))
+        self.assertFalse(self.demux.demux(frame(4, 7), source))
+        self.assertEqual((self.demux.lost, self.demux.stale), (2, 2))
+
+    def test_reconnect(self):
+        # A headset reconnect builds a new commander (new session, new socket) counting from 1 again
+        for _ in range(2):
+            commander = UnifiedCommander("127.0.0.1", self.port)
+            for _ in range(50):
+                commander.send_commands()
+                self.assertTrue(self.demux.process_packet())
+            commander.sock.close()
+        self.assertEqual(self.demux.forwarded, 100)
+        self.assertEqual((self.demux.stale, self.demux.resets), (0, 1))
+
+    def test_new_session_same_source(self):
+        source = ("10.0.0.2", 5000)
+        for seq in range(1, 200):
+            self.demux.demux(frame(seq, 1), source)
+        self.assertTrue(self.demux.demux(frame(1, 2), source))
+        self.assertFalse(self.demux.demux(frame(1, 2), source))
+
+    def test_idle_timeout(self):
+        self.assertTrue(self.demux._accept_seq(100, now=0.0))
+        self.assertFalse(self.demux._accept_seq(1, now=1.0))
+        self.assertTrue(self.demux._accept_seq(1, now=1.0 + self.demux.idle_timeout + 0.1))
+
+
+if __name__ == "__main__":
+    unittest.main()